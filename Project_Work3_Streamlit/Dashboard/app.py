@@ -2,37 +2,22 @@ import streamlit as st
 import pandas as pd
 import pickle # Mantenuto per completezza
 
+from core import perf
+from core.sensors import SENSORS_DIR, SensorStore
+from core.data import MODEL_PATH
+from core.refresh import dashboard_managers
+
 # --- CONFIGURAZIONE E CARICAMENTO DATI ---
 DATA_PATH = 'dataset/cleaned_data.csv' 
 
-@st.cache_data
 def load_data():
     """
-    Carica il dataset già pulito dal file CSV.
-    Include la conversione dei tipi di dato.
+    Carica il dataset già pulito dal dataset condiviso (core/shared_dataset.py):
+    file Arrow in memory-map, comune a tutte le sessioni e le repliche. In sola lettura.
+    La versione aggiornata del CSV viene preparata in background (core/refresh.py).
     """
     try:
-        # Carica il CSV
-        df = pd.read_csv(DATA_PATH)
-        
-        # L'unica trasformazione necessaria è la conversione del timestamp
-        df['date_time'] = pd.to_datetime(df['date_time'])
-        
-        # Ordiniamo per sicurezza cronologica
-        df = df.sort_values('date_time')
-        
-        # Conversione dei tipi per le colonne già presenti nel CSV, assicurando siano interi
-        # Questo previene problemi di float in analisi (es. 9.0 anziché 9)
-        if 'day_of_week' in df.columns:
-            df['day_of_week'] = df['day_of_week'].astype('Int64') # Int64 gestisce i NaN se presenti
-        if 'month' in df.columns:
-            df['month'] = df['month'].astype('Int64')
-        if 'hour' in df.columns:
-            df['hour'] = df['hour'].astype('Int64')
-        if 'year' in df.columns:
-             df['year'] = df['year'].astype('Int64')
-        
-        return df
+        return dashboard_managers(DATA_PATH, MODEL_PATH)['dati'].get().value['analisi']
 
     except FileNotFoundError:
         st.error(f"⚠️ Errore: File non trovato in '{DATA_PATH}'. Controlla il nome e la cartella.")
@@ -40,6 +25,15 @@ def load_data():
     except Exception as e:
         st.error(f"Errore nel caricamento: {e}")
         return pd.DataFrame()
+
+
+@st.cache_resource
+def load_sensor_locations():
+    """Coordinate dei sensori del dataset partizionato (vuoto se non esiste)."""
+    try:
+        return SensorStore(SENSORS_DIR).locations()
+    except FileNotFoundError:
+        return pd.DataFrame(columns=['sensor_id', 'name', 'lat', 'lon'])
 # --------------------------------------------------------
 
 
@@ -49,6 +43,7 @@ st.set_page_config(
     page_icon="🚦",
     layout="wide"
 )
+perf.start_run("Home")
 
 
 # --- TITOLO E INTRODUZIONE ---
@@ -81,7 +76,9 @@ with st.container():
 
 # --- CARICAMENTO DATI PER LA HOME ---
 # La funzione load_data ora è definita in questo stesso file
-df = load_data()
+with perf.section('load_data', cached=True) as sec:
+    df = load_data()
+    sec.rows = len(df)
 
 
 if not df.empty:
@@ -91,12 +88,18 @@ if not df.empty:
     col_map, col_info = st.columns([3, 2])
 
     with col_map:
-        map_data = pd.DataFrame({
-            'lat': [44.96],
-            'lon': [-93.20]
-        })
-        st.map(map_data, zoom=10, width='stretch')
-        st.caption("<b>Interstate 94</b> tra Minneapolis e Saint Paul, MN (USA)", unsafe_allow_html=True)
+        # Con il dataset partizionato (python -m core.sensors partition) la mappa mostra tutti i sensori
+        sensor_map = load_sensor_locations()
+        if len(sensor_map) > 1:
+            st.map(sensor_map, zoom=9, width='stretch')
+            st.caption(f"{len(sensor_map)} sensori: " + ", ".join(sensor_map['name']))
+        else:
+            map_data = pd.DataFrame({
+                'lat': [44.96],
+                'lon': [-93.20]
+            })
+            st.map(map_data, zoom=10, width='stretch')
+            st.caption("<b>Interstate 94</b> tra Minneapolis e Saint Paul, MN (USA)", unsafe_allow_html=True)
 
     with col_info:
         st.markdown("#### 📅 Periodo di osservazione")
@@ -110,4 +113,6 @@ if not df.empty:
         
 
 else:
-    st.warning("Caricamento dati in corso... controlla che il file sia nella cartella 'data'.")
\ No newline at end of file
+    st.warning("Caricamento dati in corso... controlla che il file sia nella cartella 'data'.")
+
+perf.end_run()
@@ -0,0 +1 @@
+"""Benchmark headless della dashboard (vedi `run_benchmarks.py`)."""
@@ -0,0 +1,101 @@
+"""
+Fixture per i benchmark: dataset e modello derivati dagli artefatti del Project Work 2.
+
+Se la dashboard ha già `dataset/cleaned_data.csv` e `models/rf_pipeline.pkl`
+vengono usati quelli; altrimenti si ricostruisce la colonna `date_time` dal
+`cleaned_data.csv` del PW2 e si usa la pipeline Ridge serializzata.
+"""
+import os
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from core.data import DATA_PATH, MODEL_PATH, load_pipeline
+
+DASHBOARD_DIR = Path(__file__).resolve().parents[1]
+PW2_DIR = DASHBOARD_DIR.parents[1] / 'Project_Work2_Time_Series'
+PW2_DATA_PATH = PW2_DIR / 'Datasets' / 'cleaned_data.csv'
+PW2_MODEL_PATH = PW2_DIR / 'Models' / 'linear_regression_pipeline.pkl'
+
+# Primo timestamp del dataset originale UCI (martedì 2 ottobre 2012, ore 9)
+FIRST_TIMESTAMP = pd.Timestamp('2012-10-02 09:00:00')
+
+
+def reconstruct_date_time(df, start=FIRST_TIMESTAMP):
+    """
+    Ricostruisce `date_time` dal cleaned_data del PW2 (che ha solo anno/mese/giorno
+    settimana/ora): ogni riga è la prima ora successiva alla precedente con gli
+    stessi campi di calendario. Le righe sono già in ordine cronologico.
+    """
+    year = df['year'].to_numpy(dtype=int)
+    month = df['month'].to_numpy(dtype=int)
+    dow = df['day_of_week'].to_numpy(dtype=int)
+    hour = df['hour'].to_numpy(dtype=int)
+
+    out = np.empty(len(df), dtype='datetime64[ns]')
+    current = start - pd.Timedelta(hours=1)
+    one_hour = pd.Timedelta(hours=1)
+    for i in range(len(df)):
+        current = current + one_hour
+        while (current.year, current.month, current.weekday(), current.hour) != (year[i], month[i], dow[i], hour[i]):
+            current = current + one_hour
+        out[i] = current.to_datetime64()
+    return pd.Series(out, index=df.index, name='date_time')
+
+
+def base_frame():
+    """Dataset (CSV grezzo, come su disco) su cui costruire le fixture."""
+    dashboard_data = DASHBOARD_DIR / DATA_PATH
+    if dashboard_data.exists():
+        return pd.read_csv(dashboard_data, parse_dates=['date_time'])
+    df = pd.read_csv(PW2_DATA_PATH)
+    df.insert(0, 'date_time', reconstruct_date_time(df))
+    return df
+
+
+def scale_frame(df, factor):
+    """
+    Dataset sintetico `factor` volte più grande: il periodo viene replicato in coda, spostando
+    i timestamp di un multiplo di 52 settimane (ogni ora resta nello stesso giorno della
+    settimana e quasi nella stessa data). Le copie intermedie si fermano all'inizio della
+    successiva e le colonne di calendario vengono ricalcolate da `date_time`.
+    """
+    if factor <= 1:
+        return df.copy()
+    start = df['date_time'].min()
+    span = df['date_time'].max() - start + pd.Timedelta(hours=1)
+    year = pd.Timedelta(weeks=52)
+    shift = max(1, span // year) * year
+    copies = []
+    for k in range(int(factor)):
+        part = df if k == int(factor) - 1 else df[df['date_time'] < start + shift]
+        part = part.copy()
+        part['date_time'] = part['date_time'] + shift * k
+        copies.append(set_calendar_columns(part))
+    return pd.concat(copies, ignore_index=True)
+
+
+def set_calendar_columns(df):
+    """Ricalcola ora, giorno della settimana, mese, anno e weekend da `date_time` (stessi dtype)."""
+    dt = df['date_time'].dt
+    values = {'hour': dt.hour, 'day_of_week': dt.dayofweek, 'month': dt.month, 'year': dt.year,
+              'is_weekend': dt.dayofweek >= 5}
+    for col, v in values.items():
+        if col in df.columns:
+            df[col] = v.astype(df[col].dtype)
+    return df
+
+
+def write_csv(df, directory, name='cleaned_data.csv'):
+    """Scrive la fixture su disco (così `load_data` misura anche il parsing del CSV)."""
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, name)
+    df.to_csv(path, index=False)
+    return path
+
+
+def fixture_pipeline():
+    """Pipeline della dashboard se presente, altrimenti la Ridge del PW2."""
+    dashboard_model = DASHBOARD_DIR / MODEL_PATH
+    return load_pipeline(dashboard_model if dashboard_model.exists() else PW2_MODEL_PATH)
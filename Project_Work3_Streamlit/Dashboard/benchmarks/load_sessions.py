@@ -0,0 +1,303 @@
+"""
+Load test delle pagine Streamlit con N sessioni concorrenti, contro un server locale.
+
+Uso (dalla cartella Dashboard, con dataset e modello al loro posto):
+    python -m benchmarks.load_sessions --spawn                      # avvia `streamlit run app.py`, 1/2/4/8 sessioni
+    python -m benchmarks.load_sessions --spawn --sessions 1 4 16 --flows kpi --iterations 3
+    python -m benchmarks.load_sessions --url http://127.0.0.1:8501  # server già avviato (RSS non misurata)
+
+Ogni sessione è un client websocket che parla il protocollo del browser (BackMsg/ForwardMsg):
+chiede il rerun della pagina, legge i widget dai delta e invia i nuovi valori come farebbe il
+frontend. I flussi ripetono i gesti tipici: nella pagina *Analisi & KPI* soglia di congestione,
+intervallo di date, soglia z e direzione delle anomalie (le schede non causano rerun:
+Streamlit le esegue tutte a ogni run); nella pagina *Previsioni* finestra di storico e
+generazione di ogni orizzonte. Per ogni livello di concorrenza: percentili della latenza dei
+rerun, rerun al secondo e memoria residente del processo server.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import websockets
+from streamlit.proto.BackMsg_pb2 import BackMsg
+from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+from streamlit.proto.WidgetStates_pb2 import WidgetState
+
+from benchmarks.fixtures import DASHBOARD_DIR
+from core.forecast import HORIZON_CHOICES
+
+RESULTS_DIR = Path(__file__).resolve().parent / 'results'
+PAGES = {'kpi': 'Analisi&KPI', 'previsioni': 'Previsioni'}
+WIDGET_TYPES = ('slider', 'selectbox', 'radio', 'button', 'multiselect')
+
+
+class Session:
+    """Una sessione del browser: widget visti nell'ultimo run e valori impostati dall'utente."""
+
+    def __init__(self, url, page):
+        self.ws_url = url.replace('http', 'ws', 1).rstrip('/') + '/_stcore/stream'
+        self.page = page
+        self.page_hash = ''
+        self.widgets = {}   # etichetta -> (tipo, proto del widget)
+        self.states = {}    # id -> WidgetState persistente
+        self.ws = None
+
+    async def connect(self):
+        self.ws = await websockets.connect(self.ws_url, subprotocols=['streamlit'], max_size=None)
+
+    async def close(self):
+        await self.ws.close()
+
+    def widget(self, label):
+        for text, (kind, proto) in self.widgets.items():
+            if text.startswith(label):
+                return kind, proto
+        raise LookupError(f'widget non trovato: {label}')
+
+    def set(self, label, value):
+        kind, proto = self.widget(label)
+        state = WidgetState(id=proto.id)
+        if kind == 'slider':
+            state.double_array_value.data.extend(value if isinstance(value, (list, tuple)) else [value])
+        elif kind in ('selectbox', 'radio'):
+            state.string_value = value
+        elif kind == 'multiselect':
+            state.string_array_value.data.extend(value)
+        self.states[proto.id] = state
+
+    async def rerun(self, trigger=None):
+        """Chiede un rerun (con l'eventuale pulsante premuto); restituisce (ms, eccezioni della pagina)."""
+        msg = BackMsg()
+        msg.rerun_script.query_string = ''
+        msg.rerun_script.page_name = self.page
+        msg.rerun_script.page_script_hash = self.page_hash
+        msg.rerun_script.widget_states.widgets.extend(self.states.values())
+        if trigger is not None:
+            _, proto = self.widget(trigger)
+            msg.rerun_script.widget_states.widgets.append(WidgetState(id=proto.id, trigger_value=True))
+
+        t0 = time.perf_counter()
+        await self.ws.send(msg.SerializeToString())
+        widgets, exceptions = {}, []
+        while True:
+            fm = ForwardMsg()
+            fm.ParseFromString(await self.ws.recv())
+            kind = fm.WhichOneof('type')
+            if kind == 'navigation':
+                # Hash della pagina eseguita: nei rerun successivi identifica la pagina come fa il browser
+                self.page_hash = fm.navigation.page_script_hash
+            elif kind == 'delta' and fm.delta.WhichOneof('type') == 'new_element':
+                element = fm.delta.new_element
+                el_type = element.WhichOneof('type')
+                if el_type in WIDGET_TYPES:
+                    proto = getattr(element, el_type)
+                    widgets[proto.label] = (el_type, proto)
+                elif el_type == 'exception':
+                    exceptions.append(element.exception.message)
+            elif kind == 'script_finished':
+                if fm.script_finished == ForwardMsg.FINISHED_EARLY_FOR_RERUN:
+                    continue
+                break
+        self.widgets = widgets
+        return (time.perf_counter() - t0) * 1000, exceptions
+
+
+def kpi_flow(session, rng):
+    """Gesti della pagina Analisi & KPI: (nome, azione) con azione -> pulsante da premere o None."""
+    def threshold():
+        session.set('🎚️ Soglia di congestione', float(rng.randrange(1000, 7501, 250)))
+
+    def date_range():
+        # Gli slider di date lavorano in microsecondi dall'epoca
+        _, proto = session.widget('Seleziona intervallo di date')
+        day = 86_400 * 10**6
+        span_days = int((proto.max - proto.min) // day)
+        start = proto.min + day * rng.randrange(0, max(1, span_days - 30))
+        end = min(proto.max, start + day * rng.choice([7, 30, 365, 3 * 365]))
+        session.set('Seleziona intervallo di date', [start, end])
+
+    def z_threshold():
+        session.set('Soglia z', rng.choice([2.0, 2.5, 3.0, 4.0]))
+
+    def direction():
+        session.set('Direzione', rng.choice(['Tutte', 'sopra la norma', 'sotto la norma']))
+
+    return [('soglia', threshold), ('date', date_range), ('soglia_z', z_threshold), ('direzione', direction)]
+
+
+def forecast_flow(session, rng):
+    """Gesti della pagina Previsioni: finestra di storico, poi ogni orizzonte di previsione."""
+    def history():
+        _, proto = session.widget('Range temporale')
+        session.set('Range temporale', rng.choice(list(proto.options)))
+
+    def horizon(choice):
+        def step():
+            session.set('Orizzonte previsioni', choice)
+            return '▶️ Genera previsioni'
+        return step
+
+    return [('storico', history)] + [(f'genera:{choice}', horizon(choice)) for choice in HORIZON_CHOICES]
+
+
+FLOWS = {'kpi': kpi_flow, 'previsioni': forecast_flow}
+
+
+async def run_session(url, flow_name, iterations, seed, samples, errors):
+    rng = random.Random(seed)
+    session = Session(url, PAGES[flow_name])
+
+    async def rerun(step, trigger=None):
+        try:
+            ms, exceptions = await session.rerun(trigger)
+        except Exception as e:
+            errors.append(f'{flow_name}/{step}: {e!r}')
+            return
+        samples.append((flow_name, step, ms))
+        errors.extend(f'{flow_name}/{step}: {msg}' for msg in exceptions)
+
+    await session.connect()
+    try:
+        await rerun('avvio')
+        for _ in range(iterations):
+            for step, action in FLOWS[flow_name](session, rng):
+                try:
+                    trigger = action()
+                except LookupError as e:
+                    errors.append(f'{flow_name}/{step}: {e}')
+                    continue
+                await rerun(step, trigger)
+    finally:
+        await session.close()
+
+
+def server_rss_mb(pid):
+    """Memoria residente del server (MB), da /proc; None se non disponibile."""
+    if pid is None:
+        return None
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        return None
+    return None
+
+
+def run_level(url, n_sessions, flows, iterations, server_pid=None):
+    """N sessioni concorrenti, distribuite a rotazione sui flussi richiesti."""
+    samples, errors = [], []
+
+    async def level():
+        await asyncio.gather(*(run_session(url, flows[i % len(flows)], iterations, i, samples, errors)
+                               for i in range(n_sessions)))
+
+    t0 = time.perf_counter()
+    asyncio.run(level())
+    elapsed = time.perf_counter() - t0
+
+    latencies = [ms for _, _, ms in samples]
+    per_step = {}
+    for flow, step, ms in samples:
+        per_step.setdefault(f'{flow}/{step}', []).append(ms)
+    return {
+        'sessions': n_sessions,
+        'reruns': len(samples),
+        'errors': len(errors),
+        'error_samples': errors[:5],
+        'elapsed_s': elapsed,
+        'throughput_rps': len(samples) / elapsed if elapsed > 0 else 0.0,
+        'p50_ms': float(np.percentile(latencies, 50)) if latencies else float('nan'),
+        'p95_ms': float(np.percentile(latencies, 95)) if latencies else float('nan'),
+        'p99_ms': float(np.percentile(latencies, 99)) if latencies else float('nan'),
+        'rss_mb': server_rss_mb(server_pid),
+        'steps_p50_ms': {name: float(np.percentile(v, 50)) for name, v in sorted(per_step.items())},
+    }
+
+
+def _spawn_server(timeout=120):
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+    cmd = [sys.executable, '-m', 'streamlit', 'run', str(DASHBOARD_DIR / 'app.py'), '--server.headless', 'true',
+           '--server.port', str(port), '--server.address', '127.0.0.1', '--browser.gatherUsageStats', 'false']
+    env = {**os.environ, 'PYTHONPATH': os.pathsep.join(filter(None, [str(DASHBOARD_DIR), os.environ.get('PYTHONPATH')]))}
+    proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, env=env)
+    url = f'http://127.0.0.1:{port}'
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with urllib.request.urlopen(f'{url}/_stcore/health', timeout=2) as resp:
+                if resp.status == 200:
+                    return proc, url
+        except OSError:
+            time.sleep(0.5)
+    proc.terminate()
+    raise RuntimeError('il server Streamlit non risponde')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default=None, help='server già avviato')
+    parser.add_argument('--spawn', action='store_true', help='avvia `streamlit run app.py` dalla cartella corrente')
+    parser.add_argument('--sessions', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--flows', nargs='+', choices=list(FLOWS), default=list(FLOWS))
+    parser.add_argument('--iterations', type=int, default=2, help='ripetizioni del flusso per sessione')
+    parser.add_argument('--output', type=Path, default=None, help='file JSON dei risultati')
+    args = parser.parse_args(argv)
+
+    proc, url = None, args.url
+    if args.spawn:
+        proc, url = _spawn_server()
+    if url is None:
+        parser.error('specificare --url oppure --spawn')
+    pid = proc.pid if proc is not None else None
+
+    levels = []
+    try:
+        rss_start = server_rss_mb(pid)
+        if rss_start is not None:
+            print(f'RSS server all\'avvio: {rss_start:.0f} MB')
+        print(f"{'sessioni':>8} {'rerun':>6} {'err':>4} {'rerun/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'RSS MB':>8}")
+        for n in args.sessions:
+            r = run_level(url, n, args.flows, args.iterations, pid)
+            levels.append(r)
+            rss = f"{r['rss_mb']:>8.0f}" if r['rss_mb'] is not None else f"{'-':>8}"
+            print(f"{r['sessions']:>8} {r['reruns']:>6} {r['errors']:>4} {r['throughput_rps']:>8.2f} "
+                  f"{r['p50_ms']:>9.0f} {r['p95_ms']:>9.0f} {r['p99_ms']:>9.0f} {rss}")
+            for err in r['error_samples']:
+                print(f'         ! {err}')
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait(timeout=30)
+
+    print('== p50 per gesto (ultimo livello)')
+    for name, ms in levels[-1]['steps_p50_ms'].items():
+        print(f'  {name:<40} {ms:>9.0f} ms')
+
+    report = {
+        'meta': {'timestamp': datetime.now().isoformat(timespec='seconds'), 'url': url, 'flows': args.flows,
+                 'iterations': args.iterations, 'rss_start_mb': rss_start},
+        'levels': levels,
+    }
+    output = args.output or RESULTS_DIR / f"load_{datetime.now():%Y%m%d_%H%M%S}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2))
+    print(f'Risultati salvati in {output}')
+    return 1 if any(r['errors'] for r in levels) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,317 @@
+"""
+Benchmark headless dei percorsi critici della dashboard.
+
+Uso (dalla cartella Dashboard):
+    python -m benchmarks.run_benchmarks                      # suite completa
+    python -m benchmarks.run_benchmarks --quick              # meno ripetizioni, scaling fino a 10x
+    python -m benchmarks.run_benchmarks --compare benchmarks/results/<file>.json
+
+I risultati (percentili, memoria di picco, curve di scaling) vengono salvati in
+`benchmarks/results/` e possono essere confrontati con un run precedente.
+"""
+import argparse
+import json
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.ipc as ipc
+
+from benchmarks import fixtures
+from core import aggregations as agg
+from core.attributions import PipelineAttributor
+from core.charts import build_history_forecast_chart
+from core.climatology import Climatology
+from core.data import add_label_columns, load_data
+from core.ecdf import ThresholdIndex
+from core.events import EventIndex
+from core.feature_store import FeatureStore, build_feature_store
+from core.forecast import recursive_forecast
+from core.linear_fast import compile_linear_pipeline, iter_linear_forecast
+from core.rollups import RollupPyramid
+
+RESULTS_DIR = Path(__file__).resolve().parent / 'results'
+
+# Orizzonti della pagina Previsioni (ore): ora successiva, oggi, oggi e domani, 3gg, settimana, mese
+FORECAST_HORIZONS = (1, 24, 48, 72, 168, 720)
+
+SCALE_FACTORS = (1, 10, 25, 50, 100)
+QUICK_SCALE_FACTORS = (1, 10)
+
+
+def measure(fn, repeat, warmup=1):
+    """Esegue `fn` più volte e restituisce i percentili dei tempi (ms) e la memoria di picco (MB)."""
+    for _ in range(warmup):
+        fn()
+
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - t0) * 1000)
+
+    # Memoria misurata in un run separato: tracemalloc rallenta l'esecuzione
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'runs': repeat,
+        'mean_ms': statistics.fmean(times),
+        'min_ms': min(times),
+        'p50_ms': float(np.percentile(times, 50)),
+        'p95_ms': float(np.percentile(times, 95)),
+        'p99_ms': float(np.percentile(times, 99)),
+        'max_ms': max(times),
+        'peak_mb': peak / 2**20,
+    }
+
+
+def aggregation_cases(df):
+    """Tutte le aggregazioni della pagina Analisi & KPI, su un dataset già etichettato."""
+    daily = agg.daily_series(df)
+    end = daily['date_time'].max().date()
+    start = end - pd.Timedelta(days=29)
+    day = df['date_time'].iloc[len(df) // 2].date()
+    day_df = agg.day_slice(df, day)
+    index = ThresholdIndex(df)
+    rollups = RollupPyramid(df)
+    last_dt = df['date_time'].max()
+    year_start = last_dt - pd.Timedelta(days=365)
+    return {
+        'kpi_summary': lambda: agg.kpi_summary(df),
+        'add_label_columns': lambda: add_label_columns(df.copy()),
+        'hourly_profile': lambda: agg.hourly_profile(df),
+        'daily_series': lambda: agg.daily_series(df),
+        'filter_date_range': lambda: agg.filter_date_range(daily, start, end),
+        'hour_weekday_matrix': lambda: agg.hour_weekday_matrix(df),
+        'weekly_trend': lambda: agg.weekly_trend(df),
+        'monthly_trend': lambda: agg.monthly_trend(df),
+        'yearly_trend': lambda: agg.yearly_trend(df),
+        'day_slice': lambda: agg.day_slice(df, day),
+        'summarize_day': lambda: agg.summarize_day(day_df),
+        'weather_traffic': lambda: agg.weather_traffic(df),
+        'temp_traffic': lambda: agg.temp_traffic(df),
+        'rain_traffic': lambda: agg.rain_traffic(df),
+        'snow_traffic': lambda: agg.snow_traffic(df),
+        'cloud_traffic': lambda: agg.cloud_traffic(df),
+        'rollups.build': lambda: RollupPyramid(df),
+        'rollups.window_1anno': lambda: rollups.window(year_start, last_dt),
+        'mask.window_1anno': lambda: df.loc[df['date_time'] >= year_start, ['date_time', 'traffic_volume']].copy(),
+        'ecdf.build': lambda: ThresholdIndex(df),
+        'ecdf.count_above': lambda: index.count_above(4000, hour=8, weather_main='rain'),
+        'ecdf.scan_count_above': lambda: int(((df['traffic_volume'] > 4000) & (df['hour'] == 8) & (df['weather_main'] == 'rain')).sum()),
+    }
+
+
+def forecast_case(pipeline, raw_df, hours):
+    working = raw_df.sort_values('date_time').reset_index(drop=True)
+    start_dt = working['date_time'].max() + pd.Timedelta(hours=1)
+    return lambda: recursive_forecast(pipeline, working.copy(), start_dt, hours)
+
+
+def arrow_bytes(data):
+    """Dimensione in byte di un dataset (lista di record o DataFrame) serializzato come stream IPC Arrow."""
+    table = pa.Table.from_pandas(pd.DataFrame(data))
+    sink = pa.BufferOutputStream()
+    with ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().size
+
+
+def chart_payload(spec):
+    """Spec JSON + dataset in Arrow, come li serializza Streamlit: restituisce la dimensione in byte."""
+    spec = dict(spec)
+    datasets = spec.pop('datasets', {})
+    size = len(json.dumps(spec))
+    for data in datasets.values():
+        size += arrow_bytes(data)
+    return size
+
+
+def chart_case(raw_df, preds_df, hist_choice='1 anno', fc_choice='Prossimo mese'):
+    """Costruzione dello spec del grafico più la serializzazione dei dati inviata al client."""
+    last_dt = raw_df['date_time'].max()
+    hist = raw_df.loc[raw_df['date_time'] >= last_dt - pd.Timedelta(days=365), ['date_time', 'traffic_volume']]
+    return lambda: chart_payload(build_history_forecast_chart(hist, preds_df, fc_choice=fc_choice, hist_choice=hist_choice))
+
+
+def run_suite(raw_df, pipeline, repeat, scale_factors, workdir):
+    results = {}
+
+    def record(name, fn, n=repeat):
+        print(f'  {name} ...', end=' ', flush=True)
+        stats = measure(fn, n)
+        results[name] = stats
+        print(f"p50={stats['p50_ms']:.2f}ms p95={stats['p95_ms']:.2f}ms peak={stats['peak_mb']:.1f}MB")
+
+    print('== load_data')
+    csv_path = fixtures.write_csv(raw_df, workdir)
+    record('load_data', lambda: load_data(csv_path))
+    store_dir = str(Path(workdir) / 'feature_store')
+    build_feature_store(csv_path, store_dir)
+    record('feature_store.open', lambda: FeatureStore(store_dir))
+
+    df = add_label_columns(load_data(csv_path))
+    print('== aggregazioni Analisi & KPI')
+    for name, fn in aggregation_cases(df).items():
+        record(f'agg.{name}', fn)
+
+    print('== forecast ricorsivo')
+    preds_720 = None
+    for hours in FORECAST_HORIZONS:
+        # Gli orizzonti lunghi sono costosi: meno ripetizioni
+        n = repeat if hours <= 48 else max(1, repeat // 5)
+        fn = forecast_case(pipeline, raw_df, hours)
+        record(f'forecast.{hours}h', fn, n)
+        if hours == 720:
+            preds_720 = pd.DataFrame(fn()[0])
+
+    print('== stima istantanea (climatologia)')
+    clim = Climatology.from_frame(raw_df)
+    clim_start = raw_df['date_time'].max() + pd.Timedelta(hours=1)
+    record('climatology.build', lambda: Climatology.from_frame(raw_df))
+    for hours in (24, 720):
+        record(f'climatology.forecast_{hours}h', lambda hours=hours: clim.forecast(clim_start, hours))
+
+    print('== indice degli eventi (festività ed episodi meteo)')
+    events = EventIndex.from_frame(raw_df, clim)
+    record('events.build', lambda: EventIndex.from_frame(raw_df, clim))
+    # Evento più frequente: una finestra di ±48h per ogni occorrenza in un'unica lettura
+    busiest = events.catalog().sort_values('occorrenze').iloc[-1]['evento']
+    record('events.windows_busiest', lambda: events.windows(busiest, 48, 48))
+    record('events.impact_curve_busiest', lambda: events.impact_curve(busiest, 48, 48))
+
+    try:
+        compiled = compile_linear_pipeline(pipeline)
+    except ValueError:
+        compiled = None
+    if compiled is not None:
+        print('== pipeline lineare: sklearn vs compilata')
+        X = raw_df.drop(columns=['date_time', 'traffic_volume'])
+        X1, X1000 = X.tail(1), X.tail(1000)
+        row = X1.to_dict('records')[0]
+        record('linear.predict_1.sklearn', lambda: pipeline.predict(X1))
+        record('linear.predict_1.compiled', lambda: compiled.predict_row(row))
+        record('linear.predict_1000.sklearn', lambda: pipeline.predict(X1000))
+        record('linear.predict_1000.compiled', lambda: compiled.predict(X1000))
+        working = raw_df.sort_values('date_time').reset_index(drop=True)
+        start_dt = working['date_time'].max() + pd.Timedelta(hours=1)
+        for hours in (24, 720):
+            record(f'forecast.{hours}h.compiled',
+                   lambda hours=hours: list(iter_linear_forecast(compiled, working, start_dt, hours)))
+
+    try:
+        attributor = PipelineAttributor(pipeline)
+    except ValueError:
+        attributor = None
+    if attributor is not None:
+        print(f'== contributi delle feature ({attributor.kind}), orizzonte di 720 ore')
+        X720 = raw_df.drop(columns=['date_time', 'traffic_volume']).tail(720)
+        record('attributions.build', lambda: PipelineAttributor(pipeline))
+        record('attributions.explain_720', lambda: attributor.explain(X720))
+        record('attributions.predict_720', lambda: pipeline.predict(X720))
+
+    print('== render_history_forecast_chart (spec)')
+    record('chart.1anno_no_preds', chart_case(raw_df, None))
+    record('chart.1anno_720h', chart_case(raw_df, preds_720))
+    print(f"  payload 1 anno + 720h: {chart_case(raw_df, preds_720)() / 1024:.0f} KiB")
+
+    print('== scaling')
+    scaling = {}
+    for factor in scale_factors:
+        big = fixtures.scale_frame(raw_df, factor)
+        path = fixtures.write_csv(big, workdir, f'scaled_{factor}x.csv')
+        n = max(1, repeat // max(1, factor // 5))
+        big_df = add_label_columns(load_data(path))
+        cases = {
+            'load_data': lambda: load_data(path),
+            'agg.hourly_profile': lambda: agg.hourly_profile(big_df),
+            'agg.daily_series': lambda: agg.daily_series(big_df),
+            'agg.hour_weekday_matrix': lambda: agg.hour_weekday_matrix(big_df),
+            'agg.rain_traffic': lambda: agg.rain_traffic(big_df),
+            'forecast.24h': forecast_case(pipeline, big, 24),
+            'chart.1anno_720h': chart_case(big, preds_720),
+        }
+        for name, fn in cases.items():
+            stats = measure(fn, n)
+            scaling.setdefault(name, []).append({'factor': factor, 'rows': len(big), **stats})
+            print(f"  {factor:>3}x {name}: p50={stats['p50_ms']:.2f}ms peak={stats['peak_mb']:.1f}MB")
+
+    return results, scaling
+
+
+def compare(current, baseline, tolerance):
+    """Elenca i benchmark il cui p50 è peggiorato oltre la tolleranza rispetto al baseline."""
+    regressions = []
+    for name, stats in current['results'].items():
+        old = baseline.get('results', {}).get(name)
+        if old is None:
+            continue
+        ratio = stats['p50_ms'] / old['p50_ms'] if old['p50_ms'] > 0 else 1.0
+        flag = 'REGRESSIONE' if ratio > 1 + tolerance else ''
+        print(f"  {name:<32} {old['p50_ms']:>10.2f} → {stats['p50_ms']:>10.2f} ms  ({ratio:5.2f}x) {flag}")
+        if flag:
+            regressions.append(name)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--quick', action='store_true', help='meno ripetizioni e scaling fino a 10x')
+    parser.add_argument('--repeat', type=int, default=None, help='ripetizioni per benchmark')
+    parser.add_argument('--scales', type=int, nargs='*', default=None, help='fattori di scaling del dataset')
+    parser.add_argument('--output', type=Path, default=None, help='file JSON dei risultati')
+    parser.add_argument('--compare', type=Path, default=None, help='risultati precedenti da confrontare')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='peggioramento p50 tollerato (0.2 = +20%%)')
+    args = parser.parse_args(argv)
+
+    repeat = args.repeat or (5 if args.quick else 20)
+    scale_factors = args.scales if args.scales is not None else (QUICK_SCALE_FACTORS if args.quick else SCALE_FACTORS)
+
+    raw_df = fixtures.base_frame()
+    pipeline = fixtures.fixture_pipeline()
+    print(f'Fixture: {len(raw_df):,} righe, modello {type(pipeline[-1]).__name__}')
+
+    with tempfile.TemporaryDirectory() as workdir:
+        results, scaling = run_suite(raw_df, pipeline, repeat, scale_factors, workdir)
+
+    report = {
+        'meta': {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'pandas': pd.__version__,
+            'numpy': np.__version__,
+            'machine': platform.machine(),
+            'rows': len(raw_df),
+            'repeat': repeat,
+        },
+        'results': results,
+        'scaling': scaling,
+    }
+
+    output = args.output or RESULTS_DIR / f"bench_{datetime.now():%Y%m%d_%H%M%S}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2))
+    print(f'Risultati salvati in {output}')
+
+    if args.compare is not None:
+        print(f'== confronto con {args.compare}')
+        regressions = compare(report, json.loads(args.compare.read_text()), args.tolerance)
+        if regressions:
+            print(f"{len(regressions)} regressioni oltre il {args.tolerance:.0%}: {', '.join(regressions)}")
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
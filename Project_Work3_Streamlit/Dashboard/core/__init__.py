@@ -0,0 +1,6 @@
+"""
+Logica condivisa della dashboard (dati, aggregazioni, previsioni, grafici).
+
+I moduli di questo package non dipendono dal runtime di Streamlit (salvo dove
+indicato), così possono essere usati anche da script headless come i benchmark.
+"""
@@ -0,0 +1,160 @@
+import pandas as pd
+
+from core import perf
+from core.data import ORDINE_GIORNI, ORDINE_MESI
+
+# Soglia (veicoli/ora) oltre la quale un'ora è considerata congestionata
+CONGESTION_THRESHOLD = 5000
+
+# Categorie meteo con meno campioni vengono escluse dal grafico (outlier)
+MIN_SAMPLES = 100
+
+
+@perf.timed('agg.kpi_summary')
+def kpi_summary(df):
+    """KPI sintetici mostrati in testa alla pagina."""
+    return {
+        'avg_traffic': round(df['traffic_volume'].mean(), 2),
+        'max_traffic': round(df['traffic_volume'].max(), 2),
+        'min_dt': df['date_time'].min(),
+        'max_dt': df['date_time'].max(),
+        'n_rows': len(df),
+        'busy_hours': df[df['traffic_volume'] > CONGESTION_THRESHOLD].shape[0],
+    }
+
+
+@perf.timed('agg.hourly_profile')
+def hourly_profile(df):
+    """Traffico medio per ora, separando feriali e weekend."""
+    return df.groupby(['hour', 'tipo_giorno'])['traffic_volume'].mean().round(2).reset_index()
+
+
+@perf.timed('agg.daily_series')
+def daily_series(df):
+    """Serie della media giornaliera del traffico."""
+    return df.set_index('date_time')['traffic_volume'].resample('D').mean().round(2).reset_index()
+
+
+@perf.timed('agg.filter_date_range')
+def filter_date_range(daily, start, end):
+    """Filtra la serie giornaliera sull'intervallo [start, end] (date)."""
+    mask = (daily['date_time'].dt.date >= start) & (daily['date_time'].dt.date <= end)
+    return daily[mask]
+
+
+@perf.timed('agg.hour_weekday_matrix')
+def hour_weekday_matrix(df):
+    """Matrice ora × giorno della settimana (media), ordinata Domenica → Lunedì."""
+    pivot = df.pivot_table(index='day_of_week', columns='hour', values='traffic_volume', aggfunc='mean').round(2)
+    return pivot.reindex([6, 5, 4, 3, 2, 1, 0])
+
+
+@perf.timed('agg.weekly_trend')
+def weekly_trend(df):
+    return df.groupby('nome_giorno')['traffic_volume'].mean().round(2).reindex(ORDINE_GIORNI).reset_index()
+
+
+@perf.timed('agg.monthly_trend')
+def monthly_trend(df):
+    return df.groupby('nome_mese')['traffic_volume'].mean().round(2).reindex(ORDINE_MESI).reset_index()
+
+
+@perf.timed('agg.yearly_trend')
+def yearly_trend(df):
+    return df.groupby('year')['traffic_volume'].mean().round(2).reset_index()
+
+
+@perf.timed('agg.day_slice')
+def day_slice(df, date):
+    """Righe di una singola giornata, con i float troncati a due decimali."""
+    day_df = df[df['date_time'].dt.date == date].copy()
+    float_cols = day_df.select_dtypes(include=['float', 'float64', 'float32']).columns
+    day_df[float_cols] = day_df[float_cols].apply(lambda x: x.round(2))
+    return day_df
+
+
+@perf.timed('agg.summarize_day')
+def summarize_day(day_df: pd.DataFrame) -> dict:
+    """Riepilogo giornaliero (una riga) per confronto diretto."""
+    if day_df.empty:
+        return {}
+
+    # Valori categoriali: prendiamo il più frequente (o il primo non nullo)
+    def _mode(series):
+        series = series.dropna()
+        if series.empty:
+            return None
+        m = series.mode()
+        return m.iloc[0] if not m.empty else series.iloc[0]
+
+    holiday_vals = day_df['holiday'].dropna().astype(str).unique().tolist() if 'holiday' in day_df.columns else []
+    holiday_vals = [h for h in holiday_vals if h.lower() not in ("none", "nan", "nan.0")]
+    holiday_val = holiday_vals[0] if len(holiday_vals) > 0 else "Nessuna"
+
+    return {
+        "📅 Giorno settimana": str(day_df.iloc[0].get('nome_giorno', '')),
+        "🗓️ Weekend": bool(day_df.iloc[0].get('is_weekend', False)),
+        "🎉 Holiday": holiday_val,
+        "🌦️ Meteo (main)": _mode(day_df['weather_main']) if 'weather_main' in day_df.columns else None,
+        "🌫️ Meteo (desc)": _mode(day_df['weather_description']) if 'weather_description' in day_df.columns else None,
+        "🌡️ Temp media (°C)": float(day_df['temp'].mean()) if 'temp' in day_df.columns else None,
+        "☁️ Clouds mediana (%)": float(day_df['clouds_all'].median()) if 'clouds_all' in day_df.columns else None,
+        "🌧️ Pioggia tot (mm)": float(day_df['rain_1h'].sum()) if 'rain_1h' in day_df.columns else None,
+        "❄️ Neve tot (mm)": float(day_df['snow_1h'].sum()) if 'snow_1h' in day_df.columns else None,
+        "🚗 Traffico totale": float(day_df['traffic_volume'].sum()) if 'traffic_volume' in day_df.columns else None,
+        "🚀 Traffico max": float(day_df['traffic_volume'].max()) if 'traffic_volume' in day_df.columns else None,
+        "📈 Traffico medio": float(day_df['traffic_volume'].mean()) if 'traffic_volume' in day_df.columns else None,
+    }
+
+
+@perf.timed('agg.weather_traffic')
+def weather_traffic(df):
+    """Media/mediana/conteggio del traffico per categoria meteo principale."""
+    # Escludiamo i valori nulli o vuoti per l'analisi
+    out = df[df['weather_main'].notna() & (df['weather_main'] != '')].groupby('weather_main')['traffic_volume'].agg(['mean', 'median', 'count']).sort_values('mean', ascending=False).reset_index()
+    out.columns = ['Condizione Meteo', 'Traffico Medio', 'Traffico Mediano', 'Conteggio Ore']
+    return out
+
+
+@perf.timed('agg.temp_traffic')
+def temp_traffic(df):
+    """Traffico medio per intervallo di temperatura (10 bin)."""
+    temp_bins = pd.cut(df['temp'], bins=10, duplicates='drop')
+    out = df.groupby(temp_bins, observed=True)['traffic_volume'].mean().round(2).reset_index()
+    out['temp_range'] = out['temp'].astype(str)
+    return out
+
+
+@perf.timed('agg.rain_traffic')
+def rain_traffic(df):
+    """Traffico medio per intensità di pioggia (colonna 'rain_1h' con le fasce)."""
+    # Pioggia: Raggruppiamo i valori di pioggia > 0.05 per analizzare l'effetto delle piogge vere
+    rain_groups = df['rain_1h'].apply(lambda x: 'Zero/Minima' if x < 0.05 else ('Leggera' if x < 1.0 else 'Forte'))
+    # Assicuriamoci che l'ordine sia logico (Zero, Leggera, Forte)
+    if 'Leggera' in rain_groups.unique():
+        out = df.groupby(rain_groups, observed=True)['traffic_volume'].mean().round(2).reset_index()
+        out[rain_groups.name] = pd.Categorical(out[rain_groups.name], categories=['Zero/Minima', 'Leggera', 'Forte'], ordered=True)
+        out = out.sort_values(rain_groups.name)
+    else:
+        # Caso fallback se 'Leggera' non c'è
+        out = df.groupby(rain_groups, observed=True)['traffic_volume'].mean().round(2).reset_index().sort_values('traffic_volume', ascending=False)
+    return out
+
+
+@perf.timed('agg.snow_traffic')
+def snow_traffic(df):
+    """Traffico medio per intensità di neve; DataFrame vuoto se non ha mai nevicato."""
+    if not (df['snow_1h'] > 0).any():
+        return pd.DataFrame(columns=['snow_1h', 'traffic_volume'])
+    snow_groups = df['snow_1h'].apply(lambda x: 'Zero' if x == 0 else ('Leggera' if x < 0.05 else 'Forte'))
+    out = df.groupby(snow_groups, observed=True)['traffic_volume'].mean().round(2).reset_index()
+    # Ordine logico
+    out[snow_groups.name] = pd.Categorical(out[snow_groups.name], categories=['Zero', 'Leggera', 'Forte'], ordered=True)
+    return out.sort_values(snow_groups.name)
+
+
+@perf.timed('agg.cloud_traffic')
+def cloud_traffic(df):
+    """Traffico medio per fascia di copertura nuvolosa."""
+    cloud_bins = pd.cut(df['clouds_all'], bins=[0, 20, 80, 101], labels=['0-20% (Sereno) ☀️', '21-80% (Variabile) 🌤️', '81-100% (Coperto) ☁️'], right=False)
+    return df.groupby(cloud_bins, observed=True)['traffic_volume'].mean().round(2).reset_index()
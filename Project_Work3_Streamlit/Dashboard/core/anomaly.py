@@ -0,0 +1,139 @@
+"""
+Rilevamento di anomalie del traffico rispetto al profilo atteso per (ora, giorno della settimana).
+
+Per ogni coppia (ora, giorno) si mantengono conteggio, media e varianza correnti (Welford):
+un'ora è anomala se si discosta dalla media delle osservazioni precedenti di oltre `z_threshold`
+deviazioni standard. `AnomalyDetector.update` elabora una nuova ora in O(1) (`score_new_hours`,
+usato da training.online per le ore in arrivo); `backfill` calcola gli stessi punteggi su tutto
+lo storico in un solo passaggio vettoriale.
+"""
+import numpy as np
+import pandas as pd
+
+from core.data import TARGET
+
+Z_THRESHOLD = 3.0
+# Osservazioni minime per (ora, giorno) prima di giudicare un'ora
+MIN_HISTORY = 8
+
+
+def _slot(day_of_week, hour):
+    return int(day_of_week) * 24 + int(hour)
+
+
+class AnomalyDetector:
+    """Statistiche correnti per le 7 x 24 combinazioni (giorno, ora), aggiornabili un'ora alla volta."""
+
+    def __init__(self, z_threshold=Z_THRESHOLD, min_history=MIN_HISTORY):
+        self.z_threshold = z_threshold
+        self.min_history = min_history
+        self.count = np.zeros(7 * 24, dtype=np.int64)
+        self.mean = np.zeros(7 * 24)
+        self.m2 = np.zeros(7 * 24)
+
+    def expected(self, dt):
+        """(media, deviazione standard) attese per l'ora `dt`; std NaN se i dati sono insufficienti."""
+        i = _slot(dt.weekday(), dt.hour)
+        if self.count[i] < max(2, self.min_history):
+            return self.mean[i], np.nan
+        return self.mean[i], np.sqrt(self.m2[i] / (self.count[i] - 1))
+
+    def update(self, dt, value):
+        """
+        Valuta `value` rispetto alle ore precedenti con lo stesso (giorno, ora), poi aggiorna
+        le statistiche. Restituisce (z, anomala).
+        """
+        mean, std = self.expected(dt)
+        z = (value - mean) / std if std > 0 else np.nan
+        # Welford
+        i = _slot(dt.weekday(), dt.hour)
+        self.count[i] += 1
+        delta = value - self.mean[i]
+        self.mean[i] += delta / self.count[i]
+        self.m2[i] += delta * (value - self.mean[i])
+        return z, bool(abs(z) > self.z_threshold) if not np.isnan(z) else False
+
+    @classmethod
+    def from_frame(cls, df, z_threshold=Z_THRESHOLD, min_history=MIN_HISTORY):
+        """Detector con le statistiche di tutto `df`, pronto a ricevere le ore successive."""
+        det = cls(z_threshold, min_history)
+        slots = df['day_of_week'].to_numpy(dtype=np.int64) * 24 + df['hour'].to_numpy(dtype=np.int64)
+        values = df[TARGET].to_numpy(dtype=float)
+        det.count = np.bincount(slots, minlength=7 * 24)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            det.mean = np.nan_to_num(np.bincount(slots, weights=values, minlength=7 * 24) / det.count)
+        det.m2 = np.bincount(slots, weights=(values - det.mean[slots]) ** 2, minlength=7 * 24)
+        return det
+
+
+def score_new_hours(history, new_rows, z_threshold=Z_THRESHOLD, min_history=MIN_HISTORY):
+    """
+    Punteggi delle ore nuove, elaborate una alla volta in ordine cronologico con le statistiche
+    dello storico precedente (stesse colonne di `backfill`, più 'anomala').
+    """
+    det = AnomalyDetector.from_frame(history, z_threshold, min_history)
+    new_rows = new_rows.sort_values('date_time', kind='stable')
+    rows = []
+    for dt, value in zip(new_rows['date_time'], new_rows[TARGET].to_numpy(dtype=float)):
+        expected, std = det.expected(dt)
+        z, flagged = det.update(dt, value)
+        rows.append({'date_time': dt, TARGET: value, 'expected': expected, 'std': std, 'z': z, 'anomala': flagged})
+    return pd.DataFrame(rows, columns=['date_time', TARGET, 'expected', 'std', 'z', 'anomala'])
+
+
+def backfill(df, min_history=MIN_HISTORY):
+    """
+    Punteggi di tutte le ore dello storico, identici a quelli di `AnomalyDetector.update`
+    applicato in ordine cronologico: colonne date_time, traffic_volume, expected, std, z.
+    """
+    data = df[['date_time', TARGET, 'day_of_week', 'hour']].sort_values('date_time', kind='stable')
+    values = data[TARGET].to_numpy(dtype=float)
+    slot = data['day_of_week'].to_numpy(dtype=np.int64) * 24 + data['hour'].to_numpy(dtype=np.int64)
+
+    # Somme cumulative per slot escludendo l'ora corrente: statistiche delle ore precedenti
+    grouped = pd.DataFrame({'slot': slot, 'v': values, 'v2': values * values}).groupby('slot')
+    n = grouped.cumcount().to_numpy()
+    s = grouped['v'].cumsum().to_numpy() - values
+    s2 = grouped['v2'].cumsum().to_numpy() - values * values
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = s / n
+        var = (s2 - n * mean * mean) / (n - 1)
+        std = np.sqrt(np.maximum(var, 0.0))
+        std[n < max(2, min_history)] = np.nan
+        z = (values - mean) / std
+    z[~(std > 0)] = np.nan
+
+    return pd.DataFrame({
+        'date_time': data['date_time'].to_numpy(),
+        TARGET: values,
+        'expected': mean,
+        'std': std,
+        'z': z,
+    })
+
+
+def anomaly_events(scores, z_threshold=Z_THRESHOLD):
+    """
+    Raggruppa le ore anomale consecutive (stessa direzione, senza buchi) in eventi:
+    inizio, fine, ore, direzione, z di picco, scarto medio dal valore atteso.
+    """
+    flagged = scores[np.abs(scores['z']) > z_threshold]
+    columns = ['inizio', 'fine', 'ore', 'direzione', 'z_picco', 'scarto_medio']
+    if flagged.empty:
+        return pd.DataFrame(columns=columns)
+    direction = np.where(flagged['z'] > 0, 'sopra la norma', 'sotto la norma')
+    new_event = (flagged['date_time'].diff() != pd.Timedelta(hours=1)) | (direction != np.roll(direction, 1))
+    event_id = new_event.cumsum().to_numpy()
+    tmp = flagged.assign(event=event_id, direzione=direction,
+                         abs_z=flagged['z'].abs(), scarto=flagged[TARGET] - flagged['expected'])
+    peak = tmp.loc[tmp.groupby('event')['abs_z'].idxmax(), ['event', 'z']].set_index('event')['z']
+    events = tmp.groupby('event').agg(
+        inizio=('date_time', 'min'),
+        fine=('date_time', 'max'),
+        ore=('date_time', 'size'),
+        direzione=('direzione', 'first'),
+        scarto_medio=('scarto', 'mean'),
+    )
+    events['z_picco'] = peak.round(2)
+    events['scarto_medio'] = events['scarto_medio'].round(0)
+    return events[columns].reset_index(drop=True)
@@ -0,0 +1,110 @@
+"""
+Contributo di ogni feature alle singole predizioni della pipeline, senza passate extra del modello.
+
+Per alberi e foreste si usano i contributi lungo il percorso di decisione: scendendo da un nodo
+al figlio la predizione media cambia di value[figlio] - value[padre] e la variazione viene
+attribuita alla feature del padre. La predizione è quindi valore base (media della radice) +
+somma dei contributi. Le variazioni di tutti i nodi della foresta stanno in un'unica matrice
+sparsa (nodi x feature, già divisa per il numero di alberi), costruita una volta per modello:
+un blocco di righe si spiega con `decision_path` e un prodotto matrice sparsa.
+Per i modelli lineari il contributo è coefficiente x valore trasformato (esatto).
+
+Le colonne trasformate (es. one-hot di `hour`) vengono ricondotte alle feature originali.
+"""
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from sklearn.preprocessing import OneHotEncoder
+
+from core.data import CATEGORICAL_FEATURES, NUMERIC_FEATURES
+
+BASE = 'base'
+
+
+def _source_columns(pre):
+    """Feature originale di ogni colonna in uscita dal ColumnTransformer."""
+    sources = []
+    for _, trans, cols in pre.transformers_:
+        if trans == 'drop':
+            continue
+        if isinstance(trans, OneHotEncoder):
+            for col, cats in zip(cols, trans.categories_):
+                sources.extend([col] * len(cats))
+        else:
+            sources.extend(cols)
+    return sources
+
+
+class PipelineAttributor:
+    """Scompone le predizioni di Pipeline(preprocessore, modello) in valore base + contributi per feature."""
+
+    def __init__(self, pipeline):
+        steps = getattr(pipeline, 'steps', None)
+        if not steps or len(steps) != 2:
+            raise ValueError('serve una Pipeline(preprocessore, modello)')
+        self.pre, self.model = steps[0][1], steps[1][1]
+        sources = _source_columns(self.pre)
+        known = [c for c in CATEGORICAL_FEATURES + NUMERIC_FEATURES if c in sources]
+        self.features = known + [c for c in dict.fromkeys(sources) if c not in known]
+        # Somma delle colonne trasformate per feature originale
+        self._group = sparse.csr_matrix(
+            (np.ones(len(sources)), (np.arange(len(sources)), [self.features.index(c) for c in sources])),
+            shape=(len(sources), len(self.features)))
+
+        # Albero singolo (tree_) o foresta (estimators_ di alberi)
+        trees = [self.model] if hasattr(self.model, 'tree_') else list(getattr(self.model, 'estimators_', []))
+        if trees and all(hasattr(est, 'tree_') for est in trees):
+            self._deltas, self.base = self._path_deltas(trees, len(sources))
+            self.kind = 'percorso di decisione'
+        elif hasattr(self.model, 'coef_') and np.ndim(self.model.coef_) == 1:
+            self._coef = np.asarray(self.model.coef_, dtype=float)
+            self.base = float(np.ravel(self.model.intercept_)[0])
+            self.kind = 'lineare'
+        else:
+            raise ValueError(f'{type(self.model).__name__} non supportato')
+
+    @staticmethod
+    def _path_deltas(trees, n_columns):
+        rows, cols, vals, roots = [], [], [], []
+        offset = 0
+        for est in trees:
+            tree = est.tree_
+            value = tree.value[:, 0, 0]
+            internal = np.flatnonzero(tree.children_left >= 0)
+            for children in (tree.children_left[internal], tree.children_right[internal]):
+                rows.append(offset + children)
+                cols.append(tree.feature[internal])
+                vals.append(value[children] - value[internal])
+            roots.append(value[0])
+            offset += tree.node_count
+        deltas = sparse.csr_matrix(
+            (np.concatenate(vals) / len(trees), (np.concatenate(rows), np.concatenate(cols))),
+            shape=(offset, n_columns))
+        return deltas, float(np.mean(roots))
+
+    def explain(self, X):
+        """DataFrame (una riga per riga di X): colonna `base` e una colonna per feature originale."""
+        Z = self.pre.transform(X)
+        if self.kind == 'lineare':
+            Z = Z.toarray() if sparse.issparse(Z) else np.asarray(Z, dtype=float)
+            contrib = sparse.csr_matrix(Z * self._coef) @ self._group
+        else:
+            paths = self.model.decision_path(Z)
+            paths = paths[0] if isinstance(paths, tuple) else paths
+            contrib = (paths @ self._deltas) @ self._group
+        out = pd.DataFrame(contrib.toarray(), columns=self.features, index=X.index)
+        out.insert(0, BASE, self.base)
+        return out
+
+
+def contribution_table(row, top=8):
+    """
+    Contributi di una riga di `explain` ordinati per valore assoluto: le prime `top` feature
+    e il resto sommato in 'altre'. Colonne: feature, contributo.
+    """
+    contrib = row.drop(BASE).astype(float)
+    order = contrib.abs().sort_values(ascending=False).index
+    table = pd.DataFrame({'feature': order[:top], 'contributo': contrib[order[:top]].to_numpy()})
+    if len(order) > top:
+        table.loc[len(table)] = ['altre', contrib[order[top:]].sum()]
+    return table
@@ -0,0 +1,183 @@
+"""
+Backtest a origine mobile dei due livelli di previsione: climatologia e modello.
+
+Le origini sono ore successive alla fine dell'addestramento (`residual_store.training_end`),
+distribuite in modo uniforme sul periodo di test. Per ogni origine si usa solo lo storico
+precedente. La climatologia viene ricostruita da quelle ore e il modello prevede le `horizon`
+ore successive in modo ricorsivo, con i lag presi dalle proprie predizioni, come nella pagina
+Previsioni (`iter_linear_forecast` per la pipeline lineare, altrimenti `iter_forecast`).
+Il confronto con il traffico osservato dà il MAE per ore di anticipo di entrambi i livelli.
+
+Se il modello è stato addestrato su tutto lo storico, le origini cadono nell'ultimo anno e il
+risultato è in-sample per il modello (`in_sample`). Il risultato viene salvato accanto al
+modello e ricalcolato solo se cambiano modello, CSV, fine dell'addestramento o parametri.
+
+Uso (dalla cartella Dashboard):
+    python -m core.backtest [--data dataset/cleaned_data.csv] [--model models/rf_pipeline.pkl] [--origins 8] [--horizon 168]
+"""
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from core.climatology import Climatology
+from core.data import DATA_PATH, MODEL_PATH, TARGET, load_cleaned_data, load_pipeline
+from core.feature_store import file_checksum
+from core.forecast import iter_forecast
+from core.linear_fast import compile_linear_pipeline, iter_linear_forecast
+from core.residual_store import TRAIN_END, training_end
+
+ORIGINS = 8
+HORIZON = 168     # una settimana, l'orizzonte "Prossima settimana" della pagina
+FORMAT_VERSION = 1
+
+
+def cache_path(model_path):
+    """Risultato salvato accanto al modello (come la diagnostica e lo stato di training.online)."""
+    return model_path + '.backtest.json'
+
+
+def choose_origins(dates, train_end, origins=ORIGINS, horizon=HORIZON):
+    """
+    Origini equidistanti tra la prima ora di test e l'ultima che ha `horizon` ore osservate dopo
+    di sé. Restituisce (origini, in_sample): senza ore di test si usa l'ultimo anno dello storico.
+    """
+    dates = pd.DatetimeIndex(dates)
+    last = dates[-1] - pd.Timedelta(hours=horizon - 1)
+    first = pd.Timestamp(train_end).floor('h') + pd.Timedelta(hours=1)
+    in_sample = first > last
+    if in_sample:
+        # almeno una settimana di storico prima dell'origine per lag_168
+        first = max(dates[0] + pd.Timedelta(hours=168), last - pd.Timedelta(days=365))
+    if first > last:
+        return [], in_sample
+    points = np.linspace(first.value, last.value, int(origins))
+    return sorted(set(pd.to_datetime(points).floor('h'))), in_sample
+
+
+def backtest(pipeline, history, origins, horizon=HORIZON, compiled=None):
+    """Errori assoluti (origini × ore di anticipo) di climatologia e modello; NaN dove manca il dato osservato."""
+    history = history.sort_values('date_time', kind='stable').reset_index(drop=True)
+    observed = history.drop_duplicates('date_time', keep='last').set_index('date_time')[TARGET]
+    clim_err = np.full((len(origins), horizon), np.nan)
+    model_err = np.full((len(origins), horizon), np.nan)
+    for i, origin in enumerate(origins):
+        working = history[history['date_time'] < origin]
+        y = observed.reindex(pd.date_range(origin, periods=horizon, freq='h')).to_numpy(dtype=float)
+        clim = Climatology.from_frame(working).forecast(origin, horizon)[TARGET].to_numpy(dtype=float)
+        if compiled is not None:
+            steps = iter_linear_forecast(compiled, working, origin, horizon)
+        else:
+            steps = iter_forecast(pipeline, working, origin, horizon)
+        model = np.array([yhat for _, yhat, _ in steps], dtype=float)
+        clim_err[i] = np.abs(y - clim)
+        model_err[i] = np.abs(y - model)
+    return clim_err, model_err
+
+
+def summarize(clim_err, model_err, origins, in_sample, train_end):
+    """MAE per ore di anticipo e complessivo dei due livelli."""
+    ok = ~np.isnan(clim_err)
+    count = ok.sum(axis=0)
+    with np.errstate(invalid='ignore'):
+        by_lead = pd.DataFrame({
+            'lead': np.arange(1, clim_err.shape[1] + 1),
+            'mae_climatologia': np.where(ok, clim_err, 0).sum(axis=0) / count,
+            'mae_modello': np.where(ok, model_err, 0).sum(axis=0) / count,
+            'origini': count,
+        })
+    mae_clim = float(clim_err[ok].mean()) if ok.any() else float('nan')
+    mae_model = float(model_err[ok].mean()) if ok.any() else float('nan')
+    return {
+        'origins': [pd.Timestamp(o).isoformat() for o in origins],
+        'horizon': int(clim_err.shape[1]),
+        'hours': int(ok.sum()),
+        'in_sample': bool(in_sample),
+        'train_end': pd.Timestamp(train_end).isoformat(),
+        'mae_climatology': mae_clim,
+        'mae_model': mae_model,
+        'gap': mae_clim - mae_model,
+        'by_lead': by_lead,
+    }
+
+
+def _load(path, key):
+    try:
+        with open(path, encoding='utf-8') as f:
+            saved = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+    if saved.get('key') != key:
+        return None
+    result = saved['result']
+    result['by_lead'] = pd.DataFrame(result['by_lead'])
+    return result
+
+
+def _save(path, key, result):
+    payload = {'key': key, 'result': {**result, 'by_lead': result['by_lead'].to_dict('list')}}
+    tmp = path + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(payload, f)
+    os.replace(tmp, path)
+
+
+def refresh_backtest(pipeline, history, model_path=MODEL_PATH, data_path=DATA_PATH, compiled=None,
+                     origins=ORIGINS, horizon=HORIZON, train_end=TRAIN_END, save=True):
+    """Risultato del backtest per modello e storico attuali: dal file salvato se valido, altrimenti ricalcolato."""
+    history = history.sort_values('date_time', kind='stable').reset_index(drop=True)
+    end = training_end(history['date_time'].to_numpy(), model_path, train_end, pipeline)
+    key = {
+        'version': FORMAT_VERSION,
+        'model_sha1': file_checksum(model_path) if os.path.exists(model_path) else None,
+        'source_sha1': file_checksum(data_path) if os.path.exists(data_path) else None,
+        'train_end': end.isoformat(),
+        'origins': int(origins),
+        'horizon': int(horizon),
+    }
+    result = _load(cache_path(model_path), key)
+    if result is not None:
+        return result
+    points, in_sample = choose_origins(history['date_time'], end, origins, horizon)
+    result = summarize(*backtest(pipeline, history, points, horizon, compiled), points, in_sample, end)
+    if save:
+        try:
+            _save(cache_path(model_path), key, result)
+        except OSError:
+            # cartella del modello in sola lettura: si ricalcola al prossimo avvio
+            pass
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--data', default=DATA_PATH)
+    parser.add_argument('--model', default=MODEL_PATH)
+    parser.add_argument('--origins', type=int, default=ORIGINS)
+    parser.add_argument('--horizon', type=int, default=HORIZON, help='ore previste da ogni origine')
+    parser.add_argument('--train-end', default=TRAIN_END,
+                        help="ultima ora di addestramento del modello (default: ricavata come in core.residual_store)")
+    args = parser.parse_args(argv)
+
+    pipeline = load_pipeline(args.model)
+    try:
+        compiled = compile_linear_pipeline(pipeline)
+    except ValueError:
+        compiled = None
+    df = load_cleaned_data(args.data)
+    t0 = time.perf_counter()
+    result = refresh_backtest(pipeline, df, args.model, args.data, compiled, args.origins, args.horizon,
+                              args.train_end, save=False)
+    print(f"{len(result['origins'])} origini dopo {result['train_end']}, {result['horizon']} ore ciascuna, "
+          f"in {time.perf_counter() - t0:.1f}s" + (" (in-sample: nessuna ora di test)" if result['in_sample'] else ""))
+    print(f"MAE climatologia {result['mae_climatology']:.1f}, modello {result['mae_model']:.1f} "
+          f"(guadagno del modello {result['gap']:+.1f}) su {result['hours']:,} ore")
+    by_lead = result['by_lead']
+    print(by_lead[by_lead['lead'].isin([1, 2, 3, 6, 12, 24, 48, 72, 120, 168])].round(1).to_string(index=False))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,151 @@
+import copy
+from functools import lru_cache
+
+import altair as alt
+import pandas as pd
+import streamlit as st
+
+# Finestra visibile iniziale per ogni orizzonte di previsione
+FORECAST_VISIBLE_SPAN = {
+    'Ora successiva': pd.Timedelta(hours=6),
+    'Oggi': pd.Timedelta(hours=24),
+    'Oggi e Domani': pd.Timedelta(days=2),
+    'Prossimi 3gg': pd.Timedelta(days=3),
+    'Prossima settimana': pd.Timedelta(days=7),
+    'Prossimo mese': pd.Timedelta(days=30)
+}
+
+# Finestre di storico selezionabili nella pagina Previsioni
+HISTORY_WINDOWS = {
+    '24h': pd.Timedelta(hours=24),
+    '3gg': pd.Timedelta(days=3),
+    '1sett': pd.Timedelta(days=7),
+    '1 mese': pd.Timedelta(days=30),
+    '1 anno': pd.Timedelta(days=365)
+}
+
+
+# Nomi dei dataset del grafico storico + previsto: fissi, così lo spec resta identico tra i rerun
+# e cambiano solo i dati
+HISTORY_DATASET = 'storico'
+FORECAST_DATASET = 'previsto'       # previsioni con il punto ponte (ultima ora nota) in testa
+LAST_POINT_DATASET = 'ultimo'       # ultima previsione (pallino)
+RULE_DATASET = 'inizio_previsione'  # riga verticale a fine storico
+
+_LINE_COLORS = alt.Scale(domain=['Storico', 'Previsto'], range=['gray', '#FF4B4B'])
+
+
+@lru_cache(maxsize=None)
+def _chart_template(forecast_mode):
+    """
+    Spec Vega-Lite statico (livelli, encoding, stili) per `forecast_mode` in (None, 'area', 'bar'):
+    costruito e validato da Altair una sola volta, i dati sono riferimenti ai dataset con nome.
+    """
+    x = alt.X('date_time:T')
+    y = alt.Y('traffic_volume:Q')
+    color = alt.Color('series:N', scale=_LINE_COLORS, legend=alt.Legend(title=None))
+
+    layers = [alt.Chart(alt.NamedData(HISTORY_DATASET)).mark_area(opacity=0.12, color='lightgray').encode(x=x, y=y)]
+    if forecast_mode == 'area':
+        layers.append(alt.Chart(alt.NamedData(FORECAST_DATASET)).mark_area(opacity=0.18, color='#FF4B4B').encode(x=x, y=y))
+    elif forecast_mode == 'bar':
+        # 1 sola previsione: l'area non si vede, una barra semitrasparente rende visibile l'ora prevista
+        layers.append(alt.Chart(alt.NamedData(LAST_POINT_DATASET)).mark_bar(opacity=0.18, color='#FF4B4B', size=16).encode(
+            x=x, y=y, y2=alt.datum(0)))
+    # Colore della serie calcolato nello spec: nessuna colonna 'series' da aggiungere ai dati
+    layers.append(alt.Chart(alt.NamedData(HISTORY_DATASET)).mark_line(strokeWidth=2).transform_calculate(
+        series="'Storico'").encode(x=x, y=y, color=color))
+    if forecast_mode is not None:
+        layers.append(alt.Chart(alt.NamedData(FORECAST_DATASET)).mark_line(strokeWidth=2).transform_calculate(
+            series="'Previsto'").encode(x=x, y=y, color=color))
+        layers.append(alt.Chart(alt.NamedData(LAST_POINT_DATASET)).mark_circle(size=80, color='#FF4B4B').encode(
+            x=x, y=y, tooltip=['date_time:T', 'traffic_volume:Q']))
+        layers.append(alt.Chart(alt.NamedData(RULE_DATASET)).mark_rule(color='#FF4B4B', strokeDash=[6, 6]).encode(x=x))
+
+    with alt.theme.enable('none'):
+        return alt.layer(*layers).interactive().to_dict()
+
+
+def _with_domains(template, x_domain, y_domain):
+    """Copia dello spec con i domini degli assi impostati su ogni livello."""
+    spec = copy.deepcopy(template)
+    for layer in spec['layer']:
+        encoding = layer['encoding']
+        encoding['x']['scale'] = {'domain': x_domain}
+        if 'y' in encoding:
+            encoding['y']['scale'] = {'domain': y_domain}
+    return spec
+
+
+def build_history_forecast_chart(hist_plot_df, preds_df_state, fc_choice=None, hist_choice=None):
+    """
+    Costruisce lo spec Vega-Lite storico + previsto (senza renderizzarlo): spec statico in cache
+    più domini degli assi e dataset con nome (DataFrame, serializzati in Arrow da Streamlit).
+    `date_time` deve essere già datetime. Restituisce None se non ci sono dati da mostrare.
+    """
+    hist = hist_plot_df[['date_time', 'traffic_volume']]
+    datasets = {HISTORY_DATASET: hist}
+
+    forecast_mode = None
+    if isinstance(preds_df_state, pd.DataFrame) and not preds_df_state.empty:
+        preds = preds_df_state[['date_time', 'traffic_volume']]
+        # Punto ponte: l'ultima ora nota apre la serie "Previsto", così la linea rossa parte dallo storico;
+        # la riga verticale segna la fine dello storico
+        last_hist_point = hist.loc[[hist['date_time'].idxmax()]] if not hist.empty else hist
+        forecast_line = pd.concat([last_hist_point, preds], ignore_index=True) if not hist.empty else preds
+        datasets[FORECAST_DATASET] = forecast_line
+        datasets[LAST_POINT_DATASET] = preds.loc[[preds['date_time'].idxmax()]]
+        datasets[RULE_DATASET] = last_hist_point[['date_time']]
+        # L'area richiede almeno 2 punti; altrimenti barra sull'unica ora prevista
+        forecast_mode = 'area' if len(forecast_line) >= 2 else 'bar'
+        x_start_full = min(hist['date_time'].min(), preds['date_time'].min()) if not hist.empty else preds['date_time'].min()
+        x_end_raw = forecast_line['date_time'].max()
+        y_top = max(hist['traffic_volume'].max(), preds['traffic_volume'].max()) if not hist.empty else preds['traffic_volume'].max()
+    else:
+        x_start_full = hist['date_time'].min()
+        x_end_raw = hist['date_time'].max()
+        y_top = hist['traffic_volume'].max()
+
+    if pd.isna(x_start_full):
+        return None
+
+    # Dominio X: padding a destra per decentramento a sinistra e per mostrare tutte le previsioni
+    span = x_end_raw - x_start_full
+    pad = max(pd.Timedelta(hours=18), span * 0.18)
+    x_end = x_end_raw + pad
+
+    # Finestra visibile iniziale: tutto lo storico nei dati, ma zoom sulla porzione finale
+    # proporzionale all'orizzonte di previsione (o, in mancanza, al range storico selezionato)
+    if fc_choice in FORECAST_VISIBLE_SPAN:
+        visible_span = FORECAST_VISIBLE_SPAN[fc_choice]
+    elif hist_choice in HISTORY_WINDOWS:
+        visible_span = HISTORY_WINDOWS[hist_choice]
+    else:
+        visible_span = pd.Timedelta(days=7)
+    visible_span = min(visible_span, span)
+    x_visible_start = max(x_start_full, x_end_raw - visible_span)
+
+    # Dominio Y: includi sempre lo zero (serve anche per lo shading della singola ora prevista)
+    y_max = float(y_top * 1.05)
+
+    spec = _with_domains(_chart_template(forecast_mode),
+                         [x_visible_start.isoformat(), x_end.isoformat()], [0.0, y_max])
+    spec['datasets'] = datasets
+    return spec
+
+
+def render_history_forecast_chart(chart_placeholder, hist_plot_df, preds_df_state):
+    """
+    Renderizza (e aggiorna) il grafico persistente storico + previsto. Con stessa finestra e
+    stesso orizzonte lo spec non cambia: al client arrivano solo i dataset.
+    """
+    spec = build_history_forecast_chart(
+        hist_plot_df,
+        preds_df_state,
+        fc_choice=st.session_state.get('forecast_choice'),
+        hist_choice=st.session_state.get('traffic_hist_choice'),
+    )
+    if spec is None:
+        chart_placeholder.write("Nessun dato da mostrare.")
+        return
+    chart_placeholder.vega_lite_chart(spec, width='stretch')
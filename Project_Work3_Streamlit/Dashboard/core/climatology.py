@@ -0,0 +1,103 @@
+"""
+Climatologia del traffico: media storica per ora × giorno della settimana × mese × festivo.
+
+La tabella (24 × 7 × 12 × 2 celle) si costruisce una volta dallo storico con np.add.at; le
+celle con meno di MIN_COUNT ore ricadono sul livello più generale (ora × giorno × festivo,
+poi ora × festivo, poi sola ora), già al momento della costruzione. Una previsione per
+qualsiasi orizzonte è quindi una lettura vettoriale della tabella, senza modello:
+la pagina Previsioni la mostra subito e la sostituisce con il risultato del modello.
+Serve anche per i lag di default del form manuale (traffico tipico 1h, 24h e 168h prima).
+
+Uso (dalla cartella Dashboard):
+    python -m core.climatology [--data dataset/cleaned_data.csv] [--hours 168]
+
+Il confronto di accuratezza con il modello è in core/backtest.py.
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from core.data import DATA_PATH, TARGET, load_cleaned_data
+from core.events import holiday_days
+
+MIN_COUNT = 3
+SHAPE = (24, 7, 12, 2)   # ora, giorno della settimana, mese, festivo
+# Livelli di ripiego: assi sommati rispetto alla tabella completa
+FALLBACK_AXES = ((2,), (1, 2), (1, 2, 3))
+
+
+def _cells(times, holidays):
+    """Indici (ora, giorno, mese-1, festivo) di ogni istante."""
+    times = pd.DatetimeIndex(times)
+    days = times.to_numpy().astype('datetime64[D]')
+    return (times.hour.to_numpy(), times.dayofweek.to_numpy(), times.month.to_numpy() - 1,
+            np.isin(days, holidays).astype(np.int64))
+
+
+class Climatology:
+    """Tabella ora × giorno × mese × festivo delle medie storiche, con ripiego sulle celle poco popolate."""
+
+    def __init__(self, sums, counts, holidays, min_count=MIN_COUNT):
+        self.sums, self.counts = sums, counts
+        self.holidays = holidays
+        self.min_count = min_count
+        table = np.where(counts >= min_count, sums / np.maximum(counts, 1), np.nan)
+        for axes in FALLBACK_AXES:
+            s = sums.sum(axis=axes, keepdims=True)
+            c = counts.sum(axis=axes, keepdims=True)
+            coarse = np.where(c >= min_count, s / np.maximum(c, 1), np.nan)
+            table = np.where(np.isnan(table), np.broadcast_to(coarse, SHAPE), table)
+        # Ore mai osservate (storico vuoto o quasi): media generale
+        overall = sums.sum() / counts.sum() if counts.sum() else 0.0
+        self.table = np.where(np.isnan(table), overall, table)
+
+    @classmethod
+    def from_frame(cls, df, min_count=MIN_COUNT):
+        holidays = holiday_days(df)[0]
+        y = df[TARGET].to_numpy(dtype=float)
+        ok = ~np.isnan(y)
+        idx = np.ravel_multi_index(_cells(df['date_time'].to_numpy()[ok], holidays), SHAPE)
+        sums = np.zeros(SHAPE)
+        counts = np.zeros(SHAPE)
+        np.add.at(sums.reshape(-1), idx, y[ok])
+        np.add.at(counts.reshape(-1), idx, 1)
+        return cls(sums, counts, holidays, min_count)
+
+    def predict_times(self, times, holidays=None):
+        """Traffico tipico (float) per ogni istante; festivi = giorni festivi dello storico se non indicati."""
+        return self.table[_cells(times, self.holidays if holidays is None else holidays)]
+
+    def forecast(self, start_dt, hours):
+        """Previsione oraria da start_dt per `hours` ore: date_time, traffic_volume (interi, come il modello)."""
+        times = pd.date_range(pd.Timestamp(start_dt), periods=int(hours), freq='h')
+        values = np.maximum(0, self.predict_times(times)).astype(int)
+        return pd.DataFrame({'date_time': times, 'traffic_volume': values})
+
+    def default_lags(self, dt, holiday=False):
+        """(lag_1, lag_24, lag_168) tipici per l'ora `dt`; `holiday` vale per il giorno di dt."""
+        dt = pd.Timestamp(dt)
+        times = [dt - pd.Timedelta(hours=h) for h in (1, 24, 168)]
+        holidays = np.array([dt.normalize().to_datetime64()], dtype='datetime64[D]') if holiday else np.array([], dtype='datetime64[D]')
+        return tuple(float(round(v)) for v in self.predict_times(times, holidays))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--data', default=DATA_PATH)
+    parser.add_argument('--hours', type=int, default=168, help='orizzonte della previsione di prova')
+    args = parser.parse_args(argv)
+
+    df = load_cleaned_data(args.data)
+    t0 = time.perf_counter()
+    clim = Climatology.from_frame(df)
+    t1 = time.perf_counter()
+    preds = clim.forecast(df['date_time'].max() + pd.Timedelta(hours=1), args.hours)
+    t2 = time.perf_counter()
+    print(f"Tabella da {len(df):,} righe in {(t1 - t0) * 1000:.1f} ms, "
+          f"previsione di {len(preds)} ore in {(t2 - t1) * 1000:.2f} ms")
+
+
+if __name__ == '__main__':
+    main()
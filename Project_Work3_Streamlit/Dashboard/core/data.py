@@ -0,0 +1,65 @@
+import pickle
+
+import pandas as pd
+
+# --- PERCORSI (relativi alla cartella da cui si lancia `streamlit run`) ---
+DATA_PATH = 'dataset/cleaned_data.csv'
+MODEL_PATH = 'models/rf_pipeline.pkl'
+
+# Feature usate dalle pipeline (come nei notebook del Project Work 2)
+NUMERIC_FEATURES = ['temp', 'rain_1h', 'snow_1h', 'clouds_all', 'lag_1', 'lag_24', 'lag_168']
+CATEGORICAL_FEATURES = ['hour', 'month', 'day_of_week', 'holiday', 'weather_main', 'weather_description', 'is_weekend']
+TARGET = 'traffic_volume'
+
+# Nomi testuali (non sono presenti nel CSV come stringhe)
+DAY_MAP = {0: 'Lunedì', 1: 'Martedì', 2: 'Mercoledì', 3: 'Giovedì', 4: 'Venerdì', 5: 'Sabato', 6: 'Domenica'}
+MONTH_MAP = {1: 'Gen', 2: 'Feb', 3: 'Mar', 4: 'Apr', 5: 'Mag', 6: 'Giu', 7: 'Lug', 8: 'Ago', 9: 'Set', 10: 'Ott', 11: 'Nov', 12: 'Dic'}
+ORDINE_GIORNI = list(DAY_MAP.values())
+ORDINE_MESI = list(MONTH_MAP.values())
+
+
+def load_data(path=DATA_PATH):
+    """
+    Carica il dataset già pulito.
+    Solleva FileNotFoundError se il file non esiste: la gestione dell'errore
+    (messaggio in pagina) resta a carico del chiamante.
+    """
+    # Carica il CSV
+    df = pd.read_csv(path)
+
+    # L'unica trasformazione necessaria è la conversione del timestamp
+    df['date_time'] = pd.to_datetime(df['date_time'])
+
+    # Ordiniamo per sicurezza cronologica
+    df = df.sort_values('date_time')
+
+    # Conversione dei tipi per le colonne già presenti nel CSV
+    df['day_of_week'] = df['day_of_week'].astype(int)
+    df['month'] = df['month'].astype(int)
+    df['hour'] = df['hour'].astype(int)
+
+    # Tronca tutte le colonne float a due cifre decimali
+    float_cols = df.select_dtypes(include=['float', 'float64', 'float32']).columns
+    df[float_cols] = df[float_cols].apply(lambda x: x.round(2))
+
+    return df
+
+
+def load_cleaned_data(path=DATA_PATH):
+    """Carica il dataset grezzo (solo parsing del timestamp), usato dalle previsioni."""
+    return pd.read_csv(path, parse_dates=['date_time'])
+
+
+def load_pipeline(path=MODEL_PATH):
+    """Carica la pipeline sklearn serializzata con pickle."""
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+
+def add_label_columns(df):
+    """Aggiunge le colonne testuali usate dai grafici (nome giorno/mese, tipo giorno)."""
+    df['nome_giorno'] = df['day_of_week'].map(DAY_MAP)
+    df['nome_mese'] = df['month'].map(MONTH_MAP)
+    # 'is_weekend' è già presente, usiamo solo 'tipo_giorno' per il raggruppamento
+    df['tipo_giorno'] = df['is_weekend'].apply(lambda x: 'Weekend' if x else 'Feriale')
+    return df
@@ -0,0 +1,265 @@
+"""
+Diagnostica della regressione (notebook 4_AssunzioniRegressioneLineare) da statistiche sufficienti.
+
+Le righe vengono elaborate a blocchi in ordine cronologico e per ogni blocco si aggiornano:
+  - A'A, A'y e A'u, con A = [1, matrice in uscita dal preprocessore] e u = residui²;
+  - X'X delle feature numeriche (con la costante);
+  - somme delle potenze dei residui (1..4), dei valori assoluti e delle differenze tra residui
+    consecutivi al quadrato.
+Da queste si ricavano VIF, Durbin-Watson, Breusch-Pagan (n·R², versione di Koenker) e i momenti
+dei residui; per la normalità si usa Jarque-Bera, che a differenza di Shapiro si aggiorna a
+blocchi. La memoria resta quella di un blocco e l'aggiornamento costa quanto le righe nuove:
+lo stato viene salvato accanto al modello e ricalcolato da zero solo se cambia il modello.
+
+Uso (dalla cartella Dashboard):
+    python -m core.diagnostics [--data dataset/cleaned_data.csv] [--model models/rf_pipeline.pkl] [--full]
+"""
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+from core.data import DATA_PATH, MODEL_PATH, NUMERIC_FEATURES, TARGET, load_cleaned_data, load_pipeline
+from core.feature_store import file_checksum
+from core.linear_fast import compile_linear_pipeline
+
+CHUNK_ROWS = 8192
+ALPHA = 0.05
+# Soglia del notebook: VIF oltre 5 indica multicollinearità rilevante
+VIF_THRESHOLD = 5.0
+FORMAT_VERSION = 1
+
+
+def state_path(model_path):
+    """Stato delle statistiche accanto al modello (come lo stato di training.online)."""
+    return model_path + '.diagnostics.npz'
+
+
+def design_matrix(pipeline, X):
+    """Matrice densa in ingresso all'ultimo step della pipeline."""
+    steps = getattr(pipeline, 'steps', None)
+    if not steps or len(steps) < 2:
+        return X[NUMERIC_FEATURES].to_numpy(dtype=float)
+    Z = pipeline[:-1].transform(X)
+    return np.asarray(Z.toarray() if hasattr(Z, 'toarray') else Z, dtype=float)
+
+
+class RegressionDiagnostics:
+    """Statistiche sufficienti dei residui di un modello, aggiornabili a blocchi di righe."""
+
+    ARRAYS = ('ata', 'aty', 'atu', 'xtx', 'moments')
+
+    def __init__(self, n_design, model_sha1=None):
+        p = n_design + 1
+        k = len(NUMERIC_FEATURES) + 1
+        self.model_sha1 = model_sha1
+        self.n = 0
+        self.ata = np.zeros((p, p))
+        self.aty = np.zeros(p)
+        self.atu = np.zeros(p)
+        self.xtx = np.zeros((k, k))
+        # somme di y, y², u², |e|, e, e², e³, e⁴, (e_t - e_{t-1})²
+        self.moments = np.zeros(9)
+        self.last_resid = np.nan
+        self.last_date_time = None
+
+    def update(self, design, numeric, y, resid, last_date_time=None):
+        """Aggiunge un blocco di righe (consecutive e successive a quelle già viste)."""
+        if len(y) == 0:
+            return self
+        A = np.column_stack([np.ones(len(y)), design])
+        N = np.column_stack([np.ones(len(y)), numeric])
+        u = resid * resid
+        self.ata += A.T @ A
+        self.aty += A.T @ y
+        self.atu += A.T @ u
+        self.xtx += N.T @ N
+        # Durbin-Watson: la prima differenza del blocco usa l'ultimo residuo del blocco precedente
+        prev = np.concatenate([[self.last_resid], resid]) if not np.isnan(self.last_resid) else resid
+        self.moments += [y.sum(), y @ y, u @ u, np.abs(resid).sum(), resid.sum(), u.sum(),
+                         (u * resid).sum(), (u * u).sum(), (np.diff(prev) ** 2).sum()]
+        self.n += len(y)
+        self.last_resid = float(resid[-1])
+        if last_date_time is not None:
+            self.last_date_time = pd.Timestamp(last_date_time)
+        return self
+
+    def vif(self):
+        """VIF delle feature numeriche (1 / (1 - R²) di ciascuna sulle altre), dalla loro matrice di correlazione."""
+        s = self.xtx[0, 1:]
+        cov = self.xtx[1:, 1:] / self.n - np.outer(s, s) / self.n ** 2
+        std = np.sqrt(np.diag(cov))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            corr = cov / np.outer(std, std)
+        values = np.diag(np.linalg.pinv(corr))
+        return {col: float(v) if s > 0 else np.nan for col, v, s in zip(NUMERIC_FEATURES, values, std)}
+
+    def _r2_on_design(self, aty, yty, y_sum):
+        """R² della regressione OLS di un vettore sulla matrice A, dalle sole equazioni normali."""
+        coef, _, rank, _ = np.linalg.lstsq(self.ata, aty, rcond=None)
+        sst = yty - y_sum * y_sum / self.n
+        ssr = yty - coef @ aty
+        return (1.0 - ssr / sst if sst > 0 else np.nan), int(rank)
+
+    def summary(self):
+        """Indicatori e test: dizionario di valori scalari (più i VIF per feature)."""
+        if self.n < 3:
+            return {'n': self.n}
+        y_sum, y2_sum, u2_sum, abs_sum, s1, s2, s3, s4, dw_num = self.moments
+        n = self.n
+        mean = s1 / n
+        m2 = s2 / n - mean ** 2
+        m3 = s3 / n - 3 * mean * s2 / n + 2 * mean ** 3
+        m4 = s4 / n - 4 * mean * s3 / n + 6 * mean ** 2 * s2 / n - 3 * mean ** 4
+        skew = m3 / m2 ** 1.5 if m2 > 0 else np.nan
+        kurt = m4 / m2 ** 2 if m2 > 0 else np.nan
+        jb = n / 6 * (skew ** 2 + (kurt - 3) ** 2 / 4)
+
+        r2_ols, rank = self._r2_on_design(self.aty, y2_sum, y_sum)
+        r2_aux, _ = self._r2_on_design(self.atu, u2_sum, s2)
+        bp_df = max(rank - 1, 1)
+        bp_lm = n * r2_aux
+        sst = y2_sum - y_sum ** 2 / n
+        return {
+            'n': n,
+            'r2': 1 - s2 / sst if sst > 0 else np.nan,
+            'r2_ols': r2_ols,
+            'rmse': np.sqrt(s2 / n),
+            'mae': abs_sum / n,
+            'resid_mean': mean,
+            'resid_std': np.sqrt(m2),
+            'skewness': skew,
+            'kurtosis': kurt - 3,
+            'jarque_bera': jb,
+            'jarque_bera_p': float(stats.chi2.sf(jb, 2)),
+            'durbin_watson': dw_num / s2 if s2 > 0 else np.nan,
+            'breusch_pagan': bp_lm,
+            'breusch_pagan_df': bp_df,
+            'breusch_pagan_p': float(stats.chi2.sf(bp_lm, bp_df)),
+            'vif': self.vif(),
+            'last_date_time': self.last_date_time,
+        }
+
+    def save(self, path):
+        meta = {'version': FORMAT_VERSION, 'model_sha1': self.model_sha1, 'n': self.n,
+                'last_resid': self.last_resid,
+                'last_date_time': self.last_date_time.isoformat() if self.last_date_time is not None else None}
+        tmp = path + '.tmp.npz'
+        np.savez(tmp, meta=np.array(json.dumps(meta)), **{name: getattr(self, name) for name in self.ARRAYS})
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            meta = json.loads(str(data['meta']))
+            if meta.get('version') != FORMAT_VERSION:
+                raise ValueError(f"versione dello stato non supportata: {meta.get('version')}")
+            diag = cls(data['ata'].shape[0] - 1, meta['model_sha1'])
+            for name in cls.ARRAYS:
+                setattr(diag, name, data[name].copy())
+        diag.n = meta['n']
+        diag.last_resid = meta['last_resid']
+        diag.last_date_time = pd.Timestamp(meta['last_date_time']) if meta['last_date_time'] else None
+        return diag
+
+
+def accumulate(diag, pipeline, df, chunk_rows=CHUNK_ROWS):
+    """Aggiunge a `diag` le righe di `df` (ordinate per data), un blocco alla volta."""
+    model = pipeline.steps[-1][1] if hasattr(pipeline, 'steps') else pipeline
+    for start in range(0, len(df), chunk_rows):
+        chunk = df.iloc[start:start + chunk_rows]
+        X = chunk.drop(columns=[TARGET])
+        y = chunk[TARGET].to_numpy(dtype=float)
+        design = design_matrix(pipeline, X)
+        resid = y - model.predict(design)
+        diag.update(design, X[NUMERIC_FEATURES].to_numpy(dtype=float), y, resid, chunk['date_time'].iloc[-1])
+    return diag
+
+
+def refresh_diagnostics(pipeline, df, model_path=MODEL_PATH, chunk_rows=CHUNK_ROWS, full=False, save=True):
+    """
+    Statistiche aggiornate a tutte le righe di `df`: riparte dallo stato salvato se il modello
+    è lo stesso e aggiunge solo le ore successive all'ultima già elaborata.
+    Restituisce (diagnostica, righe elaborate in questa chiamata).
+    """
+    data = df.sort_values('date_time', kind='stable')
+    model_sha1 = file_checksum(model_path) if os.path.exists(model_path) else None
+    diag = None
+    if not full:
+        try:
+            diag = RegressionDiagnostics.load(state_path(model_path))
+        except (FileNotFoundError, ValueError, KeyError):
+            diag = None
+    if diag is None or diag.model_sha1 != model_sha1 or diag.last_date_time is None:
+        diag = RegressionDiagnostics(design_matrix(pipeline, data.head(1).drop(columns=[TARGET])).shape[1], model_sha1)
+    else:
+        data = data[data['date_time'] > diag.last_date_time]
+
+    accumulate(diag, pipeline, data, chunk_rows)
+    if save and len(data):
+        try:
+            diag.save(state_path(model_path))
+        except OSError:
+            # cartella del modello in sola lettura: si ricalcola al prossimo avvio
+            pass
+    return diag, len(data)
+
+
+def health_checks(summary, alpha=ALPHA):
+    """
+    Esito delle assunzioni della regressione lineare: lista di (assunzione, indicatore, valore, esito, ok).
+    Solo per pipeline lineari (compile_linear_pipeline riuscita); per gli alberi non hanno significato.
+    """
+    vif = summary['vif']
+    worst = max(vif, key=lambda c: vif[c] if not np.isnan(vif[c]) else -1)
+    dw = summary['durbin_watson']
+    return [
+        ('Normalità dei residui', 'Jarque-Bera (p)', summary['jarque_bera_p'],
+         'residui normali' if summary['jarque_bera_p'] >= alpha else 'residui non normali',
+         summary['jarque_bera_p'] >= alpha),
+        ('Omoschedasticità', 'Breusch-Pagan (p)', summary['breusch_pagan_p'],
+         'varianza costante' if summary['breusch_pagan_p'] >= alpha else 'eteroschedasticità',
+         summary['breusch_pagan_p'] >= alpha),
+        ('Indipendenza', 'Durbin-Watson', dw,
+         'nessuna autocorrelazione' if 1.5 <= dw <= 2.5 else
+         ('autocorrelazione positiva' if dw < 1.5 else 'autocorrelazione negativa'),
+         1.5 <= dw <= 2.5),
+        ('Multicollinearità', f'VIF massimo ({worst})', vif[worst],
+         'contenuta' if vif[worst] <= VIF_THRESHOLD else 'rilevante',
+         vif[worst] <= VIF_THRESHOLD),
+    ]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--data', default=DATA_PATH)
+    parser.add_argument('--model', default=MODEL_PATH)
+    parser.add_argument('--chunk-rows', type=int, default=CHUNK_ROWS)
+    parser.add_argument('--full', action='store_true', help='ignora lo stato salvato e ricalcola da zero')
+    args = parser.parse_args(argv)
+
+    t0 = time.perf_counter()
+    pipeline = load_pipeline(args.model)
+    diag, rows = refresh_diagnostics(pipeline, load_cleaned_data(args.data), args.model, args.chunk_rows, full=args.full)
+    summary = diag.summary()
+    print(f"{rows:,} righe elaborate in {time.perf_counter() - t0:.2f}s ({summary['n']:,} in totale)")
+    print(f"R² {summary['r2']:.4f} (OLS sulle stesse feature {summary['r2_ols']:.4f}), "
+          f"RMSE {summary['rmse']:.1f}, MAE {summary['mae']:.1f}")
+    print(f"Residui: media {summary['resid_mean']:.2f}, asimmetria {summary['skewness']:.3f}, "
+          f"curtosi in eccesso {summary['kurtosis']:.3f}")
+    try:
+        compile_linear_pipeline(pipeline)
+    except ValueError as e:
+        print(f'Verifiche delle assunzioni non applicabili (solo regressione lineare): {e}')
+        return
+    for name, indicator, value, verdict, _ in health_checks(summary):
+        print(f'  {name:<24} {indicator:<26} {value:>10.4g}  {verdict}')
+    print('VIF: ' + ', '.join(f'{col} {v:.2f}' for col, v in summary['vif'].items()))
+
+
+if __name__ == '__main__':
+    main()
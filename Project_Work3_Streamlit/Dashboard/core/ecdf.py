@@ -0,0 +1,99 @@
+"""
+Indice ordinato (ECDF) su traffic_volume per analisi interattive a soglia.
+
+I valori vengono ordinati una volta sola, raggruppati per le combinazioni di dimensioni richieste
+(ora, giorno della settimana, mese, meteo): "quante ore oltre X" e i percentili diventano
+ricerche binarie sulla fetta ordinata, indipendenti dalla dimensione del dataset.
+"""
+import numpy as np
+import pandas as pd
+
+from core.data import TARGET
+
+DIMENSIONS = ('hour', 'day_of_week', 'month', 'weather_main')
+
+
+class ThresholdIndex:
+    """
+    Valori ordinati per ogni combinazione delle dimensioni filtrate.
+    Le tabelle per una combinazione (es. ora + meteo) vengono costruite alla prima richiesta.
+    """
+
+    def __init__(self, df, value_col=TARGET, dimensions=DIMENSIONS):
+        self.values = df[value_col].to_numpy(dtype=float)
+        self._sorted_all = np.sort(self.values)
+        self._codes = {}
+        for dim in dimensions:
+            codes, uniques = pd.factorize(df[dim], sort=True)
+            self._codes[dim] = (codes, {v: i for i, v in enumerate(uniques.tolist())})
+        self._tables = {}
+
+    def categories(self, dim):
+        return list(self._codes[dim][1])
+
+    def _table(self, dims):
+        if dims not in self._tables:
+            # Codice composto delle dimensioni, poi ordinamento per (codice, valore)
+            composite = np.zeros(len(self.values), dtype=np.int64)
+            for dim in dims:
+                codes, lookup = self._codes[dim]
+                composite = composite * (len(lookup) + 1) + (codes + 1)
+            order = np.lexsort((self.values, composite))
+            keys, starts = np.unique(composite[order], return_index=True)
+            ends = np.append(starts[1:], len(order))
+            self._tables[dims] = (keys, starts, ends, self.values[order])
+        return self._tables[dims]
+
+    def sorted_values(self, **filters):
+        """Valori ordinati della fetta selezionata (es. hour=8, weather_main='rain'); vista, nessuna copia."""
+        filters = {k: v for k, v in filters.items() if v is not None}
+        if not filters:
+            return self._sorted_all
+        unknown = set(filters) - set(self._codes)
+        if unknown:
+            raise ValueError(f"dimensioni non indicizzate: {', '.join(sorted(unknown))}")
+        dims = tuple(sorted(filters))
+        key = 0
+        for dim in dims:
+            lookup = self._codes[dim][1]
+            if filters[dim] not in lookup:
+                return self._sorted_all[:0]
+            key = key * (len(lookup) + 1) + lookup[filters[dim]] + 1
+        keys, starts, ends, values = self._table(dims)
+        i = np.searchsorted(keys, key)
+        if i == len(keys) or keys[i] != key:
+            return values[:0]
+        return values[starts[i]:ends[i]]
+
+    def count(self, **filters):
+        return len(self.sorted_values(**filters))
+
+    def count_above(self, threshold, **filters):
+        """Ore con valore strettamente maggiore di `threshold`."""
+        values = self.sorted_values(**filters)
+        return len(values) - int(np.searchsorted(values, threshold, side='right'))
+
+    def share_below(self, value, **filters):
+        """ECDF: quota di ore con valore <= `value` (NaN se la fetta è vuota)."""
+        values = self.sorted_values(**filters)
+        if len(values) == 0:
+            return np.nan
+        return np.searchsorted(values, value, side='right') / len(values)
+
+    def percentile(self, q, **filters):
+        """Percentile `q` (0-100) con interpolazione lineare, come np.percentile, in O(1)."""
+        values = self.sorted_values(**filters)
+        if len(values) == 0:
+            return np.nan
+        pos = (len(values) - 1) * q / 100
+        lo = int(np.floor(pos))
+        hi = min(lo + 1, len(values) - 1)
+        return values[lo] + (values[hi] - values[lo]) * (pos - lo)
+
+    def ecdf_points(self, n_points=200, **filters):
+        """Punti (valore, quota cumulata) della ECDF, sottocampionati per i grafici."""
+        values = self.sorted_values(**filters)
+        if len(values) == 0:
+            return pd.DataFrame({'valore': [], 'quota': []})
+        idx = np.unique(np.linspace(0, len(values) - 1, min(n_points, len(values))).astype(np.int64))
+        return pd.DataFrame({'valore': values[idx], 'quota': (idx + 1) / len(values)})
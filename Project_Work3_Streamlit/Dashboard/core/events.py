@@ -0,0 +1,201 @@
+"""
+Indice degli eventi dello storico: festività ed episodi meteo, per l'analisi del loro impatto.
+
+Costruito una volta per dataset, contiene per ogni evento nome, inizio, fine, durata, posizione
+sulla griglia oraria (core/time_grid.py) e riga del frame di origine, in array ordinati:
+  - festività: il giorno in cui il CSV la segna (una sola ora del giorno), con inizio alle 00:00;
+  - episodi meteo: ore consecutive con la condizione (es. neve, temporale), unendo le interruzioni
+    fino a MERGE_GAP ore.
+Le finestre allineate (es. da -48h a +48h attorno a ogni Thanksgiving) sono una sola lettura
+vettoriale della griglia: posizioni di inizio + offset → matrice eventi × ore (NaN dove
+mancano dati). Sulla griglia c'è anche il traffico tipico della climatologia (core/climatology.py,
+giorni non festivi), così l'impatto di un evento è lo scarto dal traffico atteso.
+
+Uso (dalla cartella Dashboard):
+    python -m core.events [--data dataset/cleaned_data.csv] [--event "Thanksgiving Day"] [--before 48] [--after 48]
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+from core.data import DATA_PATH, TARGET, load_cleaned_data
+from core.time_grid import HOUR, HourlyGrid
+
+HOLIDAY = 'festività'
+WEATHER = 'meteo'
+# Episodi meteo: nome -> (colonna, valori)
+WEATHER_EPISODES = {
+    'Neve': ('weather_main', ('snow',)),
+    'Neve intensa': ('weather_description', ('heavy snow',)),
+    'Temporale': ('weather_main', ('thunderstorm',)),
+    'Pioggia': ('weather_main', ('rain',)),
+    'Nebbia': ('weather_main', ('fog',)),
+}
+MERGE_GAP = 3
+CONFIDENCE = 0.95
+_NO_HOLIDAY = ('none', 'nan', 'nan.0', '')
+
+
+def holiday_days(df):
+    """Festività dello storico: giorni ordinati (datetime64[D]) e nome della prima festività segnata in ciascuno."""
+    names = df['holiday'].astype(str)
+    mask = ~names.str.lower().isin(_NO_HOLIDAY).to_numpy()
+    days = df['date_time'].to_numpy()[mask].astype('datetime64[D]')
+    first = pd.DataFrame({'day': days, 'name': df.loc[mask, 'holiday'].to_numpy()}).drop_duplicates('day')
+    first = first.sort_values('day', kind='stable')
+    return first['day'].to_numpy(), first['name'].to_numpy()
+
+
+def holiday_on(days, names, dt):
+    """Nome della festività del giorno di `dt` (ricerca binaria negli array di holiday_days); None se non c'è."""
+    day = np.datetime64(pd.Timestamp(dt), 'D')
+    i = np.searchsorted(days, day)
+    return names[i] if i < len(days) and days[i] == day else None
+
+
+def _runs(flag, merge_gap=MERGE_GAP):
+    """(inizio, fine esclusa) delle sequenze di True, unendo le interruzioni fino a merge_gap posizioni."""
+    edges = np.diff(np.concatenate(([0], flag.astype(np.int8), [0])))
+    starts, ends = np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+    if len(starts) > 1:
+        keep = np.concatenate(([True], starts[1:] - ends[:-1] > merge_gap))
+        starts, ends = starts[keep], np.concatenate((ends[:-1][keep[1:]], ends[-1:]))
+    return starts, ends
+
+
+class EventIndex:
+    """Eventi dello storico in array ordinati, con griglia oraria del traffico e del traffico atteso."""
+
+    def __init__(self, grid, expected, events):
+        self.grid = grid
+        self.expected = expected
+        self.events = events.reset_index(drop=True)
+        self._names = self.events['evento'].to_numpy()
+        self._pos = self.events['pos'].to_numpy(dtype=np.int64)
+        self._hours = self.events['ore'].to_numpy(dtype=np.int64)
+        self._holiday = (self.events['tipo'] == HOLIDAY).to_numpy()
+
+    @classmethod
+    def from_frame(cls, df, climatology=None, merge_gap=MERGE_GAP):
+        """Indice da un frame dello storico; `climatology` (opzionale) fornisce il traffico atteso."""
+        df = df.sort_values('date_time', kind='stable').reset_index(drop=True)
+        grid = HourlyGrid.from_frame(df)
+        times = df['date_time'].to_numpy().astype('datetime64[h]')
+        row_pos = ((times - grid.start) / HOUR).astype(np.int64)
+        if climatology is not None:
+            expected = climatology.predict_times(grid.times, holidays=np.array([], dtype='datetime64[D]'))
+        else:
+            expected = np.full(len(grid), np.nan)
+
+        parts = []
+        days, names = holiday_days(df)
+        if len(days):
+            pos = ((days.astype('datetime64[h]') - grid.start) / HOUR).astype(np.int64)
+            parts.append(pd.DataFrame({'tipo': HOLIDAY, 'evento': [str(n).title() for n in names],
+                                       'pos': pos, 'ore': 24}))
+        for name, (col, values) in WEATHER_EPISODES.items():
+            flag = np.zeros(len(grid), dtype=bool)
+            flag[row_pos] = df[col].astype(str).str.lower().isin(values).to_numpy()
+            starts, ends = _runs(flag, merge_gap)
+            if len(starts):
+                parts.append(pd.DataFrame({'tipo': WEATHER, 'evento': name, 'pos': starts, 'ore': ends - starts}))
+        events = pd.concat(parts, ignore_index=True) if parts else pd.DataFrame(columns=['tipo', 'evento', 'pos', 'ore'])
+        events['pos'] = events['pos'].astype(np.int64)
+        events['ore'] = events['ore'].astype(np.int64)
+        events['inizio'] = grid.start + events['pos'].to_numpy() * HOUR
+        events['fine'] = events['inizio'] + events['ore'].to_numpy() * HOUR
+        # Prima riga del frame a partire dall'inizio dell'evento
+        events['riga'] = np.searchsorted(row_pos, events['pos'].to_numpy())
+        events = events.sort_values(['evento', 'pos'], kind='stable')
+        return cls(grid, expected, events[['tipo', 'evento', 'inizio', 'fine', 'ore', 'pos', 'riga']])
+
+    def catalog(self):
+        """Tipi di evento: tipo, evento, numero di occorrenze, durata media (ore)."""
+        out = self.events.groupby(['tipo', 'evento'], sort=True).agg(occorrenze=('pos', 'size'), durata_media=('ore', 'mean'))
+        return out.reset_index()
+
+    def _select(self, name, min_hours):
+        """Maschera delle occorrenze di `name`; la durata minima vale solo per gli episodi meteo."""
+        return (self._names == name) & (self._holiday | (self._hours >= min_hours))
+
+    def occurrences(self, name, min_hours=1):
+        """Occorrenze dell'evento `name`; per gli episodi meteo solo quelli lunghi almeno `min_hours` ore."""
+        return self.events[self._select(name, min_hours)]
+
+    def windows(self, name, before=48, after=48, min_hours=1, series=TARGET):
+        """
+        Finestre allineate all'inizio di ogni occorrenza: (offset in ore, matrice occorrenze × offset)
+        con `series` = traffic_volume, 'atteso' o 'scarto' (traffico - atteso). NaN fuori dalla griglia.
+        """
+        offsets = np.arange(-int(before), int(after) + 1)
+        starts = self._pos[self._select(name, min_hours)]
+        if series == TARGET:
+            values = self.grid.values
+        elif series == 'atteso':
+            values = self.expected
+        elif series == 'scarto':
+            values = self.grid.values - self.expected
+        else:
+            raise ValueError(f'serie sconosciuta: {series}')
+        pos = starts[:, None] + offsets[None, :]
+        inside = (pos >= 0) & (pos < len(values))
+        out = np.take(values, np.clip(pos, 0, len(values) - 1))
+        out[~inside] = np.nan
+        return offsets, out
+
+    def impact_curve(self, name, before=48, after=48, min_hours=1, confidence=CONFIDENCE):
+        """
+        Curva media attorno all'evento, per offset: traffico medio, traffico atteso medio, scarto medio
+        con intervallo di confidenza (t di Student) e numero di occorrenze con dati.
+        """
+        offsets, actual = self.windows(name, before, after, min_hours, TARGET)
+        _, expected = self.windows(name, before, after, min_hours, 'atteso')
+        diff = actual - expected
+        n = np.sum(~np.isnan(diff), axis=0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = np.nansum(diff, axis=0) / n
+            std = np.sqrt(np.nansum((diff - mean) ** 2, axis=0) / (n - 1))
+            half = stats.t.ppf(0.5 + confidence / 2, np.maximum(n - 1, 1)) * std / np.sqrt(n)
+        half = np.where(n >= 2, half, np.nan)
+        with np.errstate(invalid='ignore'):
+            traffic = np.nansum(np.where(np.isnan(diff), np.nan, actual), axis=0) / n
+            typical = np.nansum(np.where(np.isnan(diff), np.nan, expected), axis=0) / n
+        return pd.DataFrame({
+            'offset': offsets,
+            'traffico': traffic,
+            'atteso': typical,
+            'scarto': mean,
+            'scarto_inf': mean - half,
+            'scarto_sup': mean + half,
+            'occorrenze': n,
+        })
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--data', default=DATA_PATH)
+    parser.add_argument('--event', default='Thanksgiving Day')
+    parser.add_argument('--before', type=int, default=48)
+    parser.add_argument('--after', type=int, default=48)
+    parser.add_argument('--min-hours', type=int, default=1, help='durata minima degli episodi meteo')
+    args = parser.parse_args(argv)
+
+    from core.climatology import Climatology
+
+    df = load_cleaned_data(args.data)
+    t0 = time.perf_counter()
+    index = EventIndex.from_frame(df, Climatology.from_frame(df))
+    t1 = time.perf_counter()
+    curve = index.impact_curve(args.event, args.before, args.after, args.min_hours)
+    t2 = time.perf_counter()
+    print(f"Indice di {len(index.events):,} eventi in {(t1 - t0) * 1000:.1f} ms, "
+          f"curva di '{args.event}' in {(t2 - t1) * 1000:.2f} ms")
+    print(index.catalog().to_string(index=False))
+    print(curve.iloc[::6].round(1).to_string(index=False))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,202 @@
+"""
+Feature store su disco: matrice delle feature già codificata, target e vocabolari delle categorie
+salvati come .npy (aperti in memory-map) più un manifest JSON.
+
+Il CSV viene letto e le categorie codificate una sola volta; addestramento, backtest e
+inferenza batch aprono poi lo store senza copie, e i processi worker condividono le
+stesse pagine tramite la page cache del sistema operativo.
+
+Uso (dalla cartella Dashboard):
+    python -m core.feature_store [--data dataset/cleaned_data.csv] [--out feature_store]
+"""
+import argparse
+import hashlib
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from core.data import CATEGORICAL_FEATURES, DATA_PATH, NUMERIC_FEATURES, TARGET
+
+FEATURE_STORE_DIR = 'feature_store'
+MANIFEST = 'manifest.json'
+FORMAT_VERSION = 2
+
+# Stesso ordine di colonne in uscita dal ColumnTransformer delle pipeline (prima le categoriche)
+COLUMNS = CATEGORICAL_FEATURES + NUMERIC_FEATURES
+
+
+def file_checksum(path, chunk_size=1 << 20):
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _to_json_scalar(value):
+    return value.item() if isinstance(value, np.generic) else value
+
+
+def build_vocabularies(df):
+    """Vocabolario ordinato di ogni colonna categorica (stesso ordine delle categorie di OrdinalEncoder)."""
+    return {col: [_to_json_scalar(v) for v in np.unique(df[col].to_numpy())] for col in CATEGORICAL_FEATURES}
+
+
+def encode_frame(df, vocab):
+    """Matrice float32 (righe x COLUMNS): codici delle categorie (-1 se sconosciute) e numeriche grezze."""
+    X = np.empty((len(df), len(COLUMNS)), dtype=np.float32)
+    for j, col in enumerate(CATEGORICAL_FEATURES):
+        X[:, j] = pd.Categorical(df[col].to_numpy(), categories=vocab[col]).codes
+    for j, col in enumerate(NUMERIC_FEATURES, start=len(CATEGORICAL_FEATURES)):
+        X[:, j] = df[col].to_numpy(dtype=np.float32)
+    return X
+
+
+def _save(out_dir, name, arr):
+    # Scrittura atomica: chi ha lo store aperto in memory-map continua a leggere il file precedente
+    tmp = os.path.join(out_dir, f'.{name}.tmp.npy')
+    np.save(tmp, arr)
+    os.replace(tmp, os.path.join(out_dir, f'{name}.npy'))
+
+
+def build_feature_store(data_path=DATA_PATH, out_dir=FEATURE_STORE_DIR):
+    """Legge il CSV, codifica le feature e scrive lo store. Restituisce il manifest."""
+    df = pd.read_csv(data_path, parse_dates=['date_time'])
+    df = df.sort_values('date_time', kind='stable').reset_index(drop=True)
+    vocab = build_vocabularies(df)
+
+    os.makedirs(out_dir, exist_ok=True)
+    _save(out_dir, 'X', encode_frame(df, vocab))
+    _save(out_dir, 'y', df[TARGET].to_numpy(dtype=np.float32))
+    _save(out_dir, 'date_time', df['date_time'].to_numpy(dtype='datetime64[ns]'))
+
+    manifest = {
+        'version': FORMAT_VERSION,
+        'source': os.path.abspath(data_path),
+        'source_sha1': file_checksum(data_path),
+        'rows': len(df),
+        'columns': COLUMNS,
+        'categorical': CATEGORICAL_FEATURES,
+        'numeric': NUMERIC_FEATURES,
+        'target': TARGET,
+        'vocabularies': vocab,
+        # dtype delle categoriche nel CSV: to_frame le ricostruisce uguali (es. hour float, is_weekend bool)
+        'dtypes': {col: str(df[col].dtype) for col in CATEGORICAL_FEATURES},
+        'first_date_time': df['date_time'].min().isoformat(),
+        'last_date_time': df['date_time'].max().isoformat(),
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+    tmp = os.path.join(out_dir, MANIFEST + '.tmp')
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, ensure_ascii=False)
+    os.replace(tmp, os.path.join(out_dir, MANIFEST))
+    return manifest
+
+
+def is_fresh(store_dir=FEATURE_STORE_DIR, data_path=DATA_PATH):
+    """True se lo store esiste ed è stato costruito dalla versione attuale del CSV."""
+    try:
+        with open(os.path.join(store_dir, MANIFEST), encoding='utf-8') as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        return False
+    return manifest.get('version') == FORMAT_VERSION and manifest.get('source_sha1') == file_checksum(data_path)
+
+
+class FeatureStore:
+    """Store aperto in sola lettura: X, y e date_time sono array in memory-map (nessuna copia)."""
+
+    def __init__(self, store_dir=FEATURE_STORE_DIR):
+        self.store_dir = store_dir
+        with open(os.path.join(store_dir, MANIFEST), encoding='utf-8') as f:
+            self.manifest = json.load(f)
+        if self.manifest.get('version') != FORMAT_VERSION:
+            raise ValueError(f"versione dello store non supportata: {self.manifest.get('version')}")
+        self.X = np.load(os.path.join(store_dir, 'X.npy'), mmap_mode='r')
+        self.y = np.load(os.path.join(store_dir, 'y.npy'), mmap_mode='r')
+        self.date_time = np.load(os.path.join(store_dir, 'date_time.npy'), mmap_mode='r')
+        self.columns = self.manifest['columns']
+        self.vocabularies = self.manifest['vocabularies']
+
+    def __len__(self):
+        return self.manifest['rows']
+
+    def column(self, name):
+        return self.X[:, self.columns.index(name)]
+
+    def encode(self, df):
+        """Codifica nuove righe (es. input di inferenza) con i vocabolari dello store."""
+        return encode_frame(df, self.vocabularies)
+
+    def to_frame(self, rows=slice(None)):
+        """
+        Ricostruisce le feature originali (categorie decodificate, stessi dtype del CSV), es. per
+        addestrare una Pipeline che riceverà poi le righe della dashboard.
+        """
+        data = {}
+        for col in self.manifest['categorical']:
+            codes = self.column(col)[rows].astype(np.int64)
+            dtype = self.manifest['dtypes'][col]
+            if dtype.startswith(('float', 'int', 'bool')):
+                vocab = np.asarray(self.vocabularies[col], dtype=dtype)
+                if (codes < 0).any():
+                    # categoria assente dal vocabolario: NaN (non rappresentabile come bool)
+                    vocab = np.append(vocab.astype(float), np.nan)
+                data[col] = vocab[codes]
+            else:
+                vocab = np.asarray(self.vocabularies[col], dtype=object)
+                data[col] = np.where(codes >= 0, vocab[np.clip(codes, 0, None)], None)
+        for col in self.manifest['numeric']:
+            data[col] = np.asarray(self.column(col)[rows], dtype=np.float64)
+        frame = pd.DataFrame(data)
+        frame['date_time'] = pd.to_datetime(np.asarray(self.date_time[rows]))
+        return frame
+
+    def pipeline_inputs(self, pipeline, rows=slice(None)):
+        """
+        Input già trasformati per `pipeline[-1]`, applicando l'OrdinalEncoder e lo StandardScaler
+        addestrati della pipeline direttamente sui codici dello store (niente DataFrame né stringhe).
+        Solo per pipeline con preprocessore ('ord_enc', 'scaler') come in training/pipelines.py.
+        """
+        pre = pipeline.named_steps.get('preprocessor')
+        transformers = getattr(pre, 'named_transformers_', {})
+        if 'ord_enc' not in transformers or 'scaler' not in transformers:
+            raise ValueError('la pipeline non usa il preprocessore ordinale + scaler')
+        enc, scaler = transformers['ord_enc'], transformers['scaler']
+
+        X = np.asarray(self.X[rows], dtype=np.float32)
+        out = np.empty_like(X)
+        n_cat = len(self.manifest['categorical'])
+        for j, (col, cats) in enumerate(zip(self.manifest['categorical'], enc.categories_)):
+            # Codice dello store -> codice della pipeline (-1 per categorie mai viste in addestramento)
+            lut = pd.Categorical(self.vocabularies[col], categories=list(cats)).codes.astype(np.float32)
+            lut = np.append(lut, np.float32(-1))  # posizione -1: sconosciuta anche nello store
+            out[:, j] = lut[X[:, j].astype(np.int64)]
+        out[:, n_cat:] = (X[:, n_cat:] - scaler.mean_) / scaler.scale_
+        return out
+
+
+def open_feature_store(store_dir=FEATURE_STORE_DIR, data_path=None):
+    """Apre lo store; con `data_path` lo ricostruisce prima se manca o se il CSV è cambiato."""
+    if data_path is not None and not is_fresh(store_dir, data_path):
+        build_feature_store(data_path, store_dir)
+    return FeatureStore(store_dir)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--data', default=DATA_PATH)
+    parser.add_argument('--out', default=FEATURE_STORE_DIR)
+    args = parser.parse_args(argv)
+
+    t0 = time.perf_counter()
+    manifest = build_feature_store(args.data, args.out)
+    print(f"Feature store in {args.out}: {manifest['rows']:,} righe x {len(manifest['columns'])} colonne "
+          f"({time.perf_counter() - t0:.1f}s)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,204 @@
+import statistics
+from collections import Counter
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from core.events import holiday_days, holiday_on
+from core.time_grid import HourlyGrid
+
+# Orizzonti di previsione mostrati nel form (ordine della UI)
+HORIZON_CHOICES = ("Ora successiva", "Oggi", "Oggi e Domani", "Prossimi 3gg", "Prossima settimana", "Prossimo mese")
+
+
+def choose_weather_from_last12(combined_df, ref_dt):
+    # prende le ultime 12 righe antecedenti a ref_dt (escluse)
+    cutoff = ref_dt - pd.Timedelta(hours=12)
+    sel = combined_df[(combined_df['date_time'] > cutoff) & (combined_df['date_time'] < ref_dt)]
+    if sel.empty:
+        return None, None, np.nan, 0.0, 0.0, 0.0
+    main = sel['weather_main'].mode()
+    desc = sel['weather_description'].mode()
+    clouds = sel['clouds_all'].median()
+    temp = sel['temp'].iloc[-1] if 'temp' in sel.columns else sel['temp'].mean()
+    rain = sel['rain_1h'].max() if 'rain_1h' in sel.columns else 0.0
+    snow = sel['snow_1h'].max() if 'snow_1h' in sel.columns else 0.0
+    return (main.iloc[0] if not main.empty else None,
+            desc.iloc[0] if not desc.empty else None,
+            temp,
+            rain,
+            snow,
+            clouds)
+
+
+def select_weather(working, ref_dt):
+    """Meteo delle ultime 12h; se non ci sono dati recenti usa l'ultimo record disponibile."""
+    weather = choose_weather_from_last12(working, ref_dt)
+    if weather[0] is not None:
+        return weather
+    # fallback: prendi ultimo record
+    last = working.iloc[-1]
+    return (last['weather_main'],
+            last['weather_description'],
+            last['temp'],
+            last.get('rain_1h', 0.0),
+            last.get('snow_1h', 0.0),
+            last.get('clouds_all', 0.0))
+
+
+def build_feature_row(dt, holiday, is_weekend, weather_main, weather_desc, temp, rain, snow, clouds, lag_1, lag_24, lag_168):
+    return {
+        'date_time': dt,
+        'holiday': holiday,
+        'temp': float(temp),
+        'rain_1h': float(rain),
+        'snow_1h': float(snow),
+        'clouds_all': float(clouds),
+        'weather_main': weather_main,
+        'weather_description': weather_desc,
+        'hour': float(dt.hour),
+        'day_of_week': float(dt.weekday()),
+        'month': float(dt.month),
+        'year': float(dt.year),
+        'is_weekend': bool(is_weekend),
+        'lag_1': float(lag_1),
+        'lag_24': float(lag_24),
+        'lag_168': float(lag_168)
+    }
+
+
+def features_to_frame(rows):
+    """DataFrame per il predict (no date_time) a partire da una lista di righe feature."""
+    X = pd.DataFrame(rows)
+    X = X.drop(columns=['date_time'])
+    # assicurarsi tipi giusti
+    X['holiday'] = X['holiday'].astype(object)
+    X['weather_main'] = X['weather_main'].astype(object)
+    X['weather_description'] = X['weather_description'].astype(object)
+    return X
+
+
+def _mode(values):
+    # Come Series.mode().iloc[0]: il più frequente, a parità il minore
+    counts = Counter(v for v in values if v is not None and v == v)
+    if not counts:
+        return None
+    top = max(counts.values())
+    return min(v for v, c in counts.items() if c == top)
+
+
+def _valid(window, field):
+    return [r[field] for r in window if pd.notna(r[field])]
+
+
+def _weather(window):
+    """Stesse regole di `choose_weather_from_last12` su una lista di righe (dict); i NaN sono ignorati come in pandas."""
+    rain, snow, clouds = _valid(window, 'rain_1h'), _valid(window, 'snow_1h'), _valid(window, 'clouds_all')
+    return (_mode(r['weather_main'] for r in window),
+            _mode(r['weather_description'] for r in window),
+            window[-1]['temp'],
+            max(rain) if rain else np.nan,
+            max(snow) if snow else np.nan,
+            statistics.median(clouds) if clouds else np.nan)
+
+
+def exogenous_rows(working, start_dt, hours):
+    """
+    Righe feature (lag a 0) delle prossime `hours` ore, con le regole di `select_weather`: il meteo
+    dipende solo dalle righe precedenti (storiche o generate), non dal traffico predetto, quindi
+    si calcola una volta sola su una finestra mobile di 12 ore invece di riscandire lo storico.
+    """
+    fields = ('date_time', 'weather_main', 'weather_description', 'temp', 'rain_1h', 'snow_1h', 'clouds_all')
+    recent = working.loc[working['date_time'] > start_dt - pd.Timedelta(hours=12), list(fields)]
+    window = recent.to_dict('records')
+    last = working.iloc[-1]
+    hol_days, hol_names = holiday_days(working)
+    rows = []
+    dt = start_dt
+    for _ in range(int(hours)):
+        cutoff = dt - pd.Timedelta(hours=12)
+        window = [r for r in window if cutoff < r['date_time'] < dt]
+        if window and _mode(r['weather_main'] for r in window) is not None:
+            weather = _weather(window)
+        else:
+            # stesso fallback di select_weather: ultimo record disponibile
+            src = rows[-1] if rows else last
+            weather = (src['weather_main'], src['weather_description'], src['temp'],
+                       src.get('rain_1h', 0.0), src.get('snow_1h', 0.0), src.get('clouds_all', 0.0))
+        row = build_feature_row(dt, holiday_on(hol_days, hol_names, dt), dt.weekday() >= 5, *weather, 0.0, 0.0, 0.0)
+        rows.append(row)
+        window.append({f: row[f] for f in fields})
+        dt = dt + pd.Timedelta(hours=1)
+    return rows
+
+
+def hours_for_choice(choice, start_dt):
+    """Calcolo ore da prevedere in base alla scelta (a partire da start_dt)."""
+    if choice == "Ora successiva":
+        return 1
+    elif choice == "Oggi":
+        end_dt = datetime.combine(start_dt.date(), datetime.max.time()).replace(hour=23, minute=0, second=0, microsecond=0)
+        return max(1, int((end_dt - start_dt) / pd.Timedelta(hours=1)) + 1)
+    elif choice == "Oggi e Domani":
+        end_dt = datetime.combine((start_dt + pd.Timedelta(days=1)).date(), datetime.max.time()).replace(hour=23, minute=0, second=0, microsecond=0)
+        return max(1, int((end_dt - start_dt) / pd.Timedelta(hours=1)) + 1)
+    elif choice == "Prossimi 3gg":
+        return 72
+    elif choice == "Prossima settimana":
+        return 168
+    elif choice == "Prossimo mese":
+        return 720
+    return 1
+
+
+def iter_forecast(pipeline, working, start_dt, hours_to_forecast):
+    """
+    Previsione ricorsiva ora per ora a partire da start_dt.
+    Ad ogni passo restituisce (dt, yhat, riga_feature_con_target). Calendario e meteo di tutte le
+    ore vengono calcolati prima del ciclo (`exogenous_rows`); nel ciclo restano i lag, letti dalla
+    griglia oraria in cui vengono scritte le predizioni.
+    Eventuali errori del modello vengono propagati al chiamante.
+    """
+    rows = exogenous_rows(working, start_dt, hours_to_forecast)
+    # valore iniziale per lag_1 = ultimo traffico del dataset
+    last_known_traffic = working['traffic_volume'].iloc[-1]
+
+    # griglia oraria per i lag: ricerca O(1) invece di una scansione di `working` a ogni passo
+    grid = HourlyGrid.from_frame(working, end=start_dt + pd.Timedelta(hours=int(hours_to_forecast)))
+
+    for feat in rows:
+        current_dt = feat['date_time']
+
+        # lag_1 è l'ultimo valore noto (predetto o reale)
+        lag_1_val = last_known_traffic
+
+        # lag_24 e lag_168 dalla griglia (storico + predizioni); ore mancanti -> lag_1
+        lag_24_val = grid.value_at(current_dt - pd.Timedelta(hours=24))
+        lag_168_val = grid.value_at(current_dt - pd.Timedelta(hours=168))
+        if np.isnan(lag_24_val):
+            lag_24_val = lag_1_val
+        if np.isnan(lag_168_val):
+            lag_168_val = lag_1_val
+        feat.update(lag_1=float(lag_1_val), lag_24=float(lag_24_val), lag_168=float(lag_168_val))
+
+        yhat = pipeline.predict(features_to_frame([feat]))[0]
+        yhat = int(max(0, yhat))
+
+        new_row = {**feat}
+        new_row['traffic_volume'] = yhat
+        yield current_dt, yhat, new_row
+
+        if np.isnan(grid.value_at(current_dt)):
+            grid.set(current_dt, yhat)
+        last_known_traffic = yhat
+
+
+def recursive_forecast(pipeline, working, start_dt, hours_to_forecast):
+    """Versione non incrementale di iter_forecast: restituisce (preds, righe_generate)."""
+    preds = []
+    rows = []
+    for dt, yhat, row in iter_forecast(pipeline, working, start_dt, hours_to_forecast):
+        preds.append({'date_time': dt, 'traffic_volume': yhat})
+        rows.append(row)
+    return preds, rows
@@ -0,0 +1,125 @@
+"""
+Percorso veloce per la pipeline lineare (OneHotEncoder + StandardScaler + Ridge).
+
+La predizione della pipeline è intercetta + contributo di ogni categoria + pesi delle numeriche
+standardizzate: `compile_linear_pipeline` ripiega encoder e scaler in tabelle di lookup e in un
+vettore di pesi, così una predizione costa qualche gather e un prodotto scalare invece di un
+transform sklearn completo. `iter_linear_forecast` sfrutta la linearità nei lag per la
+previsione ricorsiva: le feature esogene (calendario, meteo) vengono calcolate una volta sola
+e il ciclo ora per ora si riduce a y_t = base_t + w1*lag_1 + w24*lag_24 + w168*lag_168.
+"""
+import numpy as np
+import pandas as pd
+from sklearn.compose import ColumnTransformer
+from sklearn.preprocessing import OneHotEncoder, StandardScaler
+
+from core.forecast import exogenous_rows, features_to_frame
+from core.time_grid import HourlyGrid
+
+LAG_FEATURES = ('lag_1', 'lag_24', 'lag_168')
+
+
+class CompiledLinear:
+    """Pipeline lineare compilata: `predict` accetta lo stesso DataFrame della pipeline sklearn."""
+
+    def __init__(self, bias, categorical, numeric):
+        self.bias = float(bias)
+        # {colonna: (categorie, contributi)}; le categorie sconosciute valgono 0 (handle_unknown='ignore')
+        self.categorical = categorical
+        # {colonna: peso già diviso per la scala dello StandardScaler}
+        self.numeric = numeric
+        self._num_cols = list(numeric)
+        self._num_w = np.array([numeric[c] for c in self._num_cols])
+        # Tabelle con uno 0 finale: il codice -1 (categoria sconosciuta) punta lì
+        self._luts = {col: np.append(contrib, 0.0) for col, (_, contrib) in categorical.items()}
+        self._dicts = {col: dict(zip(cats.tolist(), contrib.tolist())) for col, (cats, contrib) in categorical.items()}
+
+    def predict(self, X):
+        y = np.full(len(X), self.bias)
+        for col, (cats, _) in self.categorical.items():
+            codes = pd.Categorical(X[col].to_numpy(), categories=cats).codes
+            y += self._luts[col][codes]
+        y += X[self._num_cols].to_numpy(dtype=float) @ self._num_w
+        return y
+
+    def predict_row(self, row):
+        """Singola riga (dict di `build_feature_row`), senza passare da pandas."""
+        y = self.bias
+        for col, table in self._dicts.items():
+            y += table.get(row[col], 0.0)
+        for col, w in self.numeric.items():
+            y += w * row[col]
+        return y
+
+    def lag_weights(self):
+        return tuple(self.numeric.get(lag, 0.0) for lag in LAG_FEATURES)
+
+
+def compile_linear_pipeline(pipeline):
+    """
+    Compila una Pipeline(ColumnTransformer[OneHotEncoder, StandardScaler], modello lineare).
+    Solleva ValueError se la struttura non è supportata (es. pipeline ad albero).
+    """
+    steps = getattr(pipeline, 'steps', None)
+    if not steps or len(steps) != 2 or not isinstance(steps[0][1], ColumnTransformer):
+        raise ValueError('serve una Pipeline(ColumnTransformer, modello lineare)')
+    pre, model = steps[0][1], steps[1][1]
+    if not hasattr(model, 'coef_') or np.ndim(model.coef_) != 1:
+        raise ValueError(f'{type(model).__name__} non è un regressore lineare')
+    if pre.remainder != 'drop':
+        raise ValueError("il ColumnTransformer deve avere remainder='drop'")
+
+    coef = np.asarray(model.coef_, dtype=float)
+    bias = float(np.ravel(model.intercept_)[0])
+    categorical, numeric = {}, {}
+    offset = 0
+    for _, trans, cols in pre.transformers_:
+        if trans == 'drop':
+            continue
+        if isinstance(trans, OneHotEncoder):
+            if trans.drop_idx_ is not None or getattr(trans, '_infrequent_enabled', False):
+                raise ValueError('OneHotEncoder con drop/categorie rare non supportato')
+            for col, cats in zip(cols, trans.categories_):
+                categorical[col] = (cats, coef[offset:offset + len(cats)].copy())
+                offset += len(cats)
+        elif isinstance(trans, StandardScaler):
+            mean = trans.mean_ if trans.with_mean else np.zeros(len(cols))
+            scale = trans.scale_ if trans.with_std else np.ones(len(cols))
+            w = coef[offset:offset + len(cols)] / scale
+            bias -= float(w @ mean)
+            numeric.update(zip(cols, w))
+            offset += len(cols)
+        else:
+            raise ValueError(f'trasformatore non supportato: {type(trans).__name__}')
+    if offset != len(coef):
+        raise ValueError('numero di coefficienti diverso dalle colonne trasformate')
+    return CompiledLinear(bias, categorical, numeric)
+
+
+def iter_linear_forecast(compiled, working, start_dt, hours_to_forecast):
+    """
+    Equivalente di `iter_forecast` per una pipeline lineare compilata: stesse feature e
+    stesse regole per i lag, ma il modello viene valutato una volta sola su tutte le ore.
+    """
+    rows = exogenous_rows(working, start_dt, hours_to_forecast)
+    if not rows:
+        return
+    base = compiled.predict(features_to_frame(rows))
+    w1, w24, w168 = compiled.lag_weights()
+    grid = HourlyGrid.from_frame(working, end=start_dt + pd.Timedelta(hours=int(hours_to_forecast)))
+    lag_1 = working['traffic_volume'].iloc[-1]
+    for row, b in zip(rows, base):
+        dt = row['date_time']
+        lag_24 = grid.value_at(dt - pd.Timedelta(hours=24))
+        lag_168 = grid.value_at(dt - pd.Timedelta(hours=168))
+        if np.isnan(lag_24):
+            lag_24 = lag_1
+        if np.isnan(lag_168):
+            lag_168 = lag_1
+        yhat = int(max(0, b + w1 * lag_1 + w24 * lag_24 + w168 * lag_168))
+        new_row = {**row, 'lag_1': float(lag_1), 'lag_24': float(lag_24), 'lag_168': float(lag_168),
+                   'traffic_volume': yhat}
+        yield dt, yhat, new_row
+        if np.isnan(grid.value_at(dt)):
+            grid.set(dt, yhat)
+        lag_1 = yhat
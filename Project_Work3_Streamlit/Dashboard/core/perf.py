@@ -0,0 +1,223 @@
+"""
+Strumentazione leggera delle pagine: tempi per sezione, righe elaborate e cache hit/miss.
+
+Attivazione:
+- variabile d'ambiente `DASHBOARD_PERF=1` (tutte le sessioni), oppure
+- parametro `?diag=1` nell'URL (solo la sessione corrente).
+
+Da disattivata ogni sezione si riduce a un controllo su una variabile thread-local.
+Da attivata, alla fine di ogni rerun le misure vengono accodate in
+`perf_logs/timings.jsonl` e il riepilogo aggregato del processo viene riscritto
+in formato Prometheus in `perf_logs/metrics.prom` (cartella da `DASHBOARD_PERF_DIR`).
+"""
+import functools
+import json
+import os
+import threading
+import time
+from datetime import datetime
+
+import pandas as pd
+import streamlit as st
+
+PERF_ENV = 'DASHBOARD_PERF'
+PERF_DIR = os.environ.get('DASHBOARD_PERF_DIR', 'perf_logs')
+QUERY_PARAM = 'diag'
+
+# Quanti rerun tenere in sessione per il pannello
+MAX_RUNS = 20
+
+# Stato del rerun corrente: ogni sessione Streamlit esegue lo script nel proprio thread
+_local = threading.local()
+
+# Aggregato di processo (tutte le sessioni), esportato in formato Prometheus
+_totals = {}
+_totals_lock = threading.Lock()
+
+
+class _Run:
+    def __init__(self, page):
+        self.page = page
+        self.started = time.perf_counter()
+        self.timestamp = datetime.now().isoformat(timespec='seconds')
+        self.sections = {}
+        self.stack = []
+
+    def add(self, name, ms, rows=None, cache=None):
+        s = self.sections.setdefault(name, {'calls': 0, 'ms': 0.0, 'rows': 0, 'hits': 0, 'misses': 0})
+        s['calls'] += 1
+        s['ms'] += ms
+        if rows is not None:
+            s['rows'] += int(rows)
+        if cache == 'hit':
+            s['hits'] += 1
+        elif cache == 'miss':
+            s['misses'] += 1
+
+
+class _Section:
+    """Context manager di una sezione misurata; `rows` può essere impostato nel corpo."""
+
+    def __init__(self, run, name, cached, rows=None):
+        self.run = run
+        self.name = name
+        self.rows = rows
+        # Per le funzioni in cache: hit, a meno che cache_probe non segnali l'esecuzione del corpo
+        self.cache = 'hit' if cached else None
+
+    def __enter__(self):
+        self.run.stack.append(self)
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        ms = (time.perf_counter() - self.t0) * 1000
+        self.run.stack.pop()
+        self.run.add(self.name, ms, self.rows, self.cache)
+        return False
+
+
+class _NullSection:
+    """Sezione no-op usata quando la strumentazione è disattivata."""
+    rows = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL = _NullSection()
+
+
+def _current():
+    return getattr(_local, 'run', None)
+
+
+def start_run(page):
+    """Da chiamare in testa alla pagina: apre la raccolta delle misure per questo rerun."""
+    enabled = os.environ.get(PERF_ENV) == '1' or st.query_params.get(QUERY_PARAM) == '1'
+    _local.run = _Run(page) if enabled else None
+
+
+def section(name, cached=False, rows=None):
+    """Context manager che misura un blocco della pagina (tab, grafico, caricamento dati)."""
+    run = _current()
+    if run is None:
+        return _NULL
+    return _Section(run, name, cached, rows)
+
+
+def timed(name):
+    """Decoratore: misura la funzione e usa len() del primo argomento (il frame in ingresso) come righe elaborate."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            run = _current()
+            if run is None:
+                return fn(*args, **kwargs)
+            rows = len(args[0]) if args and hasattr(args[0], '__len__') else None
+            with _Section(run, name, cached=False, rows=rows):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def cache_probe(fn):
+    """
+    Da applicare sotto @st.cache_data/@st.cache_resource: se il corpo viene eseguito
+    è un cache miss, e la sezione aperta con `cached=True` lo registra come tale.
+    """
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        run = _current()
+        if run is not None and run.stack:
+            run.stack[-1].cache = 'miss'
+        return fn(*args, **kwargs)
+    return wrapper
+
+
+class _TimedPredictor:
+    """Proxy del modello che misura ogni chiamata a predict()."""
+
+    def __init__(self, model):
+        self._model = model
+        self.predict = timed('pipeline.predict')(model.predict)
+
+    def __getattr__(self, attr):
+        return getattr(self._model, attr)
+
+
+def instrument_model(model):
+    """Restituisce il modello così com'è se la strumentazione è spenta, altrimenti un proxy misurato."""
+    if model is None or _current() is None:
+        return model
+    return _TimedPredictor(model)
+
+
+def _export(run, total_ms):
+    os.makedirs(PERF_DIR, exist_ok=True)
+    with open(os.path.join(PERF_DIR, 'timings.jsonl'), 'a', encoding='utf-8') as f:
+        f.write(json.dumps({'ts': run.timestamp, 'page': run.page, 'total_ms': round(total_ms, 3), 'sections': run.sections}) + '\n')
+
+    with _totals_lock:
+        for name, s in run.sections.items():
+            t = _totals.setdefault((run.page, name), {'calls': 0, 'ms': 0.0, 'rows': 0, 'hits': 0, 'misses': 0})
+            for k in t:
+                t[k] += s[k]
+        lines = [
+            '# HELP dashboard_section_seconds Tempo speso per sezione della dashboard.',
+            '# TYPE dashboard_section_seconds summary',
+        ]
+        for (page, name), t in sorted(_totals.items()):
+            labels = f'page="{page}",section="{name}"'
+            lines.append(f'dashboard_section_seconds_sum{{{labels}}} {t["ms"] / 1000:.6f}')
+            lines.append(f'dashboard_section_seconds_count{{{labels}}} {t["calls"]}')
+        for metric, key, help_text in (
+            ('dashboard_section_rows_total', 'rows', 'Righe elaborate per sezione.'),
+            ('dashboard_cache_hits_total', 'hits', 'Cache hit per sezione.'),
+            ('dashboard_cache_misses_total', 'misses', 'Cache miss per sezione.'),
+        ):
+            lines.append(f'# HELP {metric} {help_text}')
+            lines.append(f'# TYPE {metric} counter')
+            for (page, name), t in sorted(_totals.items()):
+                lines.append(f'{metric}{{page="{page}",section="{name}"}} {t[key]}')
+        tmp_path = os.path.join(PERF_DIR, 'metrics.prom.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.replace(tmp_path, os.path.join(PERF_DIR, 'metrics.prom'))
+
+
+def _runs_to_frame(sections):
+    rows = [
+        {'Sezione': name, 'Chiamate': s['calls'], 'Tempo (ms)': round(s['ms'], 2), 'Righe': s['rows'],
+         'Cache hit': s['hits'], 'Cache miss': s['misses']}
+        for name, s in sections.items()
+    ]
+    return pd.DataFrame(rows).sort_values('Tempo (ms)', ascending=False) if rows else pd.DataFrame()
+
+
+def end_run():
+    """Da chiamare in fondo alla pagina: esporta le misure e mostra il pannello diagnostico."""
+    run = _current()
+    if run is None:
+        return
+    _local.run = None
+    total_ms = (time.perf_counter() - run.started) * 1000
+    try:
+        _export(run, total_ms)
+    except OSError as e:
+        st.sidebar.warning(f"Diagnostica: impossibile scrivere in '{PERF_DIR}': {e}")
+
+    history = st.session_state.setdefault('_perf_runs', [])
+    history.append({'ts': run.timestamp, 'page': run.page, 'total_ms': total_ms, 'sections': run.sections})
+    del history[:-MAX_RUNS]
+
+    with st.sidebar.expander("🛠️ Diagnostica prestazioni", expanded=True):
+        labels = [f"{r['ts']} · {r['page']} · {r['total_ms']:.0f} ms" for r in reversed(history)]
+        idx = st.selectbox("Rerun", range(len(labels)), format_func=lambda i: labels[i], key='_perf_run_idx')
+        selected = list(reversed(history))[idx or 0]
+        st.metric("Tempo totale rerun", f"{selected['total_ms']:.0f} ms")
+        st.dataframe(_runs_to_frame(selected['sections']), hide_index=True, width='stretch')
+        st.caption(f"Export: `{PERF_DIR}/timings.jsonl`, `{PERF_DIR}/metrics.prom`")
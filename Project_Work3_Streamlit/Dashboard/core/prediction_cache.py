@@ -0,0 +1,98 @@
+import threading
+from collections import OrderedDict
+from datetime import datetime
+
+import numpy as np
+
+from core.forecast import build_feature_row, features_to_frame
+
+# Ordine delle feature nella chiave della cache (tutte quelle passate al modello)
+KEY_FIELDS = ('holiday', 'temp', 'rain_1h', 'snow_1h', 'clouds_all', 'weather_main', 'weather_description',
+              'hour', 'day_of_week', 'month', 'year', 'is_weekend', 'lag_1', 'lag_24', 'lag_168')
+
+
+def feature_key(row):
+    """Chiave normalizzata: float arrotondati, così il rumore da slider/number_input non crea chiavi diverse."""
+    return tuple(
+        round(float(row[field]), 4) if isinstance(row[field], (float, np.floating)) else row[field]
+        for field in KEY_FIELDS
+    )
+
+
+def model_predict_fn(model):
+    """Adatta una pipeline sklearn all'interfaccia predict_fn(righe_feature) della cache."""
+    return lambda rows: model.predict(features_to_frame(rows))
+
+
+class PredictionCache:
+    """
+    Cache LRU delle predizioni singole, condivisa tra le sessioni (thread-safe).
+    Le righe mancanti vengono predette con un'unica chiamata batch al modello.
+    """
+
+    def __init__(self, maxsize=8192):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def predict_rows(self, predict_fn, rows):
+        """
+        Predizioni (int >= 0) per una lista di righe feature, usando la cache dove possibile.
+        `predict_fn` riceve le sole righe mancanti (vedi `model_predict_fn`).
+        """
+        keys = [feature_key(r) for r in rows]
+        out = [None] * len(rows)
+        missing = []
+        with self._lock:
+            for i, key in enumerate(keys):
+                if key in self._data:
+                    self._data.move_to_end(key)
+                    out[i] = self._data[key]
+                    self.hits += 1
+                else:
+                    missing.append(i)
+            self.misses += len(missing)
+
+        if missing:
+            # Duplicati nella stessa richiesta: una sola riga per chiave
+            unique = list(dict.fromkeys(keys[i] for i in missing))
+            first_row = {keys[i]: rows[i] for i in reversed(missing)}
+            y = predict_fn([first_row[k] for k in unique])
+            fresh = {k: int(max(0, v)) for k, v in zip(unique, y)}
+            with self._lock:
+                for k, v in fresh.items():
+                    self._data[k] = v
+                    self._data.move_to_end(k)
+                while len(self._data) > self.maxsize:
+                    self._data.popitem(last=False)
+            for i in missing:
+                out[i] = fresh[keys[i]]
+        return out
+
+    def predict_one(self, predict_fn, row):
+        return self.predict_rows(predict_fn, [row])[0]
+
+
+def day_grid_rows(day, holiday, weathers, temp, rain, snow, clouds, lags_for_hour):
+    """
+    Righe feature per tutte le 24 ore di `day` e tutte le condizioni meteo in `weathers`
+    ({nome_ui: {'main': ..., 'desc': ...}}); `lags_for_hour(h)` restituisce (lag_1, lag_24, lag_168).
+    """
+    is_weekend = day.weekday() >= 5
+    rows = []
+    for w in weathers.values():
+        for h in range(24):
+            dt = datetime.combine(day, datetime.min.time()).replace(hour=h)
+            lag_1, lag_24, lag_168 = lags_for_hour(h)
+            rows.append(build_feature_row(dt, holiday, is_weekend, w['main'], w['desc'],
+                                          temp, rain, snow, clouds, lag_1, lag_24, lag_168))
+    return rows
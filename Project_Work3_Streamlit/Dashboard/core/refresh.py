@@ -0,0 +1,232 @@
+"""
+Aggiornamento in background di dataset e modello (stale-while-revalidate).
+
+`RefreshManager` tiene l'ultima versione pronta di una risorsa costruita da alcuni file
+sorgente. Ogni `interval` secondi (alla richiesta successiva, o dal thread di controllo
+avviato con `start`) confronta data di modifica e dimensione dei file; se sono cambiate,
+un thread in background calcola i checksum e, solo se il contenuto è davvero diverso,
+ricostruisce la risorsa. Fino alla fine della ricostruzione `get` restituisce la versione
+precedente; poi la nuova la sostituisce con un solo assegnamento. Se la ricostruzione
+fallisce resta in uso la versione precedente e l'errore è visibile in `status`.
+
+Le risorse della dashboard sono due, condivise da tutte le pagine del processo:
+  - 'dati' (CSV): frame del dataset condiviso, piramide di aggregati, indice ECDF, climatologia,
+    indice degli eventi (festività ed episodi meteo);
+  - 'modello' (pickle + CSV): pipeline, versione compilata, contributi delle feature,
+    diagnostica dei residui, file dei residui e backtest a origine mobile dei due livelli di previsione.
+"""
+import os
+import threading
+import time
+from typing import Any, NamedTuple
+
+from core import perf
+from core.attributions import PipelineAttributor
+from core.backtest import refresh_backtest
+from core.climatology import Climatology
+from core.data import DATA_PATH, MODEL_PATH, load_pipeline
+from core.diagnostics import refresh_diagnostics
+from core.ecdf import ThresholdIndex
+from core.events import EventIndex
+from core.feature_store import file_checksum
+from core.linear_fast import compile_linear_pipeline
+from core.residual_store import RESIDUALS_DIR, open_residual_store
+from core.rollups import RollupPyramid
+from core.shared_dataset import SHARED_DIR, open_shared_dataset
+
+# Secondi tra due controlli dei file sorgente
+REFRESH_INTERVAL = float(os.environ.get('DASHBOARD_REFRESH_INTERVAL', 5))
+
+
+class Snapshot(NamedTuple):
+    version: str          # checksum dei file sorgente (abbreviati)
+    value: Any
+    built_at: float
+    build_seconds: float
+
+
+def file_stamp(path):
+    """(mtime in ns, dimensione) del file; None se non esiste."""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+class RefreshManager:
+    """Ultima versione pronta di una risorsa costruita da `build()` a partire dai file `paths`."""
+
+    def __init__(self, name, paths, build, interval=REFRESH_INTERVAL):
+        self.name = name
+        self.paths = list(paths)
+        self.build = build
+        self.interval = interval
+        self._current = None
+        self._stamps = None          # stato dei file dell'ultima verifica completata
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        self._worker = None
+        self._poller = None
+        self.last_error = None
+
+    def _stamps_now(self):
+        return tuple(file_stamp(p) for p in self.paths)
+
+    def _checksums(self):
+        return '-'.join(file_checksum(p)[:12] if os.path.exists(p) else 'assente' for p in self.paths)
+
+    def _rebuild(self, stamps):
+        """Ricostruisce se il contenuto è cambiato; al termine sostituisce la versione corrente."""
+        try:
+            version = self._checksums()
+            if self._current is None or version != self._current.version:
+                t0 = time.perf_counter()
+                value = self.build()
+                self._current = Snapshot(version, value, time.time(), time.perf_counter() - t0)
+            self.last_error = None
+        except Exception as e:
+            # La versione precedente resta in uso; si riprova quando i file cambiano di nuovo
+            self.last_error = f'{type(e).__name__}: {e}'
+            if self._current is None:
+                raise
+        finally:
+            self._stamps = stamps
+
+    def get(self):
+        """Snapshot corrente. Solo la prima volta (nessuna versione pronta) la costruzione è sincrona."""
+        if self._current is None:
+            with self._lock:
+                if self._current is None:
+                    self._rebuild(self._stamps_now())
+            return self._current
+        self.check()
+        return self._current
+
+    def check(self, force=False):
+        """Avvia la ricostruzione in background se i file sono cambiati. True se è stata avviata."""
+        now = time.monotonic()
+        if not force and now - self._checked_at < self.interval:
+            return False
+        self._checked_at = now
+        stamps = self._stamps_now()
+        if stamps == self._stamps:
+            return False
+        with self._lock:
+            if self._worker is not None and self._worker.is_alive():
+                return False
+            self._worker = threading.Thread(target=self._rebuild, args=(stamps,), name=f'refresh-{self.name}', daemon=True)
+            self._worker.start()
+        return True
+
+    def wait(self, timeout=None):
+        """Attende la fine dell'eventuale ricostruzione in corso (per script e test)."""
+        worker = self._worker
+        if worker is not None:
+            worker.join(timeout)
+
+    def start(self):
+        """Thread di controllo: la nuova versione è pronta anche se nessuno apre la pagina."""
+        if self._poller is None:
+            def poll():
+                while True:
+                    time.sleep(self.interval)
+                    self.check(force=True)
+            self._poller = threading.Thread(target=poll, name=f'refresh-poll-{self.name}', daemon=True)
+            self._poller.start()
+        return self
+
+    def status(self):
+        current = self._current
+        return {
+            'name': self.name,
+            'version': current.version if current else None,
+            'built_at': current.built_at if current else None,
+            'build_seconds': current.build_seconds if current else None,
+            'building': self._worker is not None and self._worker.is_alive(),
+            'last_error': self.last_error,
+        }
+
+
+# Le due risorse possono ripubblicare il dataset condiviso nello stesso momento (stessi file temporanei)
+_PUBLISH_LOCK = threading.Lock()
+
+
+def _open_shared(shared_dir, data_path):
+    with _PUBLISH_LOCK:
+        return open_shared_dataset(shared_dir, data_path)
+
+
+def build_data_bundle(data_path=DATA_PATH, shared_dir=SHARED_DIR):
+    """Frame del dataset condiviso e strutture derivate usate dalle pagine."""
+    shared = _open_shared(shared_dir, data_path)
+    analisi = shared.frame('analisi')
+    previsioni = shared.frame('previsioni')
+    climatology = Climatology.from_frame(previsioni)
+    return {
+        'analisi': analisi,
+        'previsioni': previsioni,
+        'anomalie': shared.frame('anomalie'),
+        'rollups': RollupPyramid(analisi),
+        'threshold_index': ThresholdIndex(analisi),
+        'climatology': climatology,
+        'events': EventIndex.from_frame(analisi, climatology),
+    }
+
+
+def build_model_bundle(model_path=MODEL_PATH, data_path=DATA_PATH, shared_dir=SHARED_DIR, residuals_dir=RESIDUALS_DIR):
+    """Pipeline e tutto ciò che dipende dal modello; la diagnostica e i residui usano lo storico attuale."""
+    pipeline = load_pipeline(model_path)
+    try:
+        compiled = compile_linear_pipeline(pipeline)
+    except ValueError:
+        compiled = None
+    try:
+        attributor = PipelineAttributor(pipeline)
+    except ValueError:
+        attributor = None
+    # Diagnostica, residui e backtest sono facoltativi: se falliscono le pagine
+    # mostrano solo un avviso
+    try:
+        history = _open_shared(shared_dir, data_path).frame('previsioni')
+    except Exception:
+        history = None
+    try:
+        diagnostics = refresh_diagnostics(pipeline, history, model_path)[0].summary()
+    except Exception:
+        diagnostics = None
+    try:
+        residuals = open_residual_store(residuals_dir, data_path, model_path)
+    except Exception:
+        residuals = None
+    try:
+        backtest = refresh_backtest(pipeline, history, model_path, data_path, compiled)
+    except Exception:
+        backtest = None
+    return {
+        'pipeline': pipeline,
+        'compiled': compiled,
+        'attributor': attributor,
+        'diagnostics': diagnostics,
+        'residuals': residuals,
+        'backtest': backtest,
+    }
+
+
+_MANAGERS = {}
+_MANAGERS_LOCK = threading.Lock()
+
+
+def dashboard_managers(data_path=DATA_PATH, model_path=MODEL_PATH):
+    """Gestori 'dati' e 'modello' del processo (uno per coppia di percorsi), con il controllo periodico avviato."""
+    key = (os.path.abspath(data_path), os.path.abspath(model_path))
+    with _MANAGERS_LOCK:
+        if key not in _MANAGERS:
+            _MANAGERS[key] = {
+                # cache_probe: la costruzione sincrona (prima richiesta) compare come cache miss nel profilo del run
+                'dati': RefreshManager('dati', [data_path],
+                                       perf.cache_probe(lambda: build_data_bundle(data_path))).start(),
+                'modello': RefreshManager('modello', [model_path, data_path],
+                                          perf.cache_probe(lambda: build_model_bundle(model_path, data_path))).start(),
+            }
+        return _MANAGERS[key]
@@ -0,0 +1,280 @@
+"""
+Predizioni e residui del modello su tutto lo storico, salvati in un file Arrow colonnare.
+
+Il job usa le colonne di lag già presenti in cleaned_data.csv (nessuna previsione ricorsiva),
+divide lo storico in blocchi e li valuta in un pool di processi. Il file è legato al checksum
+del modello: con lo stesso modello vengono rivalutate solo le righe nuove o modificate
+(riconosciute dall'hash di data, feature e target), con un modello diverso tutte.
+La pagina Analisi & KPI legge il file in memory-map e aggrega gli errori per ora, giorno,
+meteo e mese senza chiamare il modello.
+
+Gli errori contano solo sulle ore successive alla fine dell'addestramento (colonna `in_sample`,
+fine registrata nel manifest): sulle ore di training misurano l'adattamento, non la previsione.
+La fine dell'addestramento è, nell'ordine: quella indicata (--train-end o DASHBOARD_TRAIN_END),
+l'ultima ora usata da training.online, l'ultima delle righe contate alla radice dei modelli ad
+albero (un albero addestrato su tutto lo storico, come rf_pipeline.pkl del notebook 5, non ha
+ore di test), altrimenti lo split dei notebook (train fino al 01/10/2017 00:00, n_train=26064).
+
+Uso (dalla cartella Dashboard):
+    python -m core.residual_store [--data dataset/cleaned_data.csv] [--model models/rf_pipeline.pkl]
+                                  [--out residual_store] [--workers 4] [--full] [--train-end 2017-10-01]
+"""
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from core.data import CATEGORICAL_FEATURES, DATA_PATH, MODEL_PATH, NUMERIC_FEATURES, TARGET, load_cleaned_data, load_pipeline
+from core.feature_store import file_checksum
+from core.shared_dataset import read_frame, write_arrow
+
+RESIDUALS_DIR = os.environ.get('DASHBOARD_RESIDUALS_DIR', 'residual_store')
+STORE_FILE = 'residuals.arrow'
+MANIFEST = 'manifest.json'
+FORMAT_VERSION = 2
+CHUNK_ROWS = 8192
+# Ultima ora di training dello split dei notebook 3 e 5 (n_train = 26064): il test è l'ultimo anno
+NOTEBOOK_TRAIN_END = '2017-10-01 00:00:00'
+TRAIN_END = os.environ.get('DASHBOARD_TRAIN_END')
+
+FEATURES = CATEGORICAL_FEATURES + NUMERIC_FEATURES
+# Raggruppamenti disponibili per gli errori: colonna -> etichetta
+GROUPS = {'hour': 'Ora', 'day_of_week': 'Giorno', 'weather_main': 'Meteo', 'month': 'Mese'}
+
+
+def row_hashes(df):
+    """Hash (uint64) di data, feature e target di ogni riga: cambia se cambia uno dei valori."""
+    return pd.util.hash_pandas_object(df[['date_time'] + FEATURES + [TARGET]], index=False).to_numpy()
+
+
+# --- Valutazione a blocchi: il modello viene caricato una volta per worker ---
+_WORKER = {}
+
+
+def _init_worker(model_path):
+    _WORKER['pipeline'] = load_pipeline(model_path)
+
+
+def _score_chunk(chunk):
+    return _WORKER['pipeline'].predict(chunk)
+
+
+def score_rows(df, model_path=MODEL_PATH, workers=None, chunk_rows=CHUNK_ROWS, pipeline=None):
+    """Predizioni del modello per le righe di `df` (stesso ordine); con workers=1 nel processo corrente."""
+    X = df[FEATURES]
+    chunks = [X.iloc[start:start + chunk_rows] for start in range(0, len(X), chunk_rows)]
+    if not chunks:
+        return np.empty(0)
+    if workers == 1 or len(chunks) == 1:
+        pipeline = pipeline if pipeline is not None else load_pipeline(model_path)
+        return np.concatenate([pipeline.predict(chunk) for chunk in chunks])
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(model_path,)) as pool:
+        return np.concatenate(list(pool.map(_score_chunk, chunks)))
+
+
+def _trained_rows(pipeline):
+    """Righe di addestramento registrate alla radice di un modello ad albero (foresta: primo albero); None se assenti."""
+    model = pipeline.steps[-1][1] if hasattr(pipeline, 'steps') else pipeline
+    tree = getattr(model, 'tree_', None)
+    if tree is None and getattr(model, 'estimators_', None) is not None and len(model.estimators_):
+        first = np.ravel(model.estimators_)[0]
+        tree = getattr(first, 'tree_', None)
+    return int(round(tree.weighted_n_node_samples[0])) if tree is not None else None
+
+
+def training_end(dates, model_path=MODEL_PATH, train_end=TRAIN_END, pipeline=None):
+    """Ultima ora usata per addestrare il modello (vedi docstring del modulo); `dates` ordinate."""
+    if train_end is not None:
+        return pd.Timestamp(train_end)
+    # Stato di training.online accanto al modello: le ore fino all'ultimo aggiornamento sono di training
+    try:
+        with open(model_path + '.online.json', encoding='utf-8') as f:
+            online_end = pd.Timestamp(json.load(f)['last_date_time'])
+    except (FileNotFoundError, KeyError, ValueError):
+        online_end = None
+    rows = _trained_rows(pipeline if pipeline is not None else load_pipeline(model_path))
+    if rows is not None and len(dates):
+        end = pd.Timestamp(dates[min(rows, len(dates)) - 1])
+    else:
+        end = pd.Timestamp(NOTEBOOK_TRAIN_END)
+    return max(end, online_end) if online_end is not None else end
+
+
+def read_manifest(out_dir=RESIDUALS_DIR):
+    try:
+        with open(os.path.join(out_dir, MANIFEST), encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def is_fresh(out_dir=RESIDUALS_DIR, data_path=DATA_PATH, model_path=MODEL_PATH, train_end=TRAIN_END):
+    """True se il file esiste e deriva dal modello, dal CSV e dalla fine dell'addestramento attuali."""
+    manifest = read_manifest(out_dir)
+    return (manifest is not None
+            and manifest.get('version') == FORMAT_VERSION
+            and manifest.get('model_sha1') == file_checksum(model_path)
+            and manifest.get('source_sha1') == file_checksum(data_path)
+            # fine indicata esplicitamente; altrimenti dipende solo da modello e CSV
+            and (train_end is None or manifest.get('train_end') == pd.Timestamp(train_end).isoformat())
+            and manifest.get('train_end_explicit', False) == (train_end is not None)
+            and os.path.exists(os.path.join(out_dir, STORE_FILE)))
+
+
+def rescore(data_path=DATA_PATH, model_path=MODEL_PATH, out_dir=RESIDUALS_DIR, workers=None,
+            chunk_rows=CHUNK_ROWS, full=False, train_end=TRAIN_END):
+    """
+    Aggiorna il file dei residui: riusa le predizioni delle righe invariate se il modello è lo
+    stesso, valuta le altre, e segna le ore fino alla fine dell'addestramento come `in_sample`.
+    Restituisce il manifest (con il numero di righe rivalutate e la fine dell'addestramento).
+    """
+    # Checksum prima della lettura: se i file cambiano nel frattempo il manifest risulta non aggiornato
+    source_sha1, model_sha1 = file_checksum(data_path), file_checksum(model_path)
+    df = load_cleaned_data(data_path).sort_values('date_time', kind='stable').reset_index(drop=True)
+    hashes = row_hashes(df)
+
+    predictions = np.full(len(df), np.nan)
+    manifest = read_manifest(out_dir)
+    if (not full and manifest is not None and manifest.get('version') == FORMAT_VERSION
+            and manifest.get('model_sha1') == model_sha1):
+        old = read_frame(os.path.join(out_dir, STORE_FILE))[['row_hash', 'prediction']].drop_duplicates('row_hash')
+        pos = pd.Index(old['row_hash'].to_numpy()).get_indexer(hashes)
+        reused = pos >= 0
+        predictions[reused] = old['prediction'].to_numpy()[pos[reused]]
+    todo = np.flatnonzero(np.isnan(predictions))
+    if len(todo):
+        predictions[todo] = score_rows(df.iloc[todo], model_path, workers, chunk_rows)
+    end = training_end(df['date_time'].to_numpy(), model_path, train_end)
+    in_sample = (df['date_time'] <= end).to_numpy()
+
+    y = df[TARGET].to_numpy(dtype=float)
+    store = pd.DataFrame({
+        'date_time': df['date_time'].to_numpy(dtype='datetime64[ns]'),
+        'row_hash': hashes,
+        'hour': df['hour'].to_numpy(dtype=np.int8),
+        'day_of_week': df['day_of_week'].to_numpy(dtype=np.int8),
+        'month': df['month'].to_numpy(dtype=np.int8),
+        'weather_main': df['weather_main'].astype(str).to_numpy(),
+        TARGET: y.astype(np.float32),
+        'prediction': predictions.astype(np.float32),
+        'residual': (y - predictions).astype(np.float32),
+        # Baseline "stessa ora precedente": il valore di un'ora fa
+        'baseline_residual': (y - df['lag_1'].to_numpy(dtype=float)).astype(np.float32),
+        # Ora usata per addestrare il modello: esclusa dagli errori
+        'in_sample': in_sample,
+    })
+    os.makedirs(out_dir, exist_ok=True)
+    write_arrow(os.path.join(out_dir, STORE_FILE), store)
+
+    manifest = {
+        'version': FORMAT_VERSION,
+        'model': os.path.abspath(model_path),
+        'model_sha1': model_sha1,
+        'source': os.path.abspath(data_path),
+        'source_sha1': source_sha1,
+        'rows': len(store),
+        'rescored': int(len(todo)),
+        'train_end': end.isoformat(),
+        'train_end_explicit': train_end is not None,
+        'rows_out_of_sample': int((~in_sample).sum()),
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+    tmp = os.path.join(out_dir, f'{MANIFEST}.{os.getpid()}.tmp')
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, ensure_ascii=False)
+    os.replace(tmp, os.path.join(out_dir, MANIFEST))
+    return manifest
+
+
+def open_residual_store(out_dir=RESIDUALS_DIR, data_path=DATA_PATH, model_path=MODEL_PATH, workers=1, train_end=TRAIN_END):
+    """Residui in memory-map (sola lettura); il file viene aggiornato prima se non è allineato."""
+    if not is_fresh(out_dir, data_path, model_path, train_end):
+        rescore(data_path, model_path, out_dir, workers, train_end=train_end)
+    return read_frame(os.path.join(out_dir, STORE_FILE))
+
+
+def _rows(residuals, out_of_sample):
+    """Solo le ore successive alla fine dell'addestramento (default) oppure tutte."""
+    return residuals[~residuals['in_sample'].to_numpy()] if out_of_sample else residuals
+
+
+def error_summary(residuals, out_of_sample=True):
+    """
+    MAE, RMSE e scarto medio del modello e MAE della baseline (ora precedente), sulle ore di test
+    (`out_of_sample`) o su tutte; `first` è la prima ora valutata. Senza ore: rows = 0 e valori NaN.
+    """
+    residuals = _rows(residuals, out_of_sample)
+    r = residuals['residual'].to_numpy(dtype=float)
+    b = residuals['baseline_residual'].to_numpy(dtype=float)
+    with np.errstate(invalid='ignore'):
+        return {
+            'rows': len(r),
+            'out_of_sample': out_of_sample,
+            'first': residuals['date_time'].iloc[0] if len(r) else None,
+            'mae': float(np.abs(r).mean()) if len(r) else np.nan,
+            'rmse': float(np.sqrt((r * r).mean())) if len(r) else np.nan,
+            'bias': float(r.mean()) if len(r) else np.nan,
+            'mae_baseline': float(np.abs(b).mean()) if len(r) else np.nan,
+        }
+
+
+def error_profile(residuals, by='hour', out_of_sample=True):
+    """Errori per gruppo: ore, MAE del modello, MAE della baseline, scarto medio (predizione in eccesso < 0)."""
+    residuals = _rows(residuals, out_of_sample)
+    tmp = pd.DataFrame({
+        by: residuals[by].to_numpy(),
+        'abs_residual': np.abs(residuals['residual'].to_numpy(dtype=float)),
+        'abs_baseline': np.abs(residuals['baseline_residual'].to_numpy(dtype=float)),
+        'residual': residuals['residual'].to_numpy(dtype=float),
+    })
+    out = tmp.groupby(by, sort=True).agg(
+        ore=('residual', 'size'),
+        mae=('abs_residual', 'mean'),
+        mae_baseline=('abs_baseline', 'mean'),
+        scarto_medio=('residual', 'mean'),
+    )
+    return out.reset_index()
+
+
+def error_over_time(residuals, rule='MS', out_of_sample=True):
+    """MAE del modello e della baseline per periodo (default mensile)."""
+    residuals = _rows(residuals, out_of_sample)
+    tmp = pd.DataFrame({
+        'mae': np.abs(residuals['residual'].to_numpy(dtype=float)),
+        'mae_baseline': np.abs(residuals['baseline_residual'].to_numpy(dtype=float)),
+    }, index=pd.DatetimeIndex(residuals['date_time']))
+    return tmp.resample(rule).mean().dropna().rename_axis('date_time').reset_index()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--data', default=DATA_PATH)
+    parser.add_argument('--model', default=MODEL_PATH)
+    parser.add_argument('--out', default=RESIDUALS_DIR)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--chunk-rows', type=int, default=CHUNK_ROWS)
+    parser.add_argument('--full', action='store_true', help='rivaluta tutte le righe')
+    parser.add_argument('--train-end', default=TRAIN_END,
+                        help="ultima ora di addestramento del modello (default: ricavata dal modello, vedi sopra)")
+    args = parser.parse_args(argv)
+
+    t0 = time.perf_counter()
+    manifest = rescore(args.data, args.model, args.out, args.workers, args.chunk_rows, args.full, args.train_end)
+    residuals = read_frame(os.path.join(args.out, STORE_FILE))
+    print(f"{manifest['rescored']:,} righe rivalutate su {manifest['rows']:,} in {time.perf_counter() - t0:.2f}s -> {args.out}")
+    print(f"Fine dell'addestramento: {manifest['train_end']} ({manifest['rows_out_of_sample']:,} ore di test)")
+    for label, out_of_sample in (('ore di test', True), ('tutte le ore', False)):
+        summary = error_summary(residuals, out_of_sample)
+        if summary['rows'] == 0:
+            print(f"  {label:<14} nessuna: il modello è stato addestrato su tutto lo storico")
+            continue
+        print(f"  {label:<14} MAE {summary['mae']:.1f} (baseline ora precedente {summary['mae_baseline']:.1f}), "
+              f"RMSE {summary['rmse']:.1f}, scarto medio {summary['bias']:+.1f}, {summary['rows']:,} ore")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+"""
+Piramide di aggregati (oraria, giornaliera, settimanale, mensile) di traffic_volume.
+
+Gli aggregati (somma, media, minimo, massimo, conteggio) vengono calcolati una sola volta per
+dataset; una finestra temporale si risolve con `searchsorted` sugli indici ordinati e con la
+risoluzione più fine che rientra nel numero massimo di punti da disegnare.
+"""
+import numpy as np
+import pandas as pd
+
+from core.data import TARGET
+
+# (codice, etichetta, regola di resample): dalla più fine alla più grossolana
+LEVELS = (
+    ('H', 'oraria', {'rule': 'h'}),
+    ('D', 'giornaliera', {'rule': 'D'}),
+    ('W', 'settimanale', {'rule': 'W-MON', 'label': 'left', 'closed': 'left'}),  # settimane da lunedì
+    ('M', 'mensile', {'rule': 'MS'}),
+)
+STATS = ('sum', 'mean', 'min', 'max', 'count')
+LEVEL_LABELS = {code: label for code, label, _ in LEVELS}
+
+# Punti massimi per i grafici: oltre si passa alla risoluzione successiva
+DEFAULT_POINT_BUDGET = 1500
+
+
+class RollupPyramid:
+    """Per ogni livello: istanti di inizio dei bucket (ordinati) e un array per statistica."""
+
+    def __init__(self, df, value_col=TARGET):
+        self.value_col = value_col
+        series = df.set_index('date_time')[value_col].sort_index()
+        self.levels = {}
+        for code, _, resample_kw in LEVELS:
+            kw = dict(resample_kw)
+            agg = series.resample(kw.pop('rule'), **kw).agg(list(STATS))
+            self.levels[code] = (
+                agg.index.to_numpy(dtype='datetime64[ns]'),
+                {stat: agg[stat].to_numpy(dtype=float) for stat in STATS},
+            )
+
+    def bounds(self, level='H'):
+        times = self.levels[level][0]
+        return pd.Timestamp(times[0]), pd.Timestamp(times[-1])
+
+    def _span(self, level, start, end):
+        """Indici [lo, hi) dei bucket che si sovrappongono a [start, end]."""
+        times = self.levels[level][0]
+        lo = max(int(np.searchsorted(times, np.datetime64(pd.Timestamp(start)), side='right')) - 1, 0)
+        hi = int(np.searchsorted(times, np.datetime64(pd.Timestamp(end)), side='right'))
+        return lo, max(hi, lo)
+
+    def n_points(self, level, start, end):
+        lo, hi = self._span(level, start, end)
+        return hi - lo
+
+    def choose_level(self, start, end, max_points=DEFAULT_POINT_BUDGET):
+        """Risoluzione più fine con al massimo `max_points` bucket nell'intervallo."""
+        for code, _, _ in LEVELS:
+            if self.n_points(code, start, end) <= max_points:
+                return code
+        return LEVELS[-1][0]
+
+    def range(self, level, start, end, stats=('mean',)):
+        """Bucket del livello tra start ed end (inclusi i bucket parziali agli estremi)."""
+        lo, hi = self._span(level, start, end)
+        times, values = self.levels[level]
+        out = pd.DataFrame({'date_time': times[lo:hi]})
+        for stat in stats:
+            out[stat] = values[stat][lo:hi]
+        return out
+
+    def window(self, start, end, max_points=DEFAULT_POINT_BUDGET, stat='mean', drop_empty=True):
+        """
+        Serie (date_time, traffic_volume) per l'intervallo, alla risoluzione scelta da `choose_level`.
+        Restituisce (livello, DataFrame); con `drop_empty` i bucket senza dati vengono omessi.
+        """
+        level = self.choose_level(start, end, max_points)
+        out = self.range(level, start, end, stats=(stat, 'count'))
+        if drop_empty:
+            out = out[out['count'] > 0]
+        out = out.drop(columns='count').rename(columns={stat: self.value_col}).reset_index(drop=True)
+        return level, out
@@ -0,0 +1,251 @@
+"""
+Dataset multi-sensore partizionato: un file Arrow per sensore più un registro JSON.
+
+Il CSV in formato lungo (colonna `sensor_id`) viene diviso una volta sola in
+`dataset/sensors/<sensore>.arrow`; le pagine e i job aprono solo le partizioni che servono,
+in memory-map. Gli aggregati tra sensori si ottengono combinando statistiche parziali
+(somme e conteggi) calcolate partizione per partizione, senza concatenare i dati grezzi;
+le previsioni di tutti i sensori girano in un pool di processi.
+
+Uso (dalla cartella Dashboard):
+    python -m core.sensors partition [--data dataset/cleaned_data.csv] [--meta sensori.csv] [--out dataset/sensors]
+    python -m core.sensors forecast [--hours 24] [--workers 4] [--out previsioni_sensori.csv]
+"""
+import argparse
+import json
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
+from core.aggregations import CONGESTION_THRESHOLD
+from core.data import DATA_PATH, MODEL_PATH, TARGET, load_pipeline
+from core.forecast import recursive_forecast
+from core.linear_fast import compile_linear_pipeline, iter_linear_forecast
+from core.shared_dataset import read_frame, write_arrow
+
+SENSORS_DIR = 'dataset/sensors'
+REGISTRY = 'sensors.json'
+FORMAT_VERSION = 1
+SENSOR_COLUMN = 'sensor_id'
+
+# Il dataset storico della dashboard: un solo sensore sulla I-94
+DEFAULT_SENSOR = {'sensor_id': 'i94', 'name': 'I-94 Minneapolis - St. Paul', 'lat': 44.96, 'lon': -93.20}
+
+
+def _file_name(sensor_id):
+    return re.sub(r'[^A-Za-z0-9_.-]', '_', str(sensor_id)) + '.arrow'
+
+
+def partition_csv(data_path=DATA_PATH, out_dir=SENSORS_DIR, meta_path=None):
+    """
+    Divide il CSV per `sensor_id` (senza la colonna: tutto il file è il sensore I-94) e scrive
+    una partizione per sensore, ordinata per data, e il registro. Restituisce il registro.
+    `meta_path`: CSV opzionale con sensor_id, name, lat, lon.
+    """
+    df = pd.read_csv(data_path, parse_dates=['date_time'])
+    if SENSOR_COLUMN not in df.columns:
+        df[SENSOR_COLUMN] = DEFAULT_SENSOR['sensor_id']
+    df[SENSOR_COLUMN] = df[SENSOR_COLUMN].astype(str)
+    meta = {DEFAULT_SENSOR['sensor_id']: DEFAULT_SENSOR}
+    if meta_path is not None:
+        meta_df = pd.read_csv(meta_path, dtype={SENSOR_COLUMN: str})
+        meta.update({row[SENSOR_COLUMN]: row for row in meta_df.to_dict('records')})
+
+    os.makedirs(out_dir, exist_ok=True)
+    sensors = {}
+    for sensor_id, part in df.groupby(SENSOR_COLUMN, sort=True):
+        part = part.drop(columns=SENSOR_COLUMN).sort_values('date_time', kind='stable').reset_index(drop=True)
+        file_name = _file_name(sensor_id)
+        write_arrow(os.path.join(out_dir, file_name), part)
+        info = meta.get(sensor_id, {})
+        sensors[sensor_id] = {
+            'file': file_name,
+            'name': info.get('name', sensor_id),
+            'lat': None if pd.isna(info.get('lat')) else float(info['lat']),
+            'lon': None if pd.isna(info.get('lon')) else float(info['lon']),
+            'rows': len(part),
+            'first_date_time': part['date_time'].min().isoformat(),
+            'last_date_time': part['date_time'].max().isoformat(),
+        }
+
+    registry = {
+        'version': FORMAT_VERSION,
+        'source': os.path.abspath(data_path),
+        'sensors': sensors,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+    tmp = os.path.join(out_dir, f'{REGISTRY}.{os.getpid()}.tmp')
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(registry, f, indent=2, ensure_ascii=False)
+    os.replace(tmp, os.path.join(out_dir, REGISTRY))
+    return registry
+
+
+def profile_partials(df, by='hour'):
+    """Somma e conteggio di traffic_volume per gruppo: si combinano tra sensori sommandoli."""
+    return df.groupby(by)[TARGET].agg(['sum', 'count'])
+
+
+class SensorStore:
+    """
+    Registro dei sensori con caricamento pigro: una partizione viene aperta (in memory-map)
+    solo alla prima richiesta; le statistiche parziali restano in cache per sensore.
+    """
+
+    def __init__(self, out_dir=SENSORS_DIR):
+        self.out_dir = out_dir
+        with open(os.path.join(out_dir, REGISTRY), encoding='utf-8') as f:
+            self.registry = json.load(f)
+        if self.registry.get('version') != FORMAT_VERSION:
+            raise ValueError(f"versione del registro sensori non supportata: {self.registry.get('version')}")
+        self._frames = {}
+        self._partials = {}
+
+    def sensor_ids(self):
+        return list(self.registry['sensors'])
+
+    def info(self, sensor_id):
+        return self.registry['sensors'][sensor_id]
+
+    def locations(self):
+        """Sensori con coordinate note: sensor_id, name, lat, lon (per la mappa)."""
+        rows = [{'sensor_id': sid, 'name': s['name'], 'lat': s['lat'], 'lon': s['lon']}
+                for sid, s in self.registry['sensors'].items()]
+        out = pd.DataFrame(rows, columns=['sensor_id', 'name', 'lat', 'lon'])
+        return out.dropna(subset=['lat', 'lon'])
+
+    def load(self, sensor_id):
+        """Storico del sensore (come load_cleaned_data), in sola lettura."""
+        if sensor_id not in self._frames:
+            self._frames[sensor_id] = read_frame(os.path.join(self.out_dir, self.info(sensor_id)['file']))
+        return self._frames[sensor_id]
+
+    def _partial(self, sensor_id, key, fn):
+        cache_key = (sensor_id, key)
+        if cache_key not in self._partials:
+            self._partials[cache_key] = fn(self.load(sensor_id))
+        return self._partials[cache_key]
+
+    def summary(self, sensor_id, threshold=CONGESTION_THRESHOLD):
+        """KPI del singolo sensore; la quota di ore congestionate dipende dalla soglia."""
+        def compute(df):
+            values = df[TARGET]
+            return {'ore': len(df), 'somma': float(values.sum()), 'massimo': float(values.max()),
+                    'congestionate': int((values > threshold).sum()),
+                    'inizio': df['date_time'].min(), 'fine': df['date_time'].max()}
+        return self._partial(sensor_id, ('summary', threshold), compute)
+
+    def profile(self, sensor_id, by='hour'):
+        return self._partial(sensor_id, ('profile', by), lambda df: profile_partials(df, by))
+
+
+def sensor_kpis(store, threshold=CONGESTION_THRESHOLD, sensor_ids=None):
+    """
+    Una riga di KPI per sensore più la riga 'Tutti i sensori', combinata dai parziali
+    (media pesata sulle ore, massimo dei massimi, somma delle ore congestionate).
+    """
+    rows = []
+    for sid in sensor_ids or store.sensor_ids():
+        s = store.summary(sid, threshold)
+        rows.append({'sensore': sid, 'nome': store.info(sid)['name'], **s})
+    out = pd.DataFrame(rows, columns=['sensore', 'nome', 'ore', 'somma', 'massimo', 'congestionate', 'inizio', 'fine'])
+    if not out.empty:
+        total = {'sensore': 'tutti', 'nome': 'Tutti i sensori', 'ore': out['ore'].sum(), 'somma': out['somma'].sum(),
+                 'massimo': out['massimo'].max(), 'congestionate': out['congestionate'].sum(),
+                 'inizio': out['inizio'].min(), 'fine': out['fine'].max()}
+        out = pd.concat([out, pd.DataFrame([total])], ignore_index=True)
+    out['media'] = (out['somma'] / out['ore']).round(2)
+    out['quota_congestionate'] = out['congestionate'] / out['ore']
+    return out.drop(columns='somma')
+
+
+def combined_profile(store, by='hour', sensor_ids=None):
+    """Media di traffic_volume per gruppo su tutti i sensori selezionati, dai parziali di ciascuno."""
+    partials = [store.profile(sid, by) for sid in sensor_ids or store.sensor_ids()]
+    if not partials:
+        return pd.Series(dtype=float, name=TARGET)
+    total = pd.concat(partials).groupby(level=0).sum()
+    return (total['sum'] / total['count']).round(2).rename(TARGET)
+
+
+# --- Previsioni in parallelo: un task per sensore, modello e partizioni aperti una volta per worker ---
+_WORKER = {}
+
+
+def _init_worker(out_dir, model_path, models_dir):
+    _WORKER.update(store=SensorStore(out_dir), model_path=model_path, models_dir=models_dir, models={})
+
+
+def _worker_model(sensor_id):
+    # Modello dedicato del sensore (models/<sensore>.pkl) se presente, altrimenti quello comune
+    path = os.path.join(_WORKER['models_dir'], f'{sensor_id}.pkl') if _WORKER['models_dir'] else None
+    if path is None or not os.path.exists(path):
+        path = _WORKER['model_path']
+    if path not in _WORKER['models']:
+        pipeline = load_pipeline(path)
+        try:
+            compiled = compile_linear_pipeline(pipeline)
+        except ValueError:
+            compiled = None
+        _WORKER['models'][path] = (pipeline, compiled)
+    return _WORKER['models'][path]
+
+
+def _forecast_sensor(sensor_id, hours):
+    working = _WORKER['store'].load(sensor_id)
+    start_dt = working['date_time'].max() + pd.Timedelta(hours=1)
+    pipeline, compiled = _worker_model(sensor_id)
+    if compiled is not None:
+        preds = [{'date_time': dt, TARGET: yhat} for dt, yhat, _ in iter_linear_forecast(compiled, working, start_dt, hours)]
+    else:
+        preds, _ = recursive_forecast(pipeline, working.copy(), start_dt, hours)
+    return sensor_id, pd.DataFrame(preds, columns=['date_time', TARGET])
+
+
+def forecast_sensors(out_dir=SENSORS_DIR, hours=24, sensor_ids=None, workers=None,
+                     model_path=MODEL_PATH, models_dir=None):
+    """Previsione ricorsiva di `hours` ore per ogni sensore, in un pool di processi. {sensore: DataFrame}."""
+    sensor_ids = sensor_ids or SensorStore(out_dir).sensor_ids()
+    results = {}
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(out_dir, model_path, models_dir)) as pool:
+        futures = [pool.submit(_forecast_sensor, sid, hours) for sid in sensor_ids]
+        for future in as_completed(futures):
+            sensor_id, preds = future.result()
+            results[sensor_id] = preds
+    return {sid: results[sid] for sid in sensor_ids}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest='command', required=True)
+    p_part = sub.add_parser('partition', help='divide il CSV in una partizione per sensore')
+    p_part.add_argument('--data', default=DATA_PATH)
+    p_part.add_argument('--meta', default=None, help='CSV con sensor_id, name, lat, lon')
+    p_part.add_argument('--out', default=SENSORS_DIR)
+    p_fc = sub.add_parser('forecast', help='previsioni di tutti i sensori in parallelo')
+    p_fc.add_argument('--sensors-dir', default=SENSORS_DIR)
+    p_fc.add_argument('--hours', type=int, default=24)
+    p_fc.add_argument('--workers', type=int, default=None)
+    p_fc.add_argument('--model', default=MODEL_PATH)
+    p_fc.add_argument('--models-dir', default=None, help='cartella con modelli <sensore>.pkl dedicati')
+    p_fc.add_argument('--out', default='previsioni_sensori.csv')
+    args = parser.parse_args(argv)
+
+    t0 = time.perf_counter()
+    if args.command == 'partition':
+        registry = partition_csv(args.data, args.out, args.meta)
+        print(f"{len(registry['sensors'])} sensori in {args.out} ({time.perf_counter() - t0:.1f}s)")
+    else:
+        results = forecast_sensors(args.sensors_dir, args.hours, workers=args.workers,
+                                   model_path=args.model, models_dir=args.models_dir)
+        out = pd.concat([preds.assign(sensor_id=sid) for sid, preds in results.items()], ignore_index=True)
+        out.to_csv(args.out, index=False)
+        print(f"{len(results)} sensori x {args.hours} ore in {args.out} ({time.perf_counter() - t0:.1f}s)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,210 @@
+"""
+Dataset condiviso tra più processi della dashboard (repliche Streamlit sullo stesso host).
+
+Il CSV viene letto una volta sola e i frame usati dalle pagine (storico per le analisi, storico
+grezzo per le previsioni, punteggi delle anomalie) vengono pubblicati come file Arrow IPC non
+compressi. Ogni processo li apre in memory-map in sola lettura: le colonne numeriche e le date
+diventano array NumPy che puntano direttamente alle pagine del file e le stringhe restano array
+Arrow, quindi la memoria fisica è quella della page cache, condivisa da tutte le repliche.
+
+I file sono versionati con il checksum del CSV (`analisi.<sha1[:12]>.arrow`) ed elencati nel
+manifest, l'unico file sostituito: chi legge durante una pubblicazione vede tutti i frame della
+versione precedente o tutti quelli della nuova, e un file già aperto in memory-map (da un'altra
+replica o da una versione precedente dello stesso processo) non viene mai sovrascritto, cosa
+che su Windows non è permessa. Le versioni non più elencate vengono cancellate alla
+pubblicazione successiva; se un file è ancora aperto (Windows) si riprova alla volta dopo.
+
+Uso (dalla cartella Dashboard):
+    python -m core.shared_dataset [--data dataset/cleaned_data.csv] [--out shared_data]
+"""
+import argparse
+import json
+import os
+import re
+import time
+
+import pyarrow as pa
+import pyarrow.ipc as ipc
+
+from core import anomaly
+from core.data import DATA_PATH, add_label_columns, load_cleaned_data, load_data
+from core.feature_store import file_checksum
+
+# Cartella dei file pubblicati: configurabile se la cartella della dashboard è in sola lettura
+SHARED_DIR = os.environ.get('DASHBOARD_SHARED_DIR', 'shared_data')
+MANIFEST = 'manifest.json'
+FORMAT_VERSION = 2
+
+# Frame pubblicati: 'analisi' come load_data + colonne testuali, 'previsioni' come load_cleaned_data
+FRAMES = ('analisi', 'previsioni', 'anomalie')
+# File dei frame: versionati (formato attuale) o senza versione (formato 1)
+_FRAME_FILE = re.compile(r'^(%s)(\.[0-9a-f]{12})?\.arrow$' % '|'.join(FRAMES))
+
+
+def build_frames(data_path=DATA_PATH):
+    analisi = add_label_columns(load_data(data_path)).reset_index(drop=True)
+    return {
+        'analisi': analisi,
+        'previsioni': load_cleaned_data(data_path),
+        'anomalie': anomaly.backfill(analisi),
+    }
+
+
+def write_arrow(path, df):
+    # Nome temporaneo per processo: più repliche possono pubblicare insieme senza sovrascriversi a metà
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with pa.OSFile(tmp, 'wb') as sink, ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table)
+    try:
+        os.replace(tmp, path)
+    except OSError:
+        os.remove(tmp)
+        raise
+
+
+def frame_file(name, source_sha1):
+    """Nome del file di un frame per una versione del CSV."""
+    return f'{name}.{source_sha1[:12]}.arrow'
+
+
+def read_manifest(out_dir=SHARED_DIR):
+    """Manifest pubblicato; None se manca o è di un altro formato."""
+    try:
+        with open(os.path.join(out_dir, MANIFEST), encoding='utf-8') as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        return None
+    return manifest if manifest.get('version') == FORMAT_VERSION else None
+
+
+def remove_old_versions(out_dir, keep):
+    """Cancella i file dei frame non in `keep`; quelli ancora aperti (Windows) restano per la volta dopo."""
+    for file_name in os.listdir(out_dir):
+        if _FRAME_FILE.match(file_name) and file_name not in keep:
+            try:
+                os.remove(os.path.join(out_dir, file_name))
+            except OSError:
+                pass
+
+
+def publish_dataset(data_path=DATA_PATH, out_dir=SHARED_DIR):
+    """
+    Scrive i frame della versione attuale del CSV in file nuovi, poi sostituisce il manifest in
+    modo atomico. Restano i file della versione precedente (chi ha appena letto il vecchio
+    manifest può ancora aprirli); quelli più vecchi vengono cancellati. Restituisce il manifest.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    # Checksum prima della lettura: se il CSV cambia nel frattempo il manifest risulta non aggiornato
+    source_sha1 = file_checksum(data_path)
+    frames = build_frames(data_path)
+    files = {name: frame_file(name, source_sha1) for name in frames}
+    for name, df in frames.items():
+        path = os.path.join(out_dir, files[name])
+        # Stessa versione già scritta (da un'altra replica): stesso contenuto, e potrebbe essere aperta
+        if os.path.exists(path):
+            continue
+        try:
+            write_arrow(path, df)
+        except PermissionError:
+            if not os.path.exists(path):
+                raise
+
+    # File della versione precedente: restano fino alla prossima pubblicazione di una versione nuova
+    previous = read_manifest(out_dir) or {}
+    if previous.get('source_sha1') != source_sha1:
+        previous_files = previous.get('files', {})
+    else:
+        previous_files = previous.get('previous_files', {})
+    manifest = {
+        'version': FORMAT_VERSION,
+        'source': os.path.abspath(data_path),
+        'source_sha1': source_sha1,
+        'files': files,
+        'previous_files': previous_files,
+        'frames': {name: len(df) for name, df in frames.items()},
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+    tmp = os.path.join(out_dir, f'{MANIFEST}.{os.getpid()}.tmp')
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, ensure_ascii=False)
+    os.replace(tmp, os.path.join(out_dir, MANIFEST))
+
+    remove_old_versions(out_dir, set(files.values()) | set(previous_files.values()))
+    return manifest
+
+
+def is_fresh(out_dir=SHARED_DIR, data_path=DATA_PATH):
+    """True se i frame pubblicati esistono e derivano dalla versione attuale del CSV."""
+    manifest = read_manifest(out_dir)
+    if manifest is None or manifest.get('source_sha1') != file_checksum(data_path):
+        return False
+    files = manifest.get('files', {})
+    return all(name in files and os.path.exists(os.path.join(out_dir, files[name])) for name in FRAMES)
+
+
+def read_table(path):
+    """Tabella Arrow sopra il file in memory-map (nessuna copia)."""
+    return ipc.open_file(pa.memory_map(path, 'r')).read_all()
+
+
+def read_frame(path):
+    """
+    DataFrame in sola lettura sopra il file Arrow in memory-map: numeriche e date senza copia
+    (array non scrivibili), stringhe come array Arrow. Le pagine vanno trattate come immutabili.
+    """
+    return read_table(path).to_pandas(split_blocks=True)
+
+
+class SharedDataset:
+    """
+    Frame di una versione pubblicata in `out_dir`: tutti i file del manifest vengono aperti in
+    memory-map alla costruzione (la versione resta fissata anche se nel frattempo se ne pubblica
+    un'altra) e convertiti in DataFrame alla prima richiesta.
+    """
+
+    def __init__(self, out_dir=SHARED_DIR, retries=3):
+        self.out_dir = out_dir
+        for attempt in range(retries):
+            self.manifest = read_manifest(out_dir)
+            if self.manifest is None:
+                raise ValueError(f'nessun dataset condiviso (formato {FORMAT_VERSION}) in {out_dir}')
+            try:
+                self._tables = {name: read_table(os.path.join(out_dir, self.manifest['files'][name]))
+                                for name in FRAMES}
+                break
+            except FileNotFoundError:
+                # Versione cancellata tra la lettura del manifest e l'apertura: si rilegge il manifest
+                if attempt == retries - 1:
+                    raise
+        self._frames = {}
+
+    def frame(self, name):
+        if name not in FRAMES:
+            raise KeyError(f'frame non pubblicato: {name}')
+        if name not in self._frames:
+            self._frames[name] = self._tables[name].to_pandas(split_blocks=True)
+        return self._frames[name]
+
+
+def open_shared_dataset(out_dir=SHARED_DIR, data_path=DATA_PATH):
+    """Apre il dataset condiviso; lo pubblica prima se manca o se il CSV è cambiato."""
+    if data_path is not None and not is_fresh(out_dir, data_path):
+        publish_dataset(data_path, out_dir)
+    return SharedDataset(out_dir)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--data', default=DATA_PATH)
+    parser.add_argument('--out', default=SHARED_DIR)
+    args = parser.parse_args(argv)
+
+    t0 = time.perf_counter()
+    manifest = publish_dataset(args.data, args.out)
+    frames = ', '.join(f'{name} {rows:,} righe' for name, rows in manifest['frames'].items())
+    print(f'Dataset condiviso in {args.out}: {frames} ({time.perf_counter() - t0:.1f}s)')
+
+
+if __name__ == '__main__':
+    main()
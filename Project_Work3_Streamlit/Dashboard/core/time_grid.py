@@ -0,0 +1,144 @@
+"""
+Griglia oraria completa della serie del traffico, con maschera di validità per le ore mancanti.
+
+Nel CSV i lag (lag_1, lag_24, lag_168) sono spostamenti di riga: dopo un buco nella serie
+non corrispondono più a 1/24/168 ore prima. Sulla griglia invece lo spostamento di k posizioni
+è sempre di k ore, e le ore mancanti restano NaN (valid=False) invece di essere riempite.
+Lag e statistiche mobili arbitrari vengono calcolati con shift vettoriali in un solo passaggio
+(`add_lag_features`, per analisi ed esperimenti). Il modello della dashboard usa solo lag_1,
+lag_24 e lag_168: `training.cv_search --gap-aware-lags` li ricalcola sulla griglia e il forecaster
+legge lag_24/lag_168 dalla stessa griglia (`HourlyGrid.value_at`).
+"""
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+
+from core.data import TARGET
+
+HOUR = np.timedelta64(1, 'h')
+
+DEFAULT_LAGS = (1, 24, 168)
+# (statistica, finestra in ore): calcolata sulle ore precedenti, quindi nota al momento della previsione
+DEFAULT_ROLLING = (('mean', 24), ('max', 24))
+ROLLING_STATS = ('mean', 'sum', 'std', 'min', 'max')
+
+
+class HourlyGrid:
+    """Valori su una griglia oraria contigua: values[i] è il valore delle ore start + i (NaN se mancante)."""
+
+    def __init__(self, start, values):
+        self.start = np.datetime64(start, 'h')
+        self.values = values
+
+    @classmethod
+    def from_frame(cls, df, value_col=TARGET, end=None):
+        """
+        Griglia dalla prima all'ultima ora di `df` (o fino a `end`, esclusa, se successiva).
+        Con timestamp duplicati vale la prima riga, come nelle ricerche di iter_forecast.
+        """
+        times = df['date_time'].to_numpy().astype('datetime64[h]')
+        start, last = times.min(), times.max()
+        n = int((last - start) / HOUR) + 1
+        if end is not None:
+            n = max(n, int((np.datetime64(end, 'h') - start) / HOUR))
+        values = np.full(n, np.nan)
+        pos = ((times - start) / HOUR).astype(np.int64)
+        # Assegnazione in ordine inverso: per le posizioni ripetute resta il primo valore
+        values[pos[::-1]] = df[value_col].to_numpy(dtype=float)[::-1]
+        return cls(start, values)
+
+    def __len__(self):
+        return len(self.values)
+
+    @property
+    def valid(self):
+        return ~np.isnan(self.values)
+
+    @property
+    def times(self):
+        return self.start + np.arange(len(self.values)) * HOUR
+
+    def position(self, dt):
+        return int((np.datetime64(pd.Timestamp(dt), 'h') - self.start) / HOUR)
+
+    def value_at(self, dt):
+        """Valore all'ora `dt`; NaN se l'ora è mancante o fuori dalla griglia."""
+        i = self.position(dt)
+        return self.values[i] if 0 <= i < len(self.values) else np.nan
+
+    def set(self, dt, value):
+        i = self.position(dt)
+        if not 0 <= i < len(self.values):
+            raise IndexError(f'{dt} fuori dalla griglia')
+        self.values[i] = value
+
+    def lag_features(self, lags=DEFAULT_LAGS, rolling=DEFAULT_ROLLING, min_frac=0.5):
+        """
+        Tutte le feature per ogni ora della griglia, come dict nome -> array:
+        lag_k = valore di k ore prima; rolling_<stat>_<w> = statistica sulle w ore precedenti
+        (NaN se meno di `min_frac` * w ore valide).
+        """
+        v = self.values
+        n = len(v)
+        out = {}
+        for k in lags:
+            col = np.full(n, np.nan)
+            if k < n:
+                col[k:] = v[:n - k]
+            out[f'lag_{k}'] = col
+
+        if rolling:
+            # Finestra che termina all'ora precedente: prev[i] = v[i - 1]
+            prev = np.concatenate(([np.nan], v[:-1]))
+            ok = ~np.isnan(prev)
+            filled = np.where(ok, prev, 0.0)
+            cum_ok = np.concatenate(([0], np.cumsum(ok)))
+            cum_sum = np.concatenate(([0.0], np.cumsum(filled)))
+            cum_sq = np.concatenate(([0.0], np.cumsum(filled * filled)))
+            idx = np.arange(1, n + 1)
+
+        for stat, w in rolling:
+            if stat not in ROLLING_STATS:
+                raise ValueError(f"statistica mobile non supportata: {stat!r} (ammesse: {', '.join(ROLLING_STATS)})")
+            lo = np.maximum(idx - w, 0)
+            count = cum_ok[idx] - cum_ok[lo]
+            if stat in ('mean', 'sum', 'std'):
+                total = cum_sum[idx] - cum_sum[lo]
+                with np.errstate(invalid='ignore', divide='ignore'):
+                    mean = total / count
+                    if stat == 'mean':
+                        col = mean
+                    elif stat == 'sum':
+                        col = total
+                    else:
+                        var = (cum_sq[idx] - cum_sq[lo]) / count - mean * mean
+                        col = np.sqrt(np.maximum(var, 0.0))
+            else:
+                fill = -np.inf if stat == 'max' else np.inf
+                padded = np.concatenate((np.full(w - 1, fill), np.where(ok, prev, fill)))
+                windows = sliding_window_view(padded, w)
+                col = windows.max(axis=1) if stat == 'max' else windows.min(axis=1)
+            out[f'rolling_{stat}_{w}'] = np.where(count >= max(1, min_frac * w), col, np.nan)
+        return out
+
+
+def add_lag_features(df, lags=DEFAULT_LAGS, rolling=DEFAULT_ROLLING, value_col=TARGET, min_frac=0.5, drop_invalid=False):
+    """
+    Aggiunge a `df` i lag e le statistiche mobili calcolati sulla griglia oraria
+    (sovrascrivendo eventuali colonne omonime, es. i lag del CSV) e la colonna
+    'lags_valid' (True se tutte le feature sono disponibili). Con `drop_invalid`
+    le righe non valide vengono scartate, come nel notebook 3_RegressoreLineare.
+    """
+    grid = HourlyGrid.from_frame(df, value_col)
+    feats = grid.lag_features(lags, rolling, min_frac)
+    pos = ((df['date_time'].to_numpy().astype('datetime64[h]') - grid.start) / HOUR).astype(np.int64)
+
+    out = df.copy()
+    valid = np.ones(len(df), dtype=bool)
+    for name, col in feats.items():
+        out[name] = col[pos]
+        valid &= ~np.isnan(out[name].to_numpy())
+    out['lags_valid'] = valid
+    if drop_invalid:
+        out = out[valid].reset_index(drop=True)
+    return out
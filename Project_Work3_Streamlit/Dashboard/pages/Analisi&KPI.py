@@ -1,51 +1,104 @@
+import numpy as np
 import pandas as pd
 import streamlit as st
 import plotly.express as px
 import plotly.graph_objects as go
 import pickle # Mantenuto per completezza
 
+from core import aggregations as agg
+from core import anomaly
+from core import perf
+from core import residual_store
+from core.data import DATA_PATH, DAY_MAP, MODEL_PATH, MONTH_MAP
+from core.refresh import dashboard_managers
+from core.rollups import LEVEL_LABELS
+from core.sensors import SENSORS_DIR, SensorStore, combined_profile, sensor_kpis
+
 # --- CONFIGURAZIONE E CARICAMENTO DATI  ---
-DATA_PATH = 'dataset/cleaned_data.csv' 
+# I frame arrivano dal dataset condiviso (core/shared_dataset.py): file Arrow in memory-map,
+# comuni a tutte le sessioni e a tutte le repliche sullo stesso host. Sono in sola lettura.
+# Dataset e modello sono gestiti da core/refresh.py: quando cleaned_data.csv o il pickle cambiano,
+# la nuova versione (con aggregati e residui) viene preparata in background e poi sostituita.
+def refresh_managers():
+    return dashboard_managers(DATA_PATH, MODEL_PATH)
 
-@st.cache_data
-def load_data():
-    """
-    Carica il dataset già pulito.
-    """
-    try:
-        # Carica il CSV
-        df = pd.read_csv(DATA_PATH)
-        
-        # L'unica trasformazione necessaria è la conversione del timestamp
-        df['date_time'] = pd.to_datetime(df['date_time'])
-        
-        # Ordiniamo per sicurezza cronologica
-        df = df.sort_values('date_time')
 
-        # Conversione dei tipi per le colonne già presenti nel CSV
-        df['day_of_week'] = df['day_of_week'].astype(int)
-        df['month'] = df['month'].astype(int)
-        df['hour'] = df['hour'].astype(int)
+# Versioni lette in questo run (il dizionario riparte vuoto a ogni rerun): tutte le sezioni della
+# pagina usano la stessa versione anche se a metà run ne diventa pronta una nuova
+_run_snapshots = {}
 
-        # Tronca tutte le colonne float a due cifre decimali
-        float_cols = df.select_dtypes(include=['float', 'float64', 'float32']).columns
-        df[float_cols] = df[float_cols].apply(lambda x: x.round(2))
 
-        return df
+def current_snapshot(name):
+    if name not in _run_snapshots:
+        _run_snapshots[name] = refresh_managers()[name].get()
+    return _run_snapshots[name]
 
+
+def load_data_bundle():
+    try:
+        return current_snapshot('dati').value
     except FileNotFoundError:
         st.error(f"⚠️ Errore: File non trovato in '{DATA_PATH}'. Controlla il nome e la cartella.")
-        return pd.DataFrame()
+        return None
     except Exception as e:
         st.error(f"Errore nel caricamento: {e}")
-        return pd.DataFrame()
+        return None
+
+
+def load_data():
+    """
+    Carica il dataset già pulito (con le colonne testuali per i grafici).
+    """
+    data = load_data_bundle()
+    return data['analisi'] if data is not None else pd.DataFrame()
+
+
+def load_anomaly_scores():
+    """Punteggi z di tutte le ore rispetto al profilo (ora, giorno): calcolati una volta per dataset."""
+    return load_data_bundle()['anomalie']
+
+
+def load_residuals():
+    """Predizioni e residui del modello su tutto lo storico (core/residual_store.py); None se non disponibili."""
+    try:
+        return current_snapshot('modello').value['residuals']
+    except Exception:
+        return None
+
+
+@st.cache_resource
+@perf.cache_probe
+def load_sensor_store():
+    """Registro dei sensori (core/sensors.py) se esiste il dataset partizionato; partizioni aperte su richiesta."""
+    try:
+        return SensorStore(SENSORS_DIR)
+    except FileNotFoundError:
+        return None
+
+
+def load_rollups():
+    """Aggregati orari/giornalieri/settimanali/mensili, calcolati una volta per dataset."""
+    return load_data_bundle()['rollups']
+
+
+def load_threshold_index():
+    """Indice ordinato di traffic_volume (ECDF) per le analisi a soglia: costruito una volta per dataset."""
+    return load_data_bundle()['threshold_index']
+
+
+def load_event_index():
+    """Festività ed episodi meteo dello storico (core/events.py): costruito una volta per dataset."""
+    return load_data_bundle()['events']
 # --------------------------------------------------------
 
 
 # Configurazione pagina
 st.set_page_config(page_title="Analisi & KPI", page_icon="🔍", layout="wide")
+perf.start_run("Analisi & KPI")
 
 st.title("🔍 Analisi Prestazioni e Pattern di Traffico")
+if any(m.status()['building'] for m in refresh_managers().values()):
+    st.caption("🔄 È in preparazione una nuova versione di dati o modello: fino al termine si usano quelli attuali.")
 
 
 def _apply_plot_style(fig, title=None, x_title=None, y_title=None):
@@ -71,69 +124,94 @@ def _apply_plot_style(fig, title=None, x_title=None, y_title=None):
     return fig
 
 
-def summarize_day(day_df: pd.DataFrame) -> dict:
-    """Riepilogo giornaliero (una riga) per confronto diretto."""
-    if day_df.empty:
-        return {}
-
-    # Valori categoriali: prendiamo il più frequente (o il primo non nullo)
-    def _mode(series):
-        series = series.dropna()
-        if series.empty:
-            return None
-        m = series.mode()
-        return m.iloc[0] if not m.empty else series.iloc[0]
-
-    holiday_vals = day_df['holiday'].dropna().astype(str).unique().tolist() if 'holiday' in day_df.columns else []
-    holiday_vals = [h for h in holiday_vals if h.lower() not in ("none", "nan", "nan.0")]
-    holiday_val = holiday_vals[0] if len(holiday_vals) > 0 else "Nessuna"
-
-    return {
-        "📅 Giorno settimana": str(day_df.iloc[0].get('nome_giorno', '')),
-        "🗓️ Weekend": bool(day_df.iloc[0].get('is_weekend', False)),
-        "🎉 Holiday": holiday_val,
-        "🌦️ Meteo (main)": _mode(day_df['weather_main']) if 'weather_main' in day_df.columns else None,
-        "🌫️ Meteo (desc)": _mode(day_df['weather_description']) if 'weather_description' in day_df.columns else None,
-        "🌡️ Temp media (°C)": float(day_df['temp'].mean()) if 'temp' in day_df.columns else None,
-        "☁️ Clouds mediana (%)": float(day_df['clouds_all'].median()) if 'clouds_all' in day_df.columns else None,
-        "🌧️ Pioggia tot (mm)": float(day_df['rain_1h'].sum()) if 'rain_1h' in day_df.columns else None,
-        "❄️ Neve tot (mm)": float(day_df['snow_1h'].sum()) if 'snow_1h' in day_df.columns else None,
-        "🚗 Traffico totale": float(day_df['traffic_volume'].sum()) if 'traffic_volume' in day_df.columns else None,
-        "🚀 Traffico max": float(day_df['traffic_volume'].max()) if 'traffic_volume' in day_df.columns else None,
-        "📈 Traffico medio": float(day_df['traffic_volume'].mean()) if 'traffic_volume' in day_df.columns else None,
-    }
-
 # 1. Caricamento Dati
-df = load_data()
+with perf.section('load_data', cached=True) as sec:
+    df = load_data()
+    sec.rows = len(df)
 
 if not df.empty:
     
     # --- SEZIONE 1: KPI SINTETICI ---
     st.subheader("📊 1. Indicatori Chiave (KPIs)")
     
-    avg_traffic = round(df['traffic_volume'].mean(), 2)
-    max_traffic = round(df['traffic_volume'].max(), 2)
-    min_dt = df['date_time'].min()
-    max_dt = df['date_time'].max()
-    n_rows = len(df)
-    
-    # Non è più necessario creare 'hour' qui, usiamo 'traffic_volume'
-    busy_hours = df[df['traffic_volume'] > 5000].shape[0] 
-    
-    # INSERISCI QUI I TUOI VALORI REALI
-    mae_model = 150  # esempio: MAE modello
-    mae_baseline = 500  # esempio: MAE baseline ora precedente
+    kpis = agg.kpi_summary(df)
+    avg_traffic = kpis['avg_traffic']
+    max_traffic = kpis['max_traffic']
+    min_dt = kpis['min_dt']
+    max_dt = kpis['max_dt']
+    n_rows = kpis['n_rows']
+
+    with perf.section('threshold_index', cached=True):
+        threshold_index = load_threshold_index()
+    congestion_threshold = st.slider("🎚️ Soglia di congestione (veicoli/ora)", min_value=1000, max_value=7500,
+                                     value=agg.CONGESTION_THRESHOLD, step=250)
+    busy_hours = threshold_index.count_above(congestion_threshold)
     
+    # MAE sullo storico dal file dei residui (python -m core.residual_store)
+    with perf.section('residuals', cached=True):
+        residuals = load_residuals()
+    model_errors = None
+    if residuals is not None:
+        # Solo le ore dopo la fine dell'addestramento; se non ce ne sono (modello addestrato su tutto
+        # lo storico) gli errori sono quelli sul training set e vengono indicati come tali
+        model_errors = residual_store.error_summary(residuals)
+        if model_errors['rows'] == 0:
+            model_errors = residual_store.error_summary(residuals, out_of_sample=False)
+    if model_errors is None:
+        error_scope = ""
+    elif model_errors['out_of_sample']:
+        error_scope = f"sulle {model_errors['rows']:,} ore di test, dal {model_errors['first']:%d/%m/%Y} (dopo la fine dell'addestramento)"
+    else:
+        error_scope = "in-sample: il modello è stato addestrato su tutto lo storico, quindi è l'errore sul training set"
+
     kpi1, kpi2, kpi3, kpi4, kpi5 = st.columns(5)
     kpi1.metric("Traffico medio", f"{avg_traffic:.2f}", help="veicoli/ora medi")
     kpi2.metric("Picco massimo", f"{max_traffic:.2f}", help="numero massimo rilevato di veicoli/ora")
-    kpi3.metric("MAE baseline", f"{mae_baseline:.0f}", help="Modello Baseline Traffico ora precedente", delta_color="normal")
-    kpi4.metric("MAE modello", f"{mae_model:.0f}", delta=f"{mae_model - mae_baseline:+.0f}", help="Errore medio assoluto del nostro modello RandomForest", delta_color="inverse")
+    if model_errors is not None:
+        mae_model, mae_baseline = model_errors['mae'], model_errors['mae_baseline']
+        kpi3.metric("MAE baseline", f"{mae_baseline:.0f}", help=f"Modello Baseline Traffico ora precedente, {error_scope}", delta_color="normal")
+        kpi4.metric("MAE modello" if model_errors['out_of_sample'] else "MAE modello (in-sample)", f"{mae_model:.0f}",
+                    delta=f"{mae_model - mae_baseline:+.0f}", help=f"Errore medio assoluto del modello {error_scope}", delta_color="inverse")
+    else:
+        kpi3.metric("MAE baseline", "n.d.", help="Modello Baseline Traffico ora precedente")
+        kpi4.metric("MAE modello", "n.d.", help="Residui non disponibili: controlla models/rf_pipeline.pkl")
     
-    kpi5.metric("Ore congestionate", f"{busy_hours:,}", help="Ora in cui si registrano più di 5.000 veicoli", delta_color="inverse")
+    kpi5.metric("Ore congestionate", f"{busy_hours:,}", help=f"Ore in cui si registrano più di {congestion_threshold:,} veicoli", delta_color="inverse")
 
     st.caption(f"Periodo dati: {min_dt:%Y-%m-%d} → {max_dt:%Y-%m-%d} • Righe: {n_rows:,}")
 
+    with st.expander("🎚️ Analisi per soglia"):
+        f_hour, f_day, f_month, f_weather = st.columns(4)
+        sel_hour = f_hour.selectbox("Ora", ["Tutte"] + threshold_index.categories('hour'))
+        sel_day = f_day.selectbox("Giorno", ["Tutti"] + threshold_index.categories('day_of_week'), format_func=lambda d: DAY_MAP.get(d, d))
+        sel_month = f_month.selectbox("Mese", ["Tutti"] + threshold_index.categories('month'), format_func=lambda m: MONTH_MAP.get(m, m))
+        sel_weather = f_weather.selectbox("Meteo", ["Tutti"] + threshold_index.categories('weather_main'))
+        filters = {
+            'hour': None if sel_hour == "Tutte" else sel_hour,
+            'day_of_week': None if sel_day == "Tutti" else sel_day,
+            'month': None if sel_month == "Tutti" else sel_month,
+            'weather_main': None if sel_weather == "Tutti" else sel_weather,
+        }
+
+        n_slice = threshold_index.count(**filters)
+        if n_slice == 0:
+            st.info("Nessuna ora per la combinazione selezionata.")
+        else:
+            above = threshold_index.count_above(congestion_threshold, **filters)
+            t1, t2, t3, t4, t5 = st.columns(5)
+            t1.metric(f"Ore oltre {congestion_threshold:,}", f"{above:,}")
+            t2.metric("Quota", f"{above / n_slice:.1%}", help=f"su {n_slice:,} ore selezionate")
+            t3.metric("Mediana", f"{threshold_index.percentile(50, **filters):,.0f}")
+            t4.metric("90° percentile", f"{threshold_index.percentile(90, **filters):,.0f}")
+            t5.metric("99° percentile", f"{threshold_index.percentile(99, **filters):,.0f}")
+
+            ecdf = threshold_index.ecdf_points(**filters)
+            fig_ecdf = px.line(ecdf, x='valore', y='quota')
+            fig_ecdf.add_vline(x=congestion_threshold, line_dash="dash", line_color="#d62728")
+            _apply_plot_style(fig_ecdf, title="Distribuzione cumulata del traffico", x_title="Veicoli/ora", y_title="Quota di ore ≤ valore")
+            fig_ecdf.update_yaxes(tickformat=".0%")
+            st.plotly_chart(fig_ecdf, width='stretch')
+
     st.markdown("---")
 
     # --- SEZIONE 2: ANALISI DETTAGLIATA ---
@@ -144,26 +222,16 @@ if not df.empty:
     🧩 Usa le schede sottostanti per navigare tra le diverse prospettive:
     """)
     
-    # Feature Engineering per i nomi testuali (non sono presenti nel CSV come stringhe)
-    day_map = {0: 'Lunedì', 1: 'Martedì', 2: 'Mercoledì', 3: 'Giovedì', 4: 'Venerdì', 5: 'Sabato', 6: 'Domenica'}
-    # Utilizzo la colonna 'day_of_week' già presente nel CSV
-    df['nome_giorno'] = df['day_of_week'].map(day_map) 
-    
-    month_map = {1: 'Gen', 2: 'Feb', 3: 'Mar', 4: 'Apr', 5: 'Mag', 6: 'Giu', 7: 'Lug', 8: 'Ago', 9: 'Set', 10: 'Ott', 11: 'Nov', 12: 'Dic'}
-    # Utilizzo la colonna 'month' già presente nel CSV
-    df['nome_mese'] = df['month'].map(month_map) 
-
-    # 'is_weekend' è già presente, usiamo solo 'tipo_giorno' per il raggruppamento
-    df['tipo_giorno'] = df['is_weekend'].apply(lambda x: 'Weekend' if x else 'Feriale')
+    # I nomi testuali (nome giorno/mese, tipo giorno) sono già nel frame pubblicato
 
     # --- TABS ---
-    tab1, tab2, tab3, tab4, tab5 = st.tabs(["⏱️ Pattern Orari", "📈 Serie temporale", "📅 Trend Stagionali", "🆚 Confronto Diretto", "🌧️ Traffico & Meteo"])
+    tab1, tab2, tab3, tab4, tab5, tab6, tab7, tab8 = st.tabs(["⏱️ Pattern Orari", "📈 Serie temporale", "📅 Trend Stagionali", "🆚 Confronto Diretto", "🌧️ Traffico & Meteo", "🚨 Anomalie", "🎯 Errore del modello", "🎉 Eventi"])
     
     # --- TAB 1: Pattern Orari ---
-    with tab1:
+    with tab1, perf.section('tab.pattern_orari', rows=len(df)):
         st.markdown("**🕒 Profilo orario: Feriali vs Weekend**")
         # 'hour' è già disponibile dal CSV
-        daily_trend = df.groupby(['hour', 'tipo_giorno'])['traffic_volume'].mean().round(2).reset_index()
+        daily_trend = agg.hourly_profile(df)
         fig_daily = px.line(daily_trend, x='hour', y='traffic_volume', color='tipo_giorno',
                             title='Traffico medio per ora', markers=True,
                             color_discrete_map={'Feriale': '#1f77b4', 'Weekend': '#ff7f0e'})
@@ -178,12 +246,14 @@ if not df.empty:
         st.plotly_chart(fig_box, width='stretch')
 
     # --- TAB 2: Serie temporale (demo) ---
-    with tab2:
+    with tab2, perf.section('tab.serie_temporale', rows=len(df)):
 
         # --- Selettore intervallo data per "tornare indietro nel tempo" ---
-        daily_series = df.set_index('date_time')['traffic_volume'].resample('D').mean().round(2).reset_index()
-        min_date = daily_series['date_time'].min().date()
-        max_date = daily_series['date_time'].max().date()
+        with perf.section('rollups', cached=True):
+            rollups = load_rollups()
+        first_day, last_day = rollups.bounds('D')
+        min_date = first_day.date()
+        max_date = last_day.date()
         default_end = max_date
         default_start = max(max_date - pd.Timedelta(days=29), min_date)
 
@@ -197,19 +267,23 @@ if not df.empty:
             format="YYYY-MM-DD",
             step=pd.Timedelta(days=1)
         )
-        # Filtro dati in base all'intervallo selezionato
-        mask = (daily_series['date_time'].dt.date >= date_range[0]) & (daily_series['date_time'].dt.date <= date_range[1])
-        filtered_series = daily_series[mask]
+        # Aggregati già pronti: giornalieri, o settimanali/mensili se l'intervallo è troppo lungo
+        range_start, range_end = pd.Timestamp(date_range[0]), pd.Timestamp(date_range[1])
+        level = rollups.choose_level(range_start, range_end)
+        if level == 'H':
+            level = 'D'
+        filtered_series = rollups.range(level, range_start, range_end).rename(columns={'mean': 'traffic_volume'})
+        filtered_series['traffic_volume'] = filtered_series['traffic_volume'].round(2)
+        level_label = LEVEL_LABELS[level]
         fig_ts = px.line(filtered_series, x='date_time', y='traffic_volume')
-        _apply_plot_style(fig_ts, title="📅 Traffico nel tempo (media giornaliera)", x_title="Data", y_title="Traffico medio giornaliero (veicoli/ora)")
+        _apply_plot_style(fig_ts, title=f"📅 Traffico nel tempo (media {level_label})", x_title="Data", y_title=f"Traffico medio {level_label} (veicoli/ora)")
         st.plotly_chart(fig_ts, width='stretch')
 
         #st.markdown("**🧊 Matrice ora × giorno della settimana (media)**")
-        pivot = df.pivot_table(index='day_of_week', columns='hour', values='traffic_volume', aggfunc='mean').round(2)
         # Ordine al contrario (Domenica → Lunedì)
-        pivot = pivot.reindex([6, 5, 4, 3, 2, 1, 0])
+        pivot = agg.hour_weekday_matrix(df)
         # Heatmap senza colorbar (l'informazione principale è nei valori/hover)
-        y_labels = [day_map[i] for i in pivot.index]
+        y_labels = [DAY_MAP[i] for i in pivot.index]
         fig_heat = go.Figure(
             data=go.Heatmap(
                 z=pivot.values,
@@ -228,14 +302,13 @@ if not df.empty:
         st.plotly_chart(fig_heat, width='stretch')
 
     # --- TAB 3: Trend Stagionali ---
-    with tab3:
+    with tab3, perf.section('tab.trend_stagionali', rows=len(df)):
         col_week, col_month = st.columns(2)
 
         # Settimanale
         with col_week:
             #st.markdown("**📅 Media per giorno della settimana**")
-            ordine_giorni = ['Lunedì', 'Martedì', 'Mercoledì', 'Giovedì', 'Venerdì', 'Sabato', 'Domenica']
-            weekly_trend = df.groupby('nome_giorno')['traffic_volume'].mean().round(2).reindex(ordine_giorni).reset_index()
+            weekly_trend = agg.weekly_trend(df)
             fig_week = px.bar(weekly_trend, x='nome_giorno', y='traffic_volume', text_auto='.0f')
             fig_week.update_traces(marker_opacity=0.85)
             _apply_plot_style(fig_week, title="📅 Media per giorno della settimana", x_title="Giorno", y_title="Traffico medio (veicoli/ora)")
@@ -244,22 +317,21 @@ if not df.empty:
         # Mensile
         with col_month:
             #st.markdown("**🗓️ Stagionalità mensile**")
-            ordine_mesi = ['Gen', 'Feb', 'Mar', 'Apr', 'Mag', 'Giu', 'Lug', 'Ago', 'Set', 'Ott', 'Nov', 'Dic']
-            monthly_trend = df.groupby('nome_mese')['traffic_volume'].mean().round(2).reindex(ordine_mesi).reset_index()
+            monthly_trend = agg.monthly_trend(df)
             fig_month = px.line(monthly_trend, x='nome_mese', y='traffic_volume', markers=True)
             _apply_plot_style(fig_month, title="📅 Stagionalità mensile", x_title="Mese", y_title="Traffico medio (veicoli/ora)")
             st.plotly_chart(fig_month, width='stretch')
 
         # Annuale
         st.markdown("---")
-        yearly_trend = df.groupby('year')['traffic_volume'].mean().round(2).reset_index()
+        yearly_trend = agg.yearly_trend(df)
         fig_year = px.bar(yearly_trend, x='year', y='traffic_volume', text_auto='.0f')
         fig_year.update_xaxes(type='category')
         _apply_plot_style(fig_year, title="Trend annuale", x_title="Anno", y_title="Traffico medio (veicoli/ora)")
         st.plotly_chart(fig_year, width='stretch')
 
     # --- TAB 4: CONFRONTO DIRETTO ---
-    with tab4:
+    with tab4, perf.section('tab.confronto_diretto', rows=len(df)):
         st.subheader("🆚 Confronto tra Giorni")
         st.markdown("📌 Metti a confronto due date specifiche per analizzare differenze di traffico e contesto (meteo/weekend/holiday).")
         
@@ -293,14 +365,9 @@ if not df.empty:
         with col_in2:
             date2 = st.date_input("📅 Data 2 (Confronto)", min_value=min_date, max_value=max_date, key='cmp_date2')
         
-        # Estrai i dati
-        d1_data = df[df['date_time'].dt.date == date1].copy()
-        d2_data = df[df['date_time'].dt.date == date2].copy()
-        
-        # Tronca anche i dati estratti per confronto diretto
-        for _df in [d1_data, d2_data]:
-            float_cols = _df.select_dtypes(include=['float', 'float64', 'float32']).columns
-            _df[float_cols] = _df[float_cols].apply(lambda x: x.round(2))
+        # Estrai i dati (troncati a due decimali per confronto diretto)
+        d1_data = agg.day_slice(df, date1)
+        d2_data = agg.day_slice(df, date2)
 
         if not d1_data.empty and not d2_data.empty:
             # Calcolo Differenza Totale
@@ -333,8 +400,8 @@ if not df.empty:
 
             st.markdown("---")
             st.markdown("**🧾 Contesto delle due giornate**")
-            summary_1 = summarize_day(d1_data)
-            summary_2 = summarize_day(d2_data)
+            summary_1 = agg.summarize_day(d1_data)
+            summary_2 = agg.summarize_day(d2_data)
             # Arrotonda tutti i valori float del summary a 2 decimali
             for s in (summary_1, summary_2):
                 for k, v in s.items():
@@ -360,7 +427,7 @@ if not df.empty:
     
     # --- TAB 5: Traffico & Meteo ---
 
-    with tab5:
+    with tab5, perf.section('tab.meteo', rows=len(df)):
         st.subheader("🌦️ 5. Relazione tra Traffico e Meteo")
         st.markdown("""
         Questa sezione esamina come le **diverse condizioni meteorologiche** e i **fattori ambientali** (come 🌡️ temperatura, 💧 pioggia, ❄️ neve e ☁️ nuvolosità) influenzano il volume di traffico 🚗.
@@ -368,11 +435,10 @@ if not df.empty:
         # 5.1 Grafico traffico per tipo di meteo (weather_main)
         st.markdown("**1️⃣ 🚗 Traffico Medio per Categoria Meteo Principale** 🌦️")
         # Escludiamo i valori nulli o vuoti per l'analisi
-        weather_traffic = df[df['weather_main'].notna() & (df['weather_main'] != '')].groupby('weather_main')['traffic_volume'].agg(['mean', 'median', 'count']).sort_values('mean', ascending=False).reset_index()
-        weather_traffic.columns = ['Condizione Meteo', 'Traffico Medio', 'Traffico Mediano', 'Conteggio Ore']
+        weather_traffic = agg.weather_traffic(df)
         
         # Rimuoviamo le categorie con pochissimi campioni per evitare outlier (es. meno di 100 ore)
-        MIN_SAMPLES = 100
+        MIN_SAMPLES = agg.MIN_SAMPLES
         weather_traffic_filtered = weather_traffic[weather_traffic['Conteggio Ore'] >= MIN_SAMPLES]
         
         if not weather_traffic_filtered.empty:
@@ -397,9 +463,7 @@ if not df.empty:
         
         # --- Temperatura ---
         st.markdown("**🌡️ Traffico Medio per intervallo di Temperatura**")
-        temp_bins = pd.cut(df['temp'], bins=10, duplicates='drop')
-        temp_traffic = df.groupby(temp_bins, observed=True)['traffic_volume'].mean().round(2).reset_index()
-        temp_traffic['temp_range'] = temp_traffic['temp'].astype(str)
+        temp_traffic = agg.temp_traffic(df)
         
         fig_temp = px.bar(temp_traffic, x='temp_range', y='traffic_volume', 
                         title='🌡️🚗 Traffico Medio per intervallo di Temperatura',
@@ -414,18 +478,9 @@ if not df.empty:
         # --- Grafico Pioggia (rain_1h) ---
         with col_rain:
             st.caption("💧 Pioggia (Rain_1h) vs Traffico 🚗")
-            # Pioggia: Raggruppiamo i valori di pioggia > 0.05 per analizzare l'effetto delle piogge vere
-            rain_groups = df['rain_1h'].apply(lambda x: 'Zero/Minima' if x < 0.05 else ('Leggera' if x < 1.0 else 'Forte'))
-            # Assicuriamoci che l'ordine sia logico (Zero, Leggera, Forte)
-            if 'Leggera' in rain_groups.unique():
-                rain_traffic = df.groupby(rain_groups, observed=True)['traffic_volume'].mean().round(2).reset_index()
-                rain_traffic[rain_groups.name] = pd.Categorical(rain_traffic[rain_groups.name], categories=['Zero/Minima', 'Leggera', 'Forte'], ordered=True)
-                rain_traffic = rain_traffic.sort_values(rain_groups.name)
-            else:
-                # Caso fallback se 'Leggera' non c'è
-                rain_traffic = df.groupby(rain_groups, observed=True)['traffic_volume'].mean().round(2).reset_index().sort_values('traffic_volume', ascending=False)
+            rain_traffic = agg.rain_traffic(df)
             
-            fig_rain = px.bar(rain_traffic, x=rain_groups.name, y='traffic_volume', 
+            fig_rain = px.bar(rain_traffic, x='rain_1h', y='traffic_volume', 
                             title='💧🚗 Traffico Medio per Intensità di Pioggia',
                             text_auto='.0f')
             fig_rain.update_traces(marker_color='#17becf', opacity=0.85)
@@ -436,21 +491,11 @@ if not df.empty:
         with col_snow:
             st.caption("❄️ Neve (Snow_1h) vs Traffico 🚗")
             
-            # Filtriamo le ore dove c'è stata neve (snow_1h > 0)
-            df_snow = df[df['snow_1h'] > 0].copy()
+            snow_traffic = agg.snow_traffic(df)
             
             # Se ci sono dati di neve, analizziamo
-            if not df_snow.empty:
-                # Raggruppiamo i valori di neve > 0
-                snow_groups = df['snow_1h'].apply(lambda x: 'Zero' if x == 0 else ('Leggera' if x < 0.05 else 'Forte'))
-                
-                # Calcolo dei valori medi
-                snow_traffic = df.groupby(snow_groups, observed=True)['traffic_volume'].mean().round(2).reset_index()
-                # Ordine logico
-                snow_traffic[snow_groups.name] = pd.Categorical(snow_traffic[snow_groups.name], categories=['Zero', 'Leggera', 'Forte'], ordered=True)
-                snow_traffic = snow_traffic.sort_values(snow_groups.name)
-
-                fig_snow = px.bar(snow_traffic, x=snow_groups.name, y='traffic_volume', 
+            if not snow_traffic.empty:
+                fig_snow = px.bar(snow_traffic, x='snow_1h', y='traffic_volume', 
                                 title='❄️🚗 Traffico Medio per Intensità di Neve',
                                 text_auto='.0f')
                 fig_snow.update_traces(marker_color='#8c564b', opacity=0.85)
@@ -464,9 +509,8 @@ if not df.empty:
         st.markdown("---")
         st.caption("☁️ Nuvolosità (Clouds_all) vs Traffico 🚗")
         
-        # Nuvolosità: Creazione di bin per la percentuale di copertura nuvolosa
-        cloud_bins = pd.cut(df['clouds_all'], bins=[0, 20, 80, 101], labels=['0-20% (Sereno) ☀️', '21-80% (Variabile) 🌤️', '81-100% (Coperto) ☁️'], right=False)
-        cloud_traffic = df.groupby(cloud_bins, observed=True)['traffic_volume'].mean().round(2).reset_index()
+        # Nuvolosità: fasce di copertura nuvolosa
+        cloud_traffic = agg.cloud_traffic(df)
         
         fig_clouds = px.bar(cloud_traffic, x='clouds_all', y='traffic_volume', 
                             title='☁️🚗 Traffico Medio per Fascia di Nuvolosità',
@@ -475,5 +519,188 @@ if not df.empty:
         _apply_plot_style(fig_clouds, x_title="Copertura Nuvolosa (%) ☁️", y_title="Traffico Medio 🚗")
         st.plotly_chart(fig_clouds, width='stretch')
 
+    # --- TAB 6: Anomalie ---
+    with tab6, perf.section('tab.anomalie', rows=len(df)):
+        st.subheader("🚨 6. Anomalie rispetto al profilo atteso")
+        st.markdown("""
+        Ogni ora viene confrontata con le ore **precedenti con stessa ora e stesso giorno della settimana**:
+        è anomala se si discosta dalla loro media di oltre *z* deviazioni standard. Le ore anomale consecutive formano un evento.
+        """)
+
+        with perf.section('anomaly.scores', cached=True):
+            scores = load_anomaly_scores()
+
+        col_z, col_dir, col_min = st.columns(3)
+        with col_z:
+            z_threshold = st.slider("Soglia z", min_value=2.0, max_value=6.0, value=anomaly.Z_THRESHOLD, step=0.5)
+        with col_dir:
+            direction = st.selectbox("Direzione", ["Tutte", "sopra la norma", "sotto la norma"])
+        with col_min:
+            min_hours = st.number_input("Durata minima (ore)", min_value=1, max_value=24, value=1)
+
+        events = anomaly.anomaly_events(scores, z_threshold)
+        if direction != "Tutte":
+            events = events[events['direzione'] == direction]
+        events = events[events['ore'] >= min_hours]
+
+        m1, m2, m3 = st.columns(3)
+        m1.metric("Eventi", f"{len(events):,}")
+        m2.metric("Ore anomale", f"{int(events['ore'].sum()):,}")
+        m3.metric("Ore valutate", f"{int(scores['z'].notna().sum()):,}", help=f"Servono almeno {anomaly.MIN_HISTORY} ore precedenti con stessa ora e giorno")
+
+        if events.empty:
+            st.info("Nessun evento con i filtri selezionati.")
+        else:
+            fig_events = px.scatter(events, x='inizio', y='z_picco', color='direzione', size='ore',
+                                    hover_data=['fine', 'scarto_medio'],
+                                    color_discrete_map={'sopra la norma': '#d62728', 'sotto la norma': '#1f77b4'})
+            _apply_plot_style(fig_events, title="Eventi anomali nel tempo", x_title="Inizio evento", y_title="z di picco")
+            st.plotly_chart(fig_events, width='stretch')
+            st.dataframe(events.sort_values('inizio', ascending=False), width='stretch', hide_index=True)
+
+    with tab7, perf.section('tab.errore_modello', rows=len(residuals) if residuals is not None else 0):
+        st.subheader("🎯 7. Errore del modello sullo storico")
+        if residuals is None:
+            st.info("Residui non disponibili: esegui `python -m core.residual_store` con il modello in models/.")
+        else:
+            out_of_sample = model_errors['out_of_sample']
+            st.markdown("""
+            Predizioni del modello attuale sulle ore storiche successive alla fine dell'addestramento (con i lag
+            reali), confrontate con la **baseline** che prevede il traffico dell'ora precedente.
+            Scarto medio negativo = il modello sovrastima.
+            """)
+            if not out_of_sample:
+                st.warning("⚠️ Errori **in-sample**: il modello è stato addestrato su tutte le ore storiche, quindi "
+                           "misurano l'adattamento ai dati di training e non la qualità della previsione. Per errori "
+                           "di test indica la fine dell'addestramento con `python -m core.residual_store --train-end` "
+                           "o `DASHBOARD_TRAIN_END`.")
+            e1, e2, e3 = st.columns(3)
+            e1.metric("RMSE modello", f"{model_errors['rmse']:.0f}")
+            e2.metric("Scarto medio", f"{model_errors['bias']:+.1f}")
+            e3.metric("Ore di test" if out_of_sample else "Ore valutate (training)", f"{model_errors['rows']:,}")
+
+            group_by = st.selectbox("Raggruppa per", list(residual_store.GROUPS), format_func=residual_store.GROUPS.get)
+            profile = residual_store.error_profile(residuals, group_by, out_of_sample)
+            if group_by == 'day_of_week':
+                profile[group_by] = profile[group_by].map(DAY_MAP)
+            elif group_by == 'month':
+                profile[group_by] = profile[group_by].map(MONTH_MAP)
+            profile_long = profile.melt(id_vars=[group_by, 'ore'], value_vars=['mae', 'mae_baseline'],
+                                        var_name='serie', value_name='errore')
+            profile_long['serie'] = profile_long['serie'].map({'mae': 'Modello', 'mae_baseline': 'Baseline ora precedente'})
+            fig_err = px.bar(profile_long, x=group_by, y='errore', color='serie', barmode='group', hover_data=['ore'],
+                             color_discrete_map={'Modello': '#d62728', 'Baseline ora precedente': '#bbbbbb'})
+            _apply_plot_style(fig_err, title=f"MAE per {residual_store.GROUPS[group_by].lower()}" + ("" if out_of_sample else " (in-sample)"),
+                              x_title=residual_store.GROUPS[group_by], y_title="Errore medio assoluto (veicoli/ora)")
+            fig_err.update_xaxes(type='category')
+            st.plotly_chart(fig_err, width='stretch')
+
+            over_time = residual_store.error_over_time(residuals, out_of_sample=out_of_sample)
+            fig_time = px.line(over_time.rename(columns={'mae': 'Modello', 'mae_baseline': 'Baseline ora precedente'}),
+                               x='date_time', y=['Modello', 'Baseline ora precedente'],
+                               color_discrete_map={'Modello': '#d62728', 'Baseline ora precedente': '#bbbbbb'})
+            _apply_plot_style(fig_time, title="MAE mensile nel tempo" + ("" if out_of_sample else " (in-sample)"), x_title="Mese", y_title="Errore medio assoluto (veicoli/ora)")
+            st.plotly_chart(fig_time, width='stretch')
+
+    # --- TAB 8: Impatto di festività ed episodi meteo ---
+    with tab8, perf.section('tab.eventi', rows=len(df)):
+        st.subheader("🎉 8. Impatto di festività ed eventi meteo")
+        st.markdown("""
+        Tutte le occorrenze di un evento vengono **allineate al suo inizio** (00:00 per le festività, prima ora
+        dell'episodio per il meteo) e confrontate con il **traffico tipico** di quelle ore (media per ora, giorno,
+        mese nei giorni non festivi). La curva è lo scarto medio, la fascia l'intervallo di confidenza al 95%.
+        """)
+        with perf.section('events.index', cached=True):
+            event_index = load_event_index()
+        catalog = event_index.catalog()
+        labels = {row.evento: f"{row.evento} ({row.occorrenze} {'volte' if row.tipo == 'festività' else 'episodi'})"
+                  for row in catalog.itertuples()}
+        default_events = [e for e in ('Thanksgiving Day', 'Neve intensa') if e in labels] or list(labels)[:1]
+
+        col_ev, col_before, col_after, col_dur = st.columns([3, 1, 1, 1])
+        with col_ev:
+            selected_events = st.multiselect("Eventi", list(labels), default=default_events, format_func=labels.get)
+        with col_before:
+            hours_before = st.number_input("Ore prima", min_value=0, max_value=336, value=48, step=12)
+        with col_after:
+            hours_after = st.number_input("Ore dopo", min_value=1, max_value=336, value=48, step=12)
+        with col_dur:
+            min_event_hours = st.number_input("Durata minima episodi meteo (ore)", min_value=1, max_value=48, value=1)
+
+        if not selected_events:
+            st.info("Seleziona almeno un evento.")
+        else:
+            fig_events = go.Figure()
+            impact_rows = []
+            palette = px.colors.qualitative.Plotly
+            for i, name in enumerate(selected_events):
+                # Eventi meteo: filtro sulla durata; le festività durano sempre 24 ore
+                with perf.section('events.impact_curve'):
+                    curve = event_index.impact_curve(name, hours_before, hours_after, min_event_hours)
+                color = palette[i % len(palette)]
+                r, g, b = px.colors.hex_to_rgb(color)
+                fig_events.add_trace(go.Scatter(
+                    x=np.concatenate([curve['offset'], curve['offset'][::-1]]),
+                    y=np.concatenate([curve['scarto_sup'], curve['scarto_inf'][::-1]]),
+                    fill='toself', fillcolor=f'rgba({r},{g},{b},0.15)', line=dict(width=0),
+                    hoverinfo='skip', showlegend=False, name=f"{name} (IC 95%)"))
+                fig_events.add_trace(go.Scatter(
+                    x=curve['offset'], y=curve['scarto'], mode='lines', name=name, line=dict(color=color, width=3),
+                    customdata=np.stack([curve['traffico'], curve['atteso'], curve['occorrenze']], axis=1),
+                    hovertemplate="%{y:+,.0f} veicoli/ora (traffico %{customdata[0]:,.0f}, tipico %{customdata[1]:,.0f}, "
+                                  "%{customdata[2]} occorrenze)<extra>" + name + "</extra>"))
+                first_day = curve[(curve['offset'] >= 0) & (curve['offset'] < 24)]
+                impact_rows.append({
+                    'Evento': name,
+                    'Occorrenze': len(event_index.occurrences(name, min_event_hours)),
+                    'Scarto medio prime 24h': first_day['scarto'].mean(),
+                    'Scarto minimo': curve['scarto'].min(),
+                    'Scarto massimo': curve['scarto'].max(),
+                })
+            fig_events.add_hline(y=0, line_color="#999999")
+            fig_events.add_vline(x=0, line_dash="dash", line_color="#d62728")
+            _apply_plot_style(fig_events, title="Scarto medio dal traffico tipico attorno all'evento",
+                              x_title="Ore dall'inizio dell'evento", y_title="Scarto (veicoli/ora)")
+            st.plotly_chart(fig_events, width='stretch')
+            st.dataframe(pd.DataFrame(impact_rows).round(0), width='stretch', hide_index=True)
+
+            detail = st.selectbox("Occorrenze di", selected_events, key='events_detail')
+            occurrences = event_index.occurrences(detail, min_event_hours)
+            st.dataframe(occurrences[['inizio', 'fine', 'ore']].sort_values('inizio', ascending=False),
+                         width='stretch', hide_index=True,
+                         column_config={'inizio': 'Inizio', 'fine': 'Fine', 'ore': 'Durata (ore)'})
+
+    # --- SEZIONE 3: CONFRONTO TRA SENSORI (solo con il dataset partizionato, python -m core.sensors partition) ---
+    with perf.section('sensors.store', cached=True):
+        sensor_store = load_sensor_store()
+    if sensor_store is not None and len(sensor_store.sensor_ids()) > 1:
+        st.subheader("🛰️ 3. Confronto tra sensori")
+        all_sensors = sensor_store.sensor_ids()
+        selected_sensors = st.multiselect("Sensori", all_sensors, default=all_sensors,
+                                          format_func=lambda sid: sensor_store.info(sid)['name'])
+        if selected_sensors:
+            # Ogni partizione viene letta una volta: le pagine combinano solo somme e conteggi per sensore
+            with perf.section('sensors.aggregate', rows=len(selected_sensors)):
+                sensor_table = sensor_kpis(sensor_store, congestion_threshold, selected_sensors)
+                profiles = pd.concat(
+                    [combined_profile(sensor_store, 'hour', [sid]).rename(sensor_store.info(sid)['name']) for sid in selected_sensors]
+                    + [combined_profile(sensor_store, 'hour', selected_sensors).rename('Tutti i sensori')], axis=1)
+
+            st.dataframe(
+                sensor_table[['nome', 'ore', 'media', 'massimo', 'congestionate', 'quota_congestionate', 'inizio', 'fine']],
+                width='stretch', hide_index=True,
+                column_config={
+                    'nome': 'Sensore', 'ore': 'Ore', 'media': 'Traffico medio', 'massimo': 'Picco',
+                    'congestionate': f'Ore oltre {congestion_threshold:,}',
+                    'quota_congestionate': st.column_config.NumberColumn('Quota congestionate', format='percent'),
+                    'inizio': 'Inizio', 'fine': 'Fine',
+                })
+            profiles_long = profiles.reset_index().melt(id_vars='hour', var_name='sensore', value_name='traffic_volume')
+            fig_sensors = px.line(profiles_long, x='hour', y='traffic_volume', color='sensore', markers=True)
+            _apply_plot_style(fig_sensors, title="Profilo orario per sensore", x_title="Ora del giorno", y_title="Veicoli/ora medi")
+            st.plotly_chart(fig_sensors, width='stretch')
+
 else:
-    st.error("❌ Errore nel caricamento dei dati.")
\ No newline at end of file
+    st.error("❌ Errore nel caricamento dei dati.")
+
+perf.end_run()
@@ -1,13 +1,25 @@
 import streamlit as st
 import pandas as pd
 import numpy as np
-import pickle
 import altair as alt
 import datetime
-from datetime import datetime, timedelta
+import os
+from datetime import datetime
+
+from core import perf
+from core.attributions import BASE, contribution_table
+from core.charts import HISTORY_WINDOWS, render_history_forecast_chart
+from core.data import DATA_PATH, DAY_MAP, MODEL_PATH
+from core.diagnostics import health_checks
+from core.forecast import HORIZON_CHOICES, features_to_frame, hours_for_choice, iter_forecast
+from core.linear_fast import iter_linear_forecast
+from core.prediction_cache import PredictionCache, day_grid_rows, model_predict_fn
+from core.refresh import dashboard_managers
+from service.client import ForecastClient
 
 # --- 1. CONFIGURAZIONE ---
 st.set_page_config(page_title="Traffic AI Forecast", page_icon="🚦", layout="wide")
+perf.start_run("Previsioni")
 
 st.markdown("""
 <style>
@@ -29,226 +41,79 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
-MODEL_PATH = 'models/rf_pipeline.pkl'
+# Se impostato, le previsioni vengono chieste al servizio headless (python -m service.server)
+FORECAST_SERVICE_URL = os.environ.get('FORECAST_SERVICE_URL')
+service_client = ForecastClient(FORECAST_SERVICE_URL) if FORECAST_SERVICE_URL else None
 
-DATA_PATH = 'dataset/cleaned_data.csv'
 
-@st.cache_resource
-def load_model():
+# Dataset e modello arrivano dai gestori di core/refresh.py, comuni a tutte le sessioni: quando
+# cleaned_data.csv o il pickle cambiano (es. python -m training.online), la nuova versione viene
+# preparata in background e nel frattempo le pagine continuano a usare quella precedente.
+def refresh_managers():
+    return dashboard_managers(DATA_PATH, MODEL_PATH)
+
+
+# Versioni lette in questo run (il dizionario riparte vuoto a ogni rerun): tutte le sezioni della
+# pagina usano la stessa versione anche se a metà run ne diventa pronta una nuova
+_run_snapshots = {}
+
+
+def current_snapshot(name):
+    if name not in _run_snapshots:
+        _run_snapshots[name] = refresh_managers()[name].get()
+    return _run_snapshots[name]
+
+
+def load_data_bundle():
+    """Frame dello storico (dataset condiviso in memory-map, sola lettura) e strutture derivate."""
     try:
-        with open(MODEL_PATH, 'rb') as f:
-            return pickle.load(f)
+        return current_snapshot('dati').value
     except Exception as e:
-        st.error(f"Errore caricamento modello: {e}")
+        st.error(f"Impossibile leggere {DATA_PATH}: {e}")
         return None
 
-def estimate_background_lags(hour):
-    """Restituisce una stima automatica basata sull'ora"""
-    if 0 <= hour <= 5: return 500.0
-    elif 6 <= hour <= 9: return 4500.0
-    elif 10 <= hour <= 15: return 3500.0
-    elif 16 <= hour <= 19: return 5000.0
-    else: return 2000.0
-
 
-@st.cache_data
-def load_cleaned_data(path=DATA_PATH):
+def load_model_snapshot():
+    """Versione corrente del modello: pipeline, versione compilata, contributi, diagnostica."""
     try:
-        df = pd.read_csv(path, parse_dates=['date_time'])
-        return df
+        return current_snapshot('modello')
     except Exception as e:
-        st.error(f"Impossibile leggere {path}: {e}")
+        st.error(f"Errore caricamento modello: {e}")
         return None
 
 
-def holiday_for_date(df, dt):
-    # Cerca nel dataset una festività per la data specificata
-    day = dt.normalize()
-    mask = df['date_time'].dt.normalize() == day
-    if mask.any():
-        vals = df.loc[mask, 'holiday'].unique()
-        vals = [v for v in vals if str(v).lower() not in ('none', 'nan', 'nan.0')]
-        return vals[0] if len(vals) > 0 else None
-    return None
-
-
-def choose_weather_from_last12(combined_df, ref_dt):
-    # prende le ultime 12 righe antecedenti a ref_dt (escluse)
-    cutoff = ref_dt - pd.Timedelta(hours=12)
-    sel = combined_df[(combined_df['date_time'] > cutoff) & (combined_df['date_time'] < ref_dt)]
-    if sel.empty:
-        return None, None, np.nan, 0.0, 0.0, 0.0
-    main = sel['weather_main'].mode()
-    desc = sel['weather_description'].mode()
-    clouds = sel['clouds_all'].median()
-    temp = sel['temp'].iloc[-1] if 'temp' in sel.columns else sel['temp'].mean()
-    rain = sel['rain_1h'].max() if 'rain_1h' in sel.columns else 0.0
-    snow = sel['snow_1h'].max() if 'snow_1h' in sel.columns else 0.0
-    return (main.iloc[0] if not main.empty else None,
-            desc.iloc[0] if not desc.empty else None,
-            temp,
-            rain,
-            snow,
-            clouds)
-
-
-def build_feature_row(dt, holiday, is_weekend, weather_main, weather_desc, temp, rain, snow, clouds, lag_1, lag_24, lag_168):
-    return {
-        'date_time': dt,
-        'holiday': holiday,
-        'temp': float(temp),
-        'rain_1h': float(rain),
-        'snow_1h': float(snow),
-        'clouds_all': float(clouds),
-        'weather_main': weather_main,
-        'weather_description': weather_desc,
-        'hour': float(dt.hour),
-        'day_of_week': float(dt.weekday()),
-        'month': float(dt.month),
-        'year': float(dt.year),
-        'is_weekend': bool(is_weekend),
-        'lag_1': float(lag_1),
-        'lag_24': float(lag_24),
-        'lag_168': float(lag_168)
-    }
+# `version` (checksum del pickle) fa parte della chiave: con un modello nuovo la cache riparte vuota
+@st.cache_resource(max_entries=2)
+def load_prediction_cache(version=None):
+    """Cache LRU delle predizioni manuali del modello `version`, condivisa da tutte le sessioni."""
+    return PredictionCache()
 
 
-def render_history_forecast_chart(chart_placeholder, hist_plot_df, preds_df_state):
-    """Renderizza (e aggiorna) il grafico persistente storico + previsto."""
-    hist_plot_df = hist_plot_df[['date_time', 'traffic_volume']].copy()
-    hist_plot_df['date_time'] = pd.to_datetime(hist_plot_df['date_time'])
-
-    hist_series = hist_plot_df.copy()
-    hist_series['series'] = 'Storico'
-
-    plot_df = hist_series
-    forecast_rule_dt = None
-    pred_series = None
-    pred_line_series = None
-    if isinstance(preds_df_state, pd.DataFrame) and not preds_df_state.empty:
-        preds_df_state = preds_df_state[['date_time', 'traffic_volume']].copy()
-        preds_df_state['date_time'] = pd.to_datetime(preds_df_state['date_time'])
-        pred_series = preds_df_state.copy()
-        pred_series['series'] = 'Previsto'
-        # Punto ponte: include l'ultima ora nota nella serie "Previsto" per evitare il buco
-        # (così la linea rossa collega l'ultimo punto storico al primo previsto)
-        last_hist_point = hist_series.sort_values('date_time').tail(1).copy()
-        last_hist_point['series'] = 'Previsto'
-        if not last_hist_point.empty:
-            pred_line_series = pd.concat([last_hist_point, pred_series], ignore_index=True)
-        else:
-            pred_line_series = pred_series.copy()
-
-        plot_df = pd.concat([hist_series, pred_line_series], ignore_index=True)
-        # Riga verticale: in corrispondenza dell'ultimo valore noto (fine storico)
-        forecast_rule_dt = pd.to_datetime(last_hist_point['date_time'].iloc[0])
-
-    # Dominio X: padding a destra per decentramento a sinistra e per mostrare tutte le previsioni
-    if plot_df.empty:
-        chart_placeholder.write("Nessun dato da mostrare.")
-        return
-
-    x_start_full = plot_df['date_time'].min()
-    x_end_raw = plot_df['date_time'].max()
-    span = (x_end_raw - x_start_full) if pd.notna(x_start_full) and pd.notna(x_end_raw) else pd.Timedelta(hours=24)
-    # padding a destra: serve sia per decentramento sia per garantire visibilità del primo punto previsto
-    pad = max(pd.Timedelta(hours=18), span * 0.18)
-    x_end = x_end_raw + pad
-
-    # Calcola la finestra visibile iniziale: vogliamo includere molto storico nel dataframe
-    # ma zoomare inizialmente solo sulla porzione finale proporzionale all'orizzonte di previsione.
-    # Prendiamo la scelta di orizzonte salvata in session_state (se presente).
-    fc_choice = st.session_state.get('forecast_choice')
-    # mappa scelta -> finestra visibile
-    choice_map = {
-        'Ora successiva': pd.Timedelta(hours=6),
-        'Oggi': pd.Timedelta(hours=24),
-        'Oggi e Domani': pd.Timedelta(days=2),
-        'Prossimi 3gg': pd.Timedelta(days=3),
-        'Prossima settimana': pd.Timedelta(days=7),
-        'Prossimo mese': pd.Timedelta(days=30)
-    }
-    # fallback: se non c'è scelta previsione, usa il range storico selezionato (se presente)
-    hist_choice = st.session_state.get('traffic_hist_choice')
-    hist_map = {
-        '24h': pd.Timedelta(hours=24),
-        '3gg': pd.Timedelta(days=3),
-        '1sett': pd.Timedelta(days=7),
-        '1 mese': pd.Timedelta(days=30),
-        '1 anno': pd.Timedelta(days=365)
-    }
+def load_cleaned_data():
+    data = load_data_bundle()
+    return data['previsioni'] if data is not None else None
 
-    if fc_choice in choice_map:
-        visible_span = choice_map[fc_choice]
-    elif hist_choice in hist_map:
-        visible_span = hist_map[hist_choice]
-    else:
-        visible_span = pd.Timedelta(days=7)
-
-    # Non mostrare più del range totale disponibile
-    visible_span = min(visible_span, span)
-    x_visible_start = max(x_start_full, x_end_raw - visible_span)
-
-    # Dominio Y: includi sempre lo zero (serve anche per lo shading della singola ora prevista)
-    y_min = 0.0
-    y_max = float(plot_df['traffic_volume'].max() * 1.05) if not plot_df.empty else 1.0
-    y_scale = alt.Scale(domain=[y_min, y_max])
-
-    line_colors = alt.Scale(domain=['Storico', 'Previsto'], range=['gray', '#FF4B4B'])
-
-    hist_area = alt.Chart(hist_plot_df).mark_area(opacity=0.12, color='lightgray').encode(
-        x=alt.X('date_time:T', scale=alt.Scale(domain=[x_visible_start, x_end])),
-        y=alt.Y('traffic_volume:Q', scale=y_scale)
-    )
-    lines = alt.Chart(plot_df).mark_line(strokeWidth=2).encode(
-        x=alt.X('date_time:T', scale=alt.Scale(domain=[x_visible_start, x_end])),
-        y=alt.Y('traffic_volume:Q', scale=y_scale),
-        color=alt.Color('series:N', scale=line_colors, legend=alt.Legend(title=None))
-    )
-
-    layers = [hist_area]
-
-    # Rosso SOLO area sottesa alle previsioni
-    if pred_series is not None and not pred_series.empty:
-        # Usa la serie con punto ponte per colorare anche il tratto ultimo noto -> prima previsione
-        area_df = pred_line_series if isinstance(pred_line_series, pd.DataFrame) and not pred_line_series.empty else pred_series
-
-        if len(area_df) >= 2:
-            forecast_area = alt.Chart(area_df).mark_area(opacity=0.18, color='#FF4B4B').encode(
-                x=alt.X('date_time:T', scale=alt.Scale(domain=[x_visible_start, x_end])),
-                y=alt.Y('traffic_volume:Q', scale=y_scale)
-            )
-            layers.append(forecast_area)
-        else:
-            # Caso 1 sola previsione: l'area non si vede (serve almeno 2 punti).
-            # Usa una barra semitrasparente per rendere visibile lo shading della prima ora prevista.
-            forecast_bar = alt.Chart(pred_series).mark_bar(opacity=0.18, color='#FF4B4B', size=16).encode(
-                x=alt.X('date_time:T', scale=alt.Scale(domain=[x_visible_start, x_end])),
-                y=alt.Y('traffic_volume:Q', scale=y_scale),
-                y2=alt.value(y_min)
-            )
-            layers.append(forecast_bar)
 
-    layers.append(lines)
+def load_rollups():
+    """Piramide di aggregati dello storico: le finestre del grafico si leggono con searchsorted."""
+    data = load_data_bundle()
+    return data['rollups'] if data is not None else None
+
+
+def load_threshold_index():
+    """ECDF dello storico per ora, usata per collocare la previsione manuale."""
+    data = load_data_bundle()
+    return data['threshold_index'] if data is not None else None
+
 
-    # Pallino SOLO sull'ultima previsione corrente
-    if pred_series is not None and not pred_series.empty:
-        last_pred_point = pred_series.sort_values('date_time').tail(1)
-        pred_point = alt.Chart(last_pred_point).mark_circle(size=80, color='#FF4B4B').encode(
-            x=alt.X('date_time:T', scale=alt.Scale(domain=[x_visible_start, x_end])),
-            y=alt.Y('traffic_volume:Q', scale=y_scale),
-            tooltip=['date_time:T', 'traffic_volume:Q']
-        )
-        layers.append(pred_point)
+def load_climatology():
+    """Medie storiche per ora × giorno × mese × festivo: stima istantanea e lag di default."""
+    data = load_data_bundle()
+    return data['climatology'] if data is not None else None
 
-    if forecast_rule_dt is not None:
-        rule_df = pd.DataFrame({'date_time': [forecast_rule_dt]})
-        rule = alt.Chart(rule_df).mark_rule(color='#FF4B4B', strokeDash=[6, 6]).encode(
-            x=alt.X('date_time:T', scale=alt.Scale(domain=[x_visible_start, x_end]))
-        )
-        layers.append(rule)
 
-    chart_placeholder.altair_chart(alt.layer(*layers).interactive(), width='stretch')
+# Durante la previsione ricorsiva il grafico si aggiorna ogni REFINE_EVERY ore calcolate dal modello
+REFINE_EVERY = 48
 
 # --- LISTE OPZIONI ---
 holiday_options = [
@@ -277,7 +142,18 @@ weather_map = {
 st.title("🚦 AI Traffic Predictor")
 st.markdown("---")
 
-pipeline = load_model()
+with perf.section('load_model', cached=True):
+    model_snapshot = load_model_snapshot()
+model_version = model_snapshot.version if model_snapshot is not None else None
+model_bundle = model_snapshot.value if model_snapshot is not None else {}
+pipeline = perf.instrument_model(model_bundle.get('pipeline'))
+if any(m.status()['building'] for m in refresh_managers().values()):
+    st.caption("🔄 È in preparazione una nuova versione di dati o modello: fino al termine si usano quelli attuali.")
+
+# Predizioni del form manuale: servizio headless se configurato, altrimenti modello locale
+# (con una pipeline lineare, la versione compilata: stesso risultato senza transform sklearn)
+compiled_model = model_bundle.get('compiled')
+manual_predict_fn = service_client.predict_many if service_client is not None else model_predict_fn(compiled_model or pipeline)
 
 if pipeline is not None:
 
@@ -285,7 +161,9 @@ if pipeline is not None:
     #st.markdown("---")
     st.markdown("### 🔁 Previsioni del traffico")
 
-    cleaned_df = load_cleaned_data()
+    with perf.section('load_data', cached=True) as sec:
+        cleaned_df = load_cleaned_data()
+        sec.rows = len(cleaned_df) if cleaned_df is not None else 0
     if cleaned_df is None:
         st.warning("Dataset non caricato: assicurati che cleaned_data.csv esista nella cartella.")
     else:
@@ -295,13 +173,7 @@ if pipeline is not None:
         next_dt = last_dt + pd.Timedelta(hours=1)
 
         # Storico sempre visibile (grafico persistente): usiamo session_state per non perdere i punti previsti
-        history_windows = {
-            '24h': pd.Timedelta(hours=24),
-            '3gg': pd.Timedelta(days=3),
-            '1sett': pd.Timedelta(days=7),
-            '1 mese': pd.Timedelta(days=30),
-            '1 anno': pd.Timedelta(days=365)
-        }
+        history_windows = HISTORY_WINDOWS
 
         if 'traffic_hist_choice' not in st.session_state:
             st.session_state['traffic_hist_choice'] = '24h'
@@ -309,6 +181,8 @@ if pipeline is not None:
             st.session_state['traffic_preds_df'] = None
         if 'traffic_generated_full_df' not in st.session_state:
             st.session_state['traffic_generated_full_df'] = None
+        if 'traffic_attributions_df' not in st.session_state:
+            st.session_state['traffic_attributions_df'] = None
 
         # Layout a 2 colonne: controlli a sinistra, grafico a destra (meno scroll)
         left_panel, right_panel = st.columns([1, 2], gap="large")
@@ -322,6 +196,7 @@ if pipeline is not None:
             if st.button("↩️ Reset previsioni"):
                 st.session_state['traffic_preds_df'] = None
                 st.session_state['traffic_generated_full_df'] = None
+                st.session_state['traffic_attributions_df'] = None
 
             #st.caption("Genera le previsioni: il grafico a destra si aggiorna e si estende.")
 
@@ -329,27 +204,31 @@ if pipeline is not None:
             with st.form("multi_forecast_form", clear_on_submit=False):
                 choice = st.radio(
                     "Orizzonte previsioni:",
-                    ("Ora successiva", "Oggi", "Oggi e Domani", "Prossimi 3gg", "Prossima settimana", "Prossimo mese"),
+                    HORIZON_CHOICES,
                     horizontal=False
                 )
                 generate = st.form_submit_button("▶️ Genera previsioni")
 
         hist_choice = st.session_state['traffic_hist_choice']
         delta = history_windows[hist_choice]
-        if delta is None:
-            hist_df = cleaned_df.copy()
-        else:
-            hist_df = cleaned_df[cleaned_df['date_time'] >= (last_dt - delta)].copy()
-
-        hist_plot_df = hist_df[['date_time', 'traffic_volume']].copy()
+        rollups = load_rollups()
+        first_dt = cleaned_df['date_time'].min()
+        # Finestre lunghe (es. 1 anno) in media giornaliera: al massimo DEFAULT_POINT_BUDGET punti
+        level, hist_plot_df = rollups.window(first_dt if delta is None else last_dt - delta, last_dt)
+        if level != 'H' and not hist_plot_df.empty:
+            # ultima ora reale in coda, così la linea delle previsioni parte dal valore corretto
+            last_row = cleaned_df.loc[cleaned_df['date_time'] == last_dt, ['date_time', 'traffic_volume']].head(1)
+            hist_plot_df = pd.concat([hist_plot_df[hist_plot_df['date_time'] < last_dt], last_row], ignore_index=True)
         if hist_plot_df.empty:
             hist_plot_df = pd.DataFrame({'date_time': pd.to_datetime([]), 'traffic_volume': []})
 
         # Grafico a destra (sempre visibile)
         with right_panel:
             chart_placeholder = st.empty()
+            tier_placeholder = st.empty()
             preds_df_state = st.session_state.get('traffic_preds_df')
-            render_history_forecast_chart(chart_placeholder, hist_plot_df, preds_df_state)
+            with perf.section('chart.history_forecast', rows=len(hist_plot_df)):
+                render_history_forecast_chart(chart_placeholder, hist_plot_df, preds_df_state)
 
         if generate:
             # Modalità incrementale: se scegli "Ora successiva", estendi le previsioni già presenti
@@ -364,102 +243,64 @@ if pipeline is not None:
                 # per gli altri orizzonti (o primo run), rigenera da fine dataset e resetta lo stato previsione
                 st.session_state['traffic_generated_full_df'] = None
                 st.session_state['traffic_preds_df'] = None
+                st.session_state['traffic_attributions_df'] = None
                 base_working = cleaned_df.copy().sort_values('date_time').reset_index(drop=True)
                 start_dt = base_working['date_time'].max() + pd.Timedelta(hours=1)
 
             # Calcolo ore da prevedere in base alla scelta (a partire da start_dt)
-            if choice == "Ora successiva":
-                hours_to_forecast = 1
-            elif choice == "Oggi":
-                end_dt = datetime.combine(start_dt.date(), datetime.max.time()).replace(hour=23, minute=0, second=0, microsecond=0)
-                hours_to_forecast = int((end_dt - start_dt) / pd.Timedelta(hours=1)) + 1
-                hours_to_forecast = max(1, hours_to_forecast)
-            elif choice == "Oggi e Domani":
-                end_dt = datetime.combine((start_dt + pd.Timedelta(days=1)).date(), datetime.max.time()).replace(hour=23, minute=0, second=0, microsecond=0)
-                hours_to_forecast = int((end_dt - start_dt) / pd.Timedelta(hours=1)) + 1
-                hours_to_forecast = max(1, hours_to_forecast)
-            elif choice == "Prossimi 3gg":
-                hours_to_forecast = 72
-            elif choice == "Prossima settimana":
-                hours_to_forecast = 168
-            elif choice == "Prossimo mese":
-                hours_to_forecast = 720
-            else:
-                hours_to_forecast = 1
+            hours_to_forecast = hours_for_choice(choice, start_dt)
 
             preds = []
-            working = base_working.copy()
             newly_generated_rows = []
 
-            # valore iniziale per lag_1 = ultimo traffico del dataset
-            last_known_traffic = working['traffic_volume'].iloc[-1]
-
-            current_dt = start_dt
-            for i in range(int(hours_to_forecast)):
-                # holiday mapping basata sul dataset
-                hol = holiday_for_date(working, current_dt)
-                is_weekend = current_dt.weekday() >= 5
-
-                # scegli meteo basato sulle ultime 12h
-                wm, wd, temp_sel, rain_sel, snow_sel, clouds_sel = choose_weather_from_last12(working, current_dt)
-                if wm is None:
-                    # fallback: prendi ultimo record
-                    last = working.iloc[-1]
-                    wm = last['weather_main']
-                    wd = last['weather_description']
-                    temp_sel = last['temp']
-                    rain_sel = last.get('rain_1h', 0.0)
-                    snow_sel = last.get('snow_1h', 0.0)
-                    clouds_sel = last.get('clouds_all', 0.0)
-
-                # lag_1 è l'ultimo valore noto (predetto o reale)
-                lag_1_val = last_known_traffic
-
-                # lag_24 e lag_168: cerchiamo nel working dataframe
-                ts_24 = current_dt - pd.Timedelta(hours=24)
-                ts_168 = current_dt - pd.Timedelta(hours=168)
-
-                row_24 = working[working['date_time'] == ts_24]
-                row_168 = working[working['date_time'] == ts_168]
-
-                lag_24_val = row_24['traffic_volume'].iloc[0] if not row_24.empty else lag_1_val
-                lag_168_val = row_168['traffic_volume'].iloc[0] if not row_168.empty else lag_1_val
-
-                feat = build_feature_row(current_dt, hol, is_weekend, wm, wd, temp_sel, rain_sel, snow_sel, clouds_sel, lag_1_val, lag_24_val, lag_168_val)
-
-                # dataframe per il predict (no date_time)
-                X = pd.DataFrame([feat])
-                X = X.drop(columns=['date_time'])
-                # assicurarsi tipi giusti
-                X['holiday'] = X['holiday'].astype(object)
-                X['weather_main'] = X['weather_main'].astype(object)
-                X['weather_description'] = X['weather_description'].astype(object)
-
-                try:
-                    yhat = pipeline.predict(X)[0]
-                    yhat = int(max(0, yhat))
-                except Exception as e:
-                    st.error(f"Errore predizione iterativa: {e}")
-                    break
-
-                # append ai risultati e al working dataframe (affinché i lag futuri usino le predizioni)
-                preds.append({'date_time': current_dt, 'traffic_volume': yhat})
-
-                new_row = {**feat}
-                new_row['traffic_volume'] = yhat
-                newly_generated_rows.append(new_row)
-                working = pd.concat([working, pd.DataFrame([new_row])], ignore_index=True, sort=False)
-
-                # aggiorna last_known_traffic e passo avanti di un'ora
-                last_known_traffic = yhat
-                current_dt = current_dt + pd.Timedelta(hours=1)
+            # Primo livello: stima istantanea dalla climatologia per tutto l'orizzonte, mostrata
+            # subito; le ore calcolate dal modello la sostituiscono man mano
+            climatology = load_climatology()
+            instant_df = None
+            kept_preds_df = st.session_state.get('traffic_preds_df')
+
+            def show_tiers(model_preds):
+                """Grafico con previsioni precedenti + ore già calcolate dal modello + stima per le restanti."""
+                parts = [kept_preds_df, pd.DataFrame(model_preds, columns=['date_time', 'traffic_volume']),
+                         instant_df.iloc[len(model_preds):]]
+                parts = [p for p in parts if isinstance(p, pd.DataFrame) and not p.empty]
+                render_history_forecast_chart(chart_placeholder, hist_plot_df, pd.concat(parts, ignore_index=True))
+
+            if climatology is not None:
+                with perf.section('forecast.climatology', rows=hours_to_forecast):
+                    instant_df = climatology.forecast(start_dt, hours_to_forecast)
+                    show_tiers([])
+                tier_placeholder.caption("⚡ Stima istantanea dal profilo storico (ora × giorno × mese × festivo): "
+                                         "il modello la sostituisce appena pronto.")
+
+            # Previsione ricorsiva: i lag futuri usano le predizioni già generate
+            try:
+                with perf.section('forecast.loop', rows=hours_to_forecast):
+                    if service_client is not None:
+                        # Il servizio parte dal proprio storico: gli passiamo le previsioni già generate
+                        extra_rows = existing_full.to_dict('records') if incremental and isinstance(existing_full, pd.DataFrame) and not existing_full.empty else None
+                        service_preds, service_rows = service_client.forecast(hours_to_forecast, extra_rows=extra_rows)
+                        preds = service_preds.to_dict('records')
+                        newly_generated_rows = service_rows.to_dict('records')
+                    else:
+                        if compiled_model is not None:
+                            steps = iter_linear_forecast(compiled_model, base_working.copy(), start_dt, hours_to_forecast)
+                        else:
+                            steps = iter_forecast(pipeline, base_working.copy(), start_dt, hours_to_forecast)
+                        for current_dt, yhat, new_row in steps:
+                            preds.append({'date_time': current_dt, 'traffic_volume': yhat})
+                            newly_generated_rows.append(new_row)
+                            if instant_df is not None and len(preds) % REFINE_EVERY == 0 and len(preds) < hours_to_forecast:
+                                show_tiers(preds)
+            except Exception as e:
+                st.error(f"Errore predizione iterativa: {e}")
+            tier_placeholder.empty()
 
             if len(preds) == 0:
-                st.info("Nessuna previsione generata.")
+                st.info("Nessuna previsione generata." if instant_df is None
+                        else "Nessuna previsione del modello: il grafico mostra solo la stima dal profilo storico.")
             else:
                 df_preds = pd.DataFrame(preds)
-                df_preds_display = df_preds.copy()
-                df_preds_display['date_time'] = pd.to_datetime(df_preds_display['date_time'])
 
                 # aggiorna lo stato incrementale completo (con feature) per futuri step
                 new_full_df = pd.DataFrame(newly_generated_rows)
@@ -469,18 +310,36 @@ if pipeline is not None:
                     full_df = new_full_df
                 st.session_state['traffic_generated_full_df'] = full_df
 
+                # Contributi delle feature per tutte le ore nuove in un solo batch, salvati con le
+                # previsioni: la scomposizione di un'ora si mostra senza altre chiamate al modello
+                attributor = model_bundle.get('attributor')
+                if attributor is not None:
+                    try:
+                        with perf.section('forecast.attributions', rows=len(newly_generated_rows)):
+                            X_new = features_to_frame(newly_generated_rows).drop(columns=['traffic_volume'], errors='ignore')
+                            new_attr = attributor.explain(X_new)
+                            new_attr.index = pd.DatetimeIndex(new_full_df['date_time'])
+                        prev_attr = st.session_state.get('traffic_attributions_df')
+                        if incremental and isinstance(prev_attr, pd.DataFrame):
+                            new_attr = pd.concat([prev_attr, new_attr])
+                        st.session_state['traffic_attributions_df'] = new_attr[~new_attr.index.duplicated(keep='last')]
+                    except Exception as e:
+                        st.session_state['traffic_attributions_df'] = None
+                        st.warning(f"Contributi delle feature non disponibili: {e}")
+
                 # Persisti previsioni leggere per il grafico (date_time, traffic_volume)
                 prev_preds_df = st.session_state.get('traffic_preds_df')
                 if incremental and isinstance(prev_preds_df, pd.DataFrame) and not prev_preds_df.empty:
-                    all_preds = pd.concat([prev_preds_df, df_preds_display], ignore_index=True)
+                    all_preds = pd.concat([prev_preds_df, df_preds], ignore_index=True)
                 else:
-                    all_preds = df_preds_display
+                    all_preds = df_preds
                 all_preds = all_preds.drop_duplicates(subset=['date_time']).sort_values('date_time').reset_index(drop=True)
 
-                st.session_state['traffic_preds_df'] = all_preds.copy()
+                st.session_state['traffic_preds_df'] = all_preds
 
                 # Aggiorna subito il grafico nello stesso run
-                render_history_forecast_chart(chart_placeholder, hist_plot_df, st.session_state['traffic_preds_df'])
+                with perf.section('chart.history_forecast', rows=len(hist_plot_df)):
+                    render_history_forecast_chart(chart_placeholder, hist_plot_df, st.session_state['traffic_preds_df'])
 
 
         # Mostra SEMPRE le previsioni già generate (non devono sparire cambiando lo storico)
@@ -501,6 +360,81 @@ if pipeline is not None:
                 st.write("Tabella previsioni")
                 st.dataframe(preds_to_show, width='stretch', height=260)
 
+                attributions = st.session_state.get('traffic_attributions_df')
+                if isinstance(attributions, pd.DataFrame) and not attributions.empty:
+                    st.write("### 🔍 Perché questa previsione?")
+                    explained_dt = st.selectbox(
+                        "Ora da spiegare",
+                        list(attributions.index),
+                        format_func=lambda t: f"{DAY_MAP[t.weekday()]} {t:%d/%m %H:%M}",
+                        key='traffic_explained_dt',
+                    )
+                    attr_row = attributions.loc[explained_dt]
+                    contrib = contribution_table(attr_row)
+                    contrib['verso'] = np.where(contrib['contributo'] >= 0, 'aumenta', 'riduce')
+                    contrib_chart = alt.Chart(contrib).mark_bar().encode(
+                        x=alt.X('contributo:Q', title='Contributo (veicoli/ora)'),
+                        y=alt.Y('feature:N', sort=None, title=None),
+                        color=alt.Color('verso:N', scale=alt.Scale(domain=['aumenta', 'riduce'], range=['#FF4B4B', '#1f77b4']), legend=None),
+                        tooltip=['feature', alt.Tooltip('contributo:Q', format=',.0f')],
+                    )
+                    st.altair_chart(contrib_chart, width='stretch')
+                    st.caption(
+                        f"Valore base del modello {attr_row[BASE]:,.0f} + contributi {attr_row.drop(BASE).sum():+,.0f} "
+                        f"= {attr_row.sum():,.0f} veicoli/ora (prima dell'arrotondamento)"
+                    )
+
+    with st.expander("🩺 Salute del modello"):
+        health = model_bundle.get('diagnostics')
+        if health is None:
+            st.info("Diagnostica non disponibile per il modello attuale.")
+        elif health['n'] >= 3:
+            st.caption(f"Residui del modello sulle {health['n']:,} ore storiche fino al {health['last_date_time']:%d/%m/%Y %H:%M}")
+            hcol1, hcol2, hcol3, hcol4 = st.columns(4)
+            hcol1.metric("R²", f"{health['r2']:.3f}")
+            hcol2.metric("RMSE", f"{health['rmse']:.0f}")
+            hcol3.metric("MAE", f"{health['mae']:.0f}")
+            hcol4.metric("Curtosi in eccesso", f"{health['kurtosis']:.2f}")
+            if model_bundle.get('compiled') is not None:
+                checks = pd.DataFrame(health_checks(health), columns=['Assunzione', 'Indicatore', 'Valore', 'Esito', 'ok'])
+                checks['Esito'] = np.where(checks['ok'], '✅ ', '⚠️ ') + checks['Esito']
+                checks['Valore'] = checks['Valore'].map(lambda v: f"{v:.3g}")
+                st.dataframe(checks.drop(columns='ok'), hide_index=True, width='stretch')
+                st.caption("VIF delle feature numeriche: " + ", ".join(f"{col} {v:.2f}" for col, v in health['vif'].items()))
+            else:
+                mcol1, mcol2, mcol3 = st.columns(3)
+                mcol1.metric("Media dei residui", f"{health['resid_mean']:.1f}")
+                mcol2.metric("Dev. std dei residui", f"{health['resid_std']:.0f}")
+                mcol3.metric("Asimmetria", f"{health['skewness']:.2f}")
+                st.caption("Normalità, omoschedasticità, indipendenza e VIF (notebook 4) sono verifiche della "
+                           "regressione lineare: per un modello non lineare (es. Random Forest) si mostrano solo "
+                           "i momenti dei residui.")
+
+        # Backtest a origine mobile: climatologia e previsione ricorsiva dalle stesse origini
+        backtest = model_bundle.get('backtest')
+        if backtest is not None and backtest['hours']:
+            st.write("**Stima istantanea vs modello (backtest)**")
+            gcol1, gcol2, gcol3 = st.columns(3)
+            gcol1.metric("MAE climatologia", f"{backtest['mae_climatology']:.0f}")
+            gcol2.metric("MAE modello", f"{backtest['mae_model']:.0f}")
+            gcol3.metric("Guadagno del modello", f"{backtest['gap']:+.0f}", help="MAE climatologia − MAE modello (veicoli/ora)")
+            lead_long = backtest['by_lead'].drop(columns='origini').melt('lead', var_name='livello', value_name='mae')
+            lead_chart = alt.Chart(lead_long).mark_line().encode(
+                x=alt.X('lead:Q', title="Ore di anticipo"),
+                y=alt.Y('mae:Q', title='MAE (veicoli/ora)'),
+                color=alt.Color('livello:N', scale=alt.Scale(domain=['mae_climatologia', 'mae_modello'], range=['gray', '#FF4B4B']), title=None),
+                tooltip=['lead', 'livello', alt.Tooltip('mae:Q', format=',.0f')],
+            )
+            st.altair_chart(lead_chart, width='stretch')
+            first, last = pd.Timestamp(backtest['origins'][0]), pd.Timestamp(backtest['origins'][-1])
+            st.caption(f"Backtest su {len(backtest['origins'])} origini dal {first:%d/%m/%Y %H:%M} al {last:%d/%m/%Y %H:%M}, "
+                       f"{backtest['horizon']} ore ciascuna: per ogni origine la climatologia è ricostruita dallo storico "
+                       "precedente e il modello prevede in modo ricorsivo, con i lag presi dalle proprie predizioni "
+                       "come in ▶️ Genera previsioni.")
+            if backtest['in_sample']:
+                st.warning(f"Il modello è stato addestrato fino al {pd.Timestamp(backtest['train_end']):%d/%m/%Y %H:%M}, "
+                           "cioè su tutto lo storico: le origini cadono nell'ultimo anno e l'errore del modello è in-sample.")
+
     st.markdown("---")
     st.markdown("### 🔁 Fai una Previsione!")
 
@@ -532,22 +466,25 @@ if pipeline is not None:
     # --- PARTE 2: INPUT AVANZATI (LAG) ---
     st.markdown("---")
     
-    # Calcoliamo il valore suggerito in base all'ora scelta sopra
-    default_lag_val = float(estimate_background_lags(t_time.hour))
+    # Valori suggeriti: traffico tipico (climatologia) 1 ora, 1 giorno e 7 giorni prima dell'orario scelto
+    climatology = load_climatology()
+    manual_is_holiday = selected_holiday != 'Nessuna (Giorno normale)'
+    default_lags = (climatology.default_lags(datetime.combine(d_date, t_time), manual_is_holiday)
+                    if climatology is not None else (0.0, 0.0, 0.0))
     # Calcolo automatico weekend
     is_weekend_input = (d_date.weekday() >= 5)
 
     with st.expander("🛠️ Dati Storici Avanzati (Opzionale)"):
-        st.info("Questi valori sono stimati automaticamente in base all'ora scelta. Se conosci i dati reali del traffico precedente, puoi modificarli qui.")
+        st.info("Questi valori sono il traffico medio storico per ora, giorno, mese e festività nei momenti indicati. Se conosci i dati reali del traffico precedente, puoi modificarli qui.")
         col_lag1, col_lag2, col_lag3 = st.columns(3)
         
         with col_lag1:
             # Lag 1: Il valore di default cambia se l'utente cambia l'orario sopra
-            input_lag_1 = st.number_input("Traffico 1 ora fa", value=default_lag_val, step=100.0)
+            input_lag_1 = st.number_input("Traffico 1 ora fa", value=default_lags[0], step=100.0)
         with col_lag2:
-            input_lag_24 = st.number_input("Traffico Ieri (stessa ora)", value=default_lag_val, step=100.0)
+            input_lag_24 = st.number_input("Traffico Ieri (stessa ora)", value=default_lags[1], step=100.0)
         with col_lag3:
-            input_lag_168 = st.number_input("Traffico 7gg fa (stessa ora)", value=default_lag_val, step=100.0)
+            input_lag_168 = st.number_input("Traffico 7gg fa (stessa ora)", value=default_lags[2], step=100.0)
 
     # --- PARTE 3: BOTTONE E CALCOLO ---
     st.markdown("<br>", unsafe_allow_html=True)
@@ -555,7 +492,12 @@ if pipeline is not None:
     with col_btn_2:
         predict_btn = st.button("🔮 CALCOLA TRAFFICO")
 
+    # Dopo il primo calcolo il risultato resta visibile e si aggiorna da solo al cambio
+    # di orario/meteo: le 24 ore × condizioni meteo del giorno sono già in cache.
     if predict_btn:
+        st.session_state['manual_pred_active'] = True
+
+    if st.session_state.get('manual_pred_active'):
         dt = datetime.combine(d_date, t_time)
         
         # 1. Holiday: None se "Nessuna"
@@ -566,43 +508,39 @@ if pipeline is not None:
             
         # 2. Meteo
         w_data = weather_map[weather_ui]
-        
-        # 3. Costruzione Input (Usando i Lag manuali)
-        input_data = {
-            'holiday': [final_holiday],          
-            'temp': [float(temp_c)],             
-            'rain_1h': [float(rain)],
-            'snow_1h': [float(snow)],
-            'clouds_all': [float(clouds)],       
-            'weather_main': [w_data['main']],        # Es: "Clouds"
-            'weather_description': [w_data['desc']], # Es: "scattered clouds"
-            'hour': [float(dt.hour)],            
-            'day_of_week': [float(dt.weekday())],
-            'month': [float(dt.month)],
-            'year': [float(dt.year)],            
-            'is_weekend': [is_weekend_input],    # ora calcolato automaticamente
-            # QUI usiamo le variabili dell'expander
-            'lag_1': [float(input_lag_1)],
-            'lag_24': [float(input_lag_24)],
-            'lag_168': [float(input_lag_168)]
-        }
-
-        df = pd.DataFrame(input_data)
-        
-        # 4. Gestione Tipi (Anti-Crash)
-        df['holiday'] = df['holiday'].astype(object)
-        df['weather_main'] = df['weather_main'].astype(object)
-        df['weather_description'] = df['weather_description'].astype(object)
+
+        # 3. Lag: se l'utente li ha modificati valgono per tutte le ore, altrimenti stima per ora
+        user_lags = (float(input_lag_1), float(input_lag_24), float(input_lag_168))
+        lags_overridden = user_lags != tuple(default_lags)
+
+        def lags_for_hour(h):
+            if lags_overridden or h == dt.hour or climatology is None:
+                return user_lags
+            return climatology.default_lags(dt.replace(hour=h), manual_is_holiday)
+
+        # 4. Griglia del giorno (24 ore × meteo) predetta in un unico batch, solo per le righe non in cache
+        grid_rows = day_grid_rows(d_date, final_holiday, weather_map, temp_c, rain, snow, clouds, lags_for_hour)
+        selected_idx = list(weather_map).index(weather_ui) * 24 + dt.hour
+        df = features_to_frame([grid_rows[selected_idx]])
 
         try:
-            prediction = pipeline.predict(df)[0]
-            prediction = int(max(0, prediction))
+            with perf.section('manual.day_grid', cached=True, rows=len(grid_rows)) as sec:
+                cache = load_prediction_cache(model_version)
+                misses_before = cache.misses
+                grid_preds = cache.predict_rows(manual_predict_fn, grid_rows)
+                if cache.misses > misses_before:
+                    sec.cache = 'miss'
+            prediction = grid_preds[selected_idx]
 
             st.markdown("<br>", unsafe_allow_html=True)
             res_col1, res_col2 = st.columns([1, 1])
             
             with res_col1:
                 st.metric(label="Veicoli Previsti", value=prediction)
+                threshold_index = load_threshold_index()
+                if threshold_index is not None and threshold_index.count(hour=dt.hour):
+                    share = threshold_index.share_below(prediction, hour=dt.hour)
+                    st.caption(f"Superiore al {share:.0%} delle ore storiche alle {dt.hour:02d}:00")
             
             with res_col2:
                 st.write("### Livello Congestione")
@@ -616,6 +554,25 @@ if pipeline is not None:
                     st.error("🔴 Traffico Intenso")
                     st.progress(min(1.0, prediction / 7000))
 
+            # Curva dell'intera giornata con il meteo selezionato
+            day_start = selected_idx - dt.hour
+            day_curve = pd.DataFrame({
+                'Ora': list(range(24)),
+                'Veicoli previsti': grid_preds[day_start:day_start + 24],
+            })
+            base = alt.Chart(day_curve).encode(
+                x=alt.X('Ora:O', title='Ora del giorno'),
+                y=alt.Y('Veicoli previsti:Q', title='Veicoli previsti'),
+                tooltip=['Ora', 'Veicoli previsti'],
+            )
+            selected_point = alt.Chart(day_curve[day_curve['Ora'] == dt.hour]).mark_circle(size=120, color='#FF4B4B').encode(
+                x='Ora:O', y='Veicoli previsti:Q'
+            )
+            st.write(f"### Andamento previsto per il {d_date:%d/%m/%Y} ({weather_ui})")
+            st.altair_chart(base.mark_line(point=True, color='gray') + selected_point, width='stretch')
+
         except Exception as e:
             st.error(f"Errore tecnico: {e}")
-            st.write("Dati passati al modello:", df)
\ No newline at end of file
+            st.write("Dati passati al modello:", df)
+
+perf.end_run()
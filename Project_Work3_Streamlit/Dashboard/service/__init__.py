@@ -0,0 +1 @@
+"""Servizio di previsione headless con micro-batching (vedi `server.py`)."""
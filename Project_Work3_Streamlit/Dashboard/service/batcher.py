@@ -0,0 +1,107 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+
+class MicroBatcher:
+    """
+    Raggruppa le richieste di predict concorrenti in un'unica chiamata al modello.
+
+    Il primo elemento in coda apre una finestra di `max_wait_ms`: tutto ciò che arriva
+    entro la finestra (fino a `max_batch` righe) viene predetto insieme e i risultati
+    vengono restituiti ai singoli chiamanti tramite Future.
+
+    Se i chiamanti dichiarano le richieste in corso con `track()`, la finestra si chiude
+    in anticipo quando tutte le richieste in corso sono già nel batch: un client
+    isolato non paga l'attesa.
+    """
+
+    def __init__(self, model, max_wait_ms=5.0, max_batch=256):
+        self.model = model
+        self.max_wait = max_wait_ms / 1000
+        self.max_batch = max_batch
+        self._queue = queue.Queue()
+        self._stats_lock = threading.Lock()
+        self.batches = 0
+        self.rows = 0
+        self.requests = 0
+        self._inflight = 0
+        self._thread = threading.Thread(target=self._loop, name='micro-batcher', daemon=True)
+        self._thread.start()
+
+    def submit(self, X):
+        """Accoda un DataFrame di feature; restituisce un Future con l'array delle predizioni."""
+        fut = Future()
+        self._queue.put((X, fut))
+        return fut
+
+    @contextmanager
+    def track(self):
+        """Segna una richiesta in corso (che potrebbe chiamare submit a breve)."""
+        with self._stats_lock:
+            self._inflight += 1
+        try:
+            yield
+        finally:
+            with self._stats_lock:
+                self._inflight -= 1
+
+    def predict(self, X):
+        """Interfaccia compatibile con la pipeline sklearn (bloccante)."""
+        return self.submit(X).result()
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                'batches': self.batches,
+                'requests': self.requests,
+                'rows': self.rows,
+                'avg_batch_requests': self.requests / self.batches if self.batches else 0.0,
+                'max_wait_ms': self.max_wait * 1000,
+                'max_batch': self.max_batch,
+            }
+
+    def _collect(self):
+        items = [self._queue.get()]
+        n_rows = len(items[0][0])
+        deadline = time.perf_counter() + self.max_wait
+        while n_rows < self.max_batch:
+            if 0 < self._inflight <= len(items):
+                break
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            items.append(item)
+            n_rows += len(item[0])
+        return items
+
+    def _loop(self):
+        while True:
+            items = self._collect()
+            frames = [X for X, _ in items]
+            try:
+                X_all = frames[0] if len(frames) == 1 else pd.concat(frames, ignore_index=True)
+                y_all = np.asarray(self.model.predict(X_all))
+            except Exception as e:
+                for _, fut in items:
+                    fut.set_exception(e)
+                continue
+
+            offset = 0
+            for X, fut in items:
+                fut.set_result(y_all[offset:offset + len(X)])
+                offset += len(X)
+
+            with self._stats_lock:
+                self.batches += 1
+                self.requests += len(items)
+                self.rows += len(X_all)
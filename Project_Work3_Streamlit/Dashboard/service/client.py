@@ -0,0 +1,57 @@
+import json
+import urllib.error
+import urllib.request
+
+import pandas as pd
+
+from service.server import to_json
+
+
+class ForecastServiceError(RuntimeError):
+    """Errore restituito dal servizio (o servizio non raggiungibile)."""
+
+
+class ForecastClient:
+    """Client minimale (solo libreria standard) per `service.server`."""
+
+    def __init__(self, base_url, timeout=30.0):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+
+    def _request(self, path, payload=None):
+        data = None if payload is None else to_json(payload).encode('utf-8')
+        req = urllib.request.Request(self.base_url + path, data=data, headers={'Content-Type': 'application/json'})
+        try:
+            with urllib.request.urlopen(req, timeout=self.timeout) as resp:
+                return json.loads(resp.read())
+        except urllib.error.HTTPError as e:
+            try:
+                message = json.loads(e.read()).get('error', str(e))
+            except ValueError:
+                message = str(e)
+            raise ForecastServiceError(message) from e
+        except urllib.error.URLError as e:
+            raise ForecastServiceError(f'servizio non raggiungibile ({self.base_url}): {e.reason}') from e
+
+    def health(self):
+        return self._request('/health')
+
+    def predict(self, **inputs):
+        """Predizione di una riga; restituisce il volume previsto (int)."""
+        return self._request('/predict', inputs)['traffic_volume']
+
+    def predict_many(self, rows):
+        return [r['traffic_volume'] for r in self._request('/predict', list(rows))]
+
+    def forecast(self, hours, extra_rows=None):
+        """
+        Previsione ricorsiva dal termine dello storico del servizio (più `extra_rows`,
+        es. previsioni già generate). Restituisce (preds_df, rows_df).
+        """
+        out = self._request('/forecast', {'hours': int(hours), 'extra_rows': extra_rows})
+        preds = pd.DataFrame(out['predictions'])
+        rows = pd.DataFrame(out['rows'])
+        for frame in (preds, rows):
+            if not frame.empty:
+                frame['date_time'] = pd.to_datetime(frame['date_time'])
+        return preds, rows
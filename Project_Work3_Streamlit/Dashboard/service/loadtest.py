@@ -0,0 +1,113 @@
+"""
+Load test locale del servizio di previsione con N client concorrenti.
+
+Uso (dalla cartella Dashboard):
+    python -m service.loadtest --spawn --clients 1 8 32 64          # avvia un server in-process
+    python -m service.loadtest --url http://127.0.0.1:8765 --clients 16
+    python -m service.loadtest --spawn --max-wait-ms 0              # confronto senza micro-batching
+"""
+import argparse
+import random
+import threading
+import time
+
+import numpy as np
+
+from service.client import ForecastClient
+
+
+def _spawn_server(max_wait_ms, max_batch):
+    from benchmarks import fixtures
+    from service.server import ForecastService, make_server
+
+    service = ForecastService(fixtures.base_frame(), fixtures.fixture_pipeline(), max_wait_ms=max_wait_ms, max_batch=max_batch)
+    server = make_server(service, port=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_port}'
+
+
+def run_level(url, n_clients, requests_per_client, endpoint, timestamps, hours):
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+    start_barrier = threading.Barrier(n_clients)
+
+    def worker(seed):
+        client = ForecastClient(url)
+        rng = random.Random(seed)
+        start_barrier.wait()
+        for _ in range(requests_per_client):
+            t0 = time.perf_counter()
+            try:
+                if endpoint == 'forecast':
+                    client.forecast(hours)
+                else:
+                    client.predict(date_time=rng.choice(timestamps))
+            except Exception as e:
+                with lock:
+                    errors.append(str(e))
+                continue
+            with lock:
+                latencies.append((time.perf_counter() - t0) * 1000)
+
+    before = ForecastClient(url).health()['batching']
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(n_clients)]
+    t0 = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - t0
+    after = ForecastClient(url).health()['batching']
+
+    batches = after['batches'] - before['batches']
+    requests = after['requests'] - before['requests']
+    return {
+        'clients': n_clients,
+        'ok': len(latencies),
+        'errors': len(errors),
+        'throughput_rps': len(latencies) / elapsed if elapsed > 0 else 0.0,
+        'p50_ms': float(np.percentile(latencies, 50)) if latencies else float('nan'),
+        'p95_ms': float(np.percentile(latencies, 95)) if latencies else float('nan'),
+        'p99_ms': float(np.percentile(latencies, 99)) if latencies else float('nan'),
+        'avg_batch': requests / batches if batches else 0.0,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default=None, help='server già avviato')
+    parser.add_argument('--spawn', action='store_true', help='avvia un server in-process con le fixture dei benchmark')
+    parser.add_argument('--clients', type=int, nargs='+', default=[1, 4, 16, 64])
+    parser.add_argument('--requests', type=int, default=50, help='richieste per client')
+    parser.add_argument('--endpoint', choices=['predict', 'forecast'], default='predict')
+    parser.add_argument('--hours', type=int, default=24, help='orizzonte per --endpoint forecast')
+    parser.add_argument('--max-wait-ms', type=float, default=5.0, help='solo con --spawn')
+    parser.add_argument('--max-batch', type=int, default=256, help='solo con --spawn')
+    args = parser.parse_args(argv)
+
+    server = None
+    url = args.url
+    if args.spawn:
+        server, url = _spawn_server(args.max_wait_ms, args.max_batch)
+    if url is None:
+        parser.error('specificare --url oppure --spawn')
+
+    health = ForecastClient(url).health()
+    last = np.datetime64(health['last_date_time'])
+    # Timestamp realistici: ultime 4 settimane di storico e prossime 24 ore
+    timestamps = [str(last - np.timedelta64(h, 'h')) for h in range(-24, 24 * 28)]
+
+    print(f"{'client':>7} {'ok':>6} {'err':>4} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'batch medio':>12}")
+    try:
+        for n in args.clients:
+            r = run_level(url, n, args.requests, args.endpoint, timestamps, args.hours)
+            print(f"{r['clients']:>7} {r['ok']:>6} {r['errors']:>4} {r['throughput_rps']:>9.1f} "
+                  f"{r['p50_ms']:>9.2f} {r['p95_ms']:>9.2f} {r['p99_ms']:>9.2f} {r['avg_batch']:>12.2f}")
+    finally:
+        if server is not None:
+            server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,209 @@
+"""
+Servizio HTTP locale di previsione, indipendente da Streamlit.
+
+Uso (dalla cartella Dashboard):
+    python -m service.server --port 8765 [--data dataset/cleaned_data.csv] [--model models/rf_pipeline.pkl]
+
+Endpoint:
+    GET  /health    stato del servizio e statistiche del micro-batching
+    POST /predict   una riga (oggetto JSON) o più righe (lista): feature mancanti
+                    (festività, meteo, lag) ricavate dallo storico come nella dashboard
+    POST /forecast  {"hours": n, "extra_rows": [...]} previsione ricorsiva dalla fine dello storico
+
+Le chiamate al modello di tutte le richieste concorrenti passano per un MicroBatcher,
+che le raggruppa in un'unica predict entro pochi millisecondi.
+"""
+import argparse
+import json
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pandas as pd
+
+from core.climatology import Climatology
+from core.data import DATA_PATH, MODEL_PATH, load_cleaned_data, load_pipeline
+from core.events import holiday_days, holiday_on
+from core.forecast import build_feature_row, features_to_frame, iter_forecast, select_weather
+from core.time_grid import HourlyGrid
+from service.batcher import MicroBatcher
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+
+
+def _json_default(obj):
+    if hasattr(obj, 'isoformat'):
+        return obj.isoformat()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    raise TypeError(f'{type(obj).__name__} non serializzabile')
+
+
+def to_json(payload):
+    return json.dumps(payload, default=_json_default)
+
+
+class ForecastService:
+    """Storico + modello condivisi da tutte le richieste del server."""
+
+    def __init__(self, history, model, max_wait_ms=5.0, max_batch=256):
+        self.history = history.sort_values('date_time').reset_index(drop=True)
+        self.batcher = MicroBatcher(model, max_wait_ms=max_wait_ms, max_batch=max_batch)
+        # Indici costruiti una volta sola: griglia oraria per i lag e festività per giorno
+        self.times = self.history['date_time'].to_numpy()
+        self.grid = HourlyGrid.from_frame(self.history)
+        self.holidays = holiday_days(self.history)
+        # Lag fuori dallo storico: traffico tipico di quell'ora
+        self.climatology = Climatology.from_frame(self.history)
+
+    def _lag(self, payload, key, dt, hours):
+        if payload.get(key) is not None:
+            return float(payload[key])
+        value = self.grid.value_at(dt - pd.Timedelta(hours=hours))
+        if np.isnan(value):
+            value = self.climatology.predict_times([dt - pd.Timedelta(hours=hours)])[0]
+        return float(value)
+
+    def _recent(self, dt):
+        """Righe delle 12h precedenti a dt (ricerca binaria); tutto lo storico se vuote, per il fallback."""
+        lo = np.searchsorted(self.times, np.datetime64(dt - pd.Timedelta(hours=12)), side='right')
+        hi = np.searchsorted(self.times, np.datetime64(dt), side='left')
+        return self.history.iloc[lo:hi] if hi > lo else self.history
+
+    def build_features(self, payload):
+        """Riga di feature come `build_feature_row`; i campi assenti vengono stimati dallo storico."""
+        if 'date_time' not in payload:
+            raise ValueError("campo 'date_time' obbligatorio")
+        dt = pd.Timestamp(payload['date_time'])
+        holiday = payload['holiday'] if 'holiday' in payload else holiday_on(*self.holidays, dt)
+        wm, wd, temp, rain, snow, clouds = select_weather(self._recent(dt), dt)
+        return build_feature_row(
+            dt,
+            holiday,
+            dt.weekday() >= 5,
+            payload.get('weather_main', wm),
+            payload.get('weather_description', wd),
+            payload.get('temp', temp),
+            payload.get('rain_1h', rain),
+            payload.get('snow_1h', snow),
+            payload.get('clouds_all', clouds),
+            self._lag(payload, 'lag_1', dt, 1),
+            self._lag(payload, 'lag_24', dt, 24),
+            self._lag(payload, 'lag_168', dt, 168),
+        )
+
+    def predict(self, payloads):
+        with self.batcher.track():
+            rows = [self.build_features(p) for p in payloads]
+            y = self.batcher.submit(features_to_frame(rows)).result()
+        return [
+            {'date_time': row['date_time'], 'traffic_volume': int(max(0, yhat)), 'features': row}
+            for row, yhat in zip(rows, y)
+        ]
+
+    def forecast(self, hours, extra_rows=None):
+        working = self.history
+        if extra_rows:
+            extra = pd.DataFrame(extra_rows)
+            extra['date_time'] = pd.to_datetime(extra['date_time'])
+            working = pd.concat([working, extra], ignore_index=True, sort=False).sort_values('date_time').reset_index(drop=True)
+        start_dt = working['date_time'].max() + pd.Timedelta(hours=1)
+        preds, rows = [], []
+        with self.batcher.track():
+            for dt, yhat, row in iter_forecast(self.batcher, working, start_dt, hours):
+                preds.append({'date_time': dt, 'traffic_volume': yhat})
+                rows.append(row)
+        return {'predictions': preds, 'rows': rows}
+
+    def health(self):
+        return {
+            'status': 'ok',
+            'history_rows': len(self.history),
+            'last_date_time': self.history['date_time'].max(),
+            'batching': self.batcher.stats(),
+        }
+
+
+class ForecastRequestHandler(BaseHTTPRequestHandler):
+    service = None  # impostato da make_server
+
+    def _send(self, status, payload):
+        body = to_json(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/health':
+            self._send(200, self.service.health())
+        else:
+            self._send(404, {'error': f'percorso sconosciuto: {self.path}'})
+
+    def do_POST(self):
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            payload = json.loads(self.rfile.read(length) or b'{}')
+        except (ValueError, json.JSONDecodeError) as e:
+            self._send(400, {'error': f'JSON non valido: {e}'})
+            return
+
+        try:
+            if self.path == '/predict':
+                if isinstance(payload, list):
+                    self._send(200, self.service.predict(payload))
+                else:
+                    self._send(200, self.service.predict([payload])[0])
+            elif self.path == '/forecast':
+                hours = int(payload.get('hours', 1))
+                if not 1 <= hours <= 24 * 31:
+                    raise ValueError("'hours' deve essere compreso tra 1 e 744")
+                self._send(200, self.service.forecast(hours, payload.get('extra_rows')))
+            else:
+                self._send(404, {'error': f'percorso sconosciuto: {self.path}'})
+        except (ValueError, KeyError, TypeError) as e:
+            self._send(400, {'error': str(e)})
+        except Exception as e:
+            self._send(500, {'error': f'errore del modello: {e}'})
+
+    def log_message(self, format, *args):
+        # Niente log per richiesta: falserebbe i load test
+        pass
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    # Backlog ampio: con molti client concorrenti il default (5) rifiuta connessioni
+    request_queue_size = 256
+
+
+def make_server(service, host=DEFAULT_HOST, port=DEFAULT_PORT):
+    handler = type('Handler', (ForecastRequestHandler,), {'service': service})
+    return _Server((host, port), handler)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default=DEFAULT_HOST)
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--data', default=DATA_PATH)
+    parser.add_argument('--model', default=MODEL_PATH)
+    parser.add_argument('--max-wait-ms', type=float, default=5.0, help='finestra di raggruppamento delle richieste')
+    parser.add_argument('--max-batch', type=int, default=256, help='righe massime per predict')
+    args = parser.parse_args(argv)
+
+    service = ForecastService(load_cleaned_data(args.data), load_pipeline(args.model),
+                              max_wait_ms=args.max_wait_ms, max_batch=args.max_batch)
+    server = make_server(service, args.host, args.port)
+    print(f'Servizio previsioni su http://{args.host}:{server.server_port} ({len(service.history):,} righe di storico)')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
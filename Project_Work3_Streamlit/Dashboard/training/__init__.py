@@ -0,0 +1 @@
+"""Addestramento offline dei modelli usati dalla dashboard."""
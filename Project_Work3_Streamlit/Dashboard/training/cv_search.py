@@ -0,0 +1,285 @@
+"""
+Ricerca degli iperparametri con cross-validation temporale (finestre espandibili).
+
+Uso (dalla cartella Dashboard):
+    python -m training.cv_search [--data dataset/cleaned_data.csv] [--out models/rf_pipeline.pkl]
+                                 [--workers 4] [--folds 5] [--prune-margin 0.15] [--store feature_store]
+
+Come la GridSearchCV del notebook 5_ModelliAlbero, ma:
+  - il preprocessore di ogni fold viene addestrato una sola volta (solo sul train del fold)
+    e le matrici codificate sono salvate come .npy float32, lette in memory-map dai worker;
+  - le configurazioni sono valutate in parallelo in un pool di processi, un fold alla volta,
+    e quelle molto peggiori della migliore vengono scartate prima dei fold più costosi;
+  - la classifica finisce in un CSV e la configurazione migliore, riaddestrata su tutto
+    lo storico, viene salvata nel formato caricato dalla dashboard.
+"""
+import argparse
+import hashlib
+import itertools
+import json
+import os
+import pickle
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from sklearn.metrics import mean_absolute_error, mean_squared_error
+
+from core.data import DATA_PATH, MODEL_PATH, TARGET, load_cleaned_data
+from core.feature_store import open_feature_store
+from core.forecast import build_feature_row, features_to_frame
+from core.time_grid import add_lag_features
+from training.pipelines import MODEL_FACTORIES, make_pipeline, make_preprocessor
+
+CACHE_DIR = 'training_cache'
+LEADERBOARD_PATH = 'models/leaderboard.csv'
+
+# Griglie del notebook 5_ModelliAlbero (n_estimators=None non è valido per la Random Forest)
+DEFAULT_GRID = {
+    'DecisionTree': {'max_depth': list(range(2, 15)), 'min_samples_leaf': [1, 5, 10, 20]},
+    'RandomForest': {'max_depth': [50, 100, 200], 'n_estimators': [5, 10, 20]},
+}
+
+
+def expand_grid(grid):
+    """Lista di (nome_modello, parametri) per tutte le combinazioni della griglia."""
+    configs = []
+    for model_name, space in grid.items():
+        keys = list(space)
+        for values in itertools.product(*(space[k] for k in keys)):
+            configs.append((model_name, dict(zip(keys, values))))
+    return configs
+
+
+def expanding_folds(n_rows, n_splits=5):
+    """Fold a finestra espandibile (come TimeSeriesSplit): lista di (fine_train, fine_test)."""
+    test_size = n_rows // (n_splits + 1)
+    if test_size == 0:
+        raise ValueError(f'troppe poche righe ({n_rows}) per {n_splits} fold')
+    first = n_rows - n_splits * test_size
+    return [(first + i * test_size, first + (i + 1) * test_size) for i in range(n_splits)]
+
+
+def split_xy(df):
+    """Feature e target; l'ordine cronologico è necessario per i fold temporali."""
+    if 'date_time' in df.columns:
+        df = df.sort_values('date_time', kind='stable')
+    df = df.reset_index(drop=True)
+    return df.drop(columns=[TARGET]), df[TARGET].to_numpy(dtype=np.float32)
+
+
+def _data_key(X, y, n_splits):
+    h = hashlib.sha1()
+    h.update(pd.util.hash_pandas_object(X, index=False).to_numpy().tobytes())
+    h.update(y.tobytes())
+    h.update(str(n_splits).encode())
+    return h.hexdigest()[:16]
+
+
+def _write_folds(fold_dir, n_rows, n_splits, fold_arrays):
+    """Salva gli array di ogni fold (se non già in cache) e restituisce i percorsi per fold."""
+    folds = []
+    for i, (train_end, test_end) in enumerate(expanding_folds(n_rows, n_splits)):
+        paths = {name: os.path.join(fold_dir, f'fold{i}_{name}.npy') for name in ('X_train', 'y_train', 'X_test', 'y_test')}
+        if not all(os.path.exists(p) for p in paths.values()):
+            os.makedirs(fold_dir, exist_ok=True)
+            for name, arr in fold_arrays(train_end, test_end).items():
+                np.save(paths[name], np.ascontiguousarray(arr, dtype=np.float32))
+        folds.append(paths)
+    return folds
+
+
+def encode_folds(X, y, n_splits=5, cache_dir=CACHE_DIR):
+    """
+    Codifica ogni fold una sola volta e salva X/y di train e test come .npy float32.
+    Restituisce la lista dei percorsi per fold; se la cache esiste già viene riusata.
+    """
+    def fold_arrays(train_end, test_end):
+        pre = make_preprocessor()
+        return {
+            'X_train': pre.fit_transform(X.iloc[:train_end]),
+            'y_train': y[:train_end],
+            'X_test': pre.transform(X.iloc[train_end:test_end]),
+            'y_test': y[train_end:test_end],
+        }
+
+    return _write_folds(os.path.join(cache_dir, _data_key(X, y, n_splits)), len(X), n_splits, fold_arrays)
+
+
+def encode_store_folds(store, n_splits=5, cache_dir=CACHE_DIR):
+    """
+    Come `encode_folds`, ma partendo dal feature store (nessuna lettura del CSV né codifica di stringhe).
+    I codici vengono rinumerati sulle sole categorie presenti nel train del fold e le numeriche
+    standardizzate con media/deviazione del train: lo stesso risultato del preprocessore della pipeline.
+    """
+    n_cat = len(store.manifest['categorical'])
+
+    def fold_arrays(train_end, test_end):
+        train = np.array(store.X[:train_end], dtype=np.float32)
+        test = np.array(store.X[train_end:test_end], dtype=np.float32)
+        for j in range(n_cat):
+            present = np.unique(train[:, j])
+            lut = np.full(len(store.vocabularies[store.columns[j]]) + 1, -1, dtype=np.float32)
+            lut[present.astype(np.int64)] = np.arange(len(present), dtype=np.float32)
+            train[:, j] = lut[train[:, j].astype(np.int64)]
+            test[:, j] = lut[test[:, j].astype(np.int64)]
+        mean = train[:, n_cat:].mean(axis=0)
+        std = train[:, n_cat:].std(axis=0)
+        std[std == 0] = 1.0
+        train[:, n_cat:] = (train[:, n_cat:] - mean) / std
+        test[:, n_cat:] = (test[:, n_cat:] - mean) / std
+        return {'X_train': train, 'y_train': store.y[:train_end], 'X_test': test, 'y_test': store.y[train_end:test_end]}
+
+    key = f"store_{store.manifest['source_sha1'][:12]}_{n_splits}"
+    return _write_folds(os.path.join(cache_dir, key), len(store), n_splits, fold_arrays)
+
+
+def _fit_and_score(task):
+    """Eseguito nei worker: addestra una configurazione su un fold e restituisce le metriche."""
+    model_name, params, paths = task
+    X_train = np.load(paths['X_train'], mmap_mode='r')
+    y_train = np.load(paths['y_train'], mmap_mode='r')
+    X_test = np.load(paths['X_test'], mmap_mode='r')
+    y_test = np.load(paths['y_test'], mmap_mode='r')
+
+    t0 = time.perf_counter()
+    model = MODEL_FACTORIES[model_name](**params)
+    model.fit(X_train, y_train)
+    fit_s = time.perf_counter() - t0
+    pred = model.predict(X_test)
+    return {
+        'mae': float(mean_absolute_error(y_test, pred)),
+        'rmse': float(np.sqrt(mean_squared_error(y_test, pred))),
+        'fit_s': fit_s,
+    }
+
+
+def search(folds, configs, workers=None, prune_margin=0.15, min_folds=2, log=print):
+    """
+    Valuta le configurazioni un fold alla volta (dal più piccolo al più grande).
+    Dopo `min_folds` fold, quelle con MAE medio oltre (1 + prune_margin) volte il migliore
+    vengono scartate. Restituisce la classifica come DataFrame (migliori in alto).
+    """
+    results = [{'model': m, 'params': p, 'scores': [], 'pruned_at': None} for m, p in configs]
+    alive = list(range(len(results)))
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for k, paths in enumerate(folds):
+            tasks = [(results[i]['model'], results[i]['params'], paths) for i in alive]
+            for i, score in zip(alive, pool.map(_fit_and_score, tasks)):
+                results[i]['scores'].append(score)
+
+            if k + 1 >= min_folds and k + 1 < len(folds):
+                mean_mae = {i: np.mean([s['mae'] for s in results[i]['scores']]) for i in alive}
+                cutoff = min(mean_mae.values()) * (1 + prune_margin)
+                for i in alive:
+                    if mean_mae[i] > cutoff:
+                        results[i]['pruned_at'] = k + 1
+                alive = [i for i in alive if results[i]['pruned_at'] is None]
+            log(f'fold {k + 1}/{len(folds)}: {len(tasks)} configurazioni valutate, {len(alive)} rimaste')
+
+    rows = []
+    for r in results:
+        maes = [s['mae'] for s in r['scores']]
+        rows.append({
+            'model': r['model'],
+            'params': json.dumps(r['params'], sort_keys=True),
+            'folds': len(r['scores']),
+            'mae_mean': np.mean(maes),
+            'mae_std': np.std(maes),
+            'rmse_mean': np.mean([s['rmse'] for s in r['scores']]),
+            'fit_s': sum(s['fit_s'] for s in r['scores']),
+            'status': 'completa' if r['pruned_at'] is None else f"scartata al fold {r['pruned_at']}",
+        })
+    board = pd.DataFrame(rows)
+    # Prima le configurazioni valutate su tutti i fold, poi per MAE
+    return board.sort_values(['folds', 'mae_mean'], ascending=[False, True]).reset_index(drop=True)
+
+
+def check_dashboard_rows(pipe, X, n_rows=24):
+    """
+    Verifica che la pipeline accetti le righe costruite dalla dashboard (build_feature_row +
+    features_to_frame, con hour/month/day_of_week float) per le ultime `n_rows` ore di X.
+    """
+    rows = []
+    for r in X.tail(n_rows).to_dict('records'):
+        holiday = r['holiday'] if str(r['holiday']).lower() not in ('none', 'nan') else None
+        rows.append(build_feature_row(pd.Timestamp(r['date_time']), holiday, r['is_weekend'], r['weather_main'],
+                                      r['weather_description'], r['temp'], r['rain_1h'], r['snow_1h'],
+                                      r['clouds_all'], r['lag_1'], r['lag_24'], r['lag_168']))
+    pred = pipe.predict(features_to_frame(rows))
+    if not np.all(np.isfinite(pred)):
+        raise ValueError('la pipeline restituisce predizioni non finite sulle righe della dashboard')
+
+
+def refit_best(X, y, board, out_path=MODEL_PATH):
+    """Riaddestra la configurazione migliore su tutto lo storico e la salva con pickle (se accetta le righe della dashboard)."""
+    best = board.iloc[0]
+    pipe = make_pipeline(best['model'], json.loads(best['params']))
+    pipe.fit(X, y)
+    check_dashboard_rows(pipe, X)
+    out_dir = os.path.dirname(out_path)
+    if out_dir:
+        os.makedirs(out_dir, exist_ok=True)
+    tmp = out_path + '.tmp'
+    with open(tmp, 'wb') as f:
+        pickle.dump(pipe, f)
+    os.replace(tmp, out_path)
+    return pipe
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--data', default=DATA_PATH)
+    parser.add_argument('--out', default=MODEL_PATH, help='pipeline migliore (formato della dashboard)')
+    parser.add_argument('--leaderboard', default=LEADERBOARD_PATH)
+    parser.add_argument('--cache-dir', default=CACHE_DIR, help='fold codificati (.npy)')
+    parser.add_argument('--folds', type=int, default=5)
+    parser.add_argument('--workers', type=int, default=None, help='processi (default: numero di CPU)')
+    parser.add_argument('--prune-margin', type=float, default=0.15)
+    parser.add_argument('--models', nargs='+', choices=list(DEFAULT_GRID), default=list(DEFAULT_GRID))
+    parser.add_argument('--no-refit', action='store_true', help='scrive solo la classifica')
+    parser.add_argument('--gap-aware-lags', action='store_true',
+                        help='ricalcola lag_1/24/168 sulla griglia oraria e scarta le righe dopo i buchi')
+    parser.add_argument('--store', default=None,
+                        help='usa il feature store (ricostruito da --data se mancante o non aggiornato)')
+    args = parser.parse_args(argv)
+    if args.store and args.gap_aware_lags:
+        parser.error('--gap-aware-lags non è disponibile con --store (lo store usa i lag del CSV)')
+
+    t0 = time.perf_counter()
+    if args.store:
+        store = open_feature_store(args.store, args.data)
+        folds = encode_store_folds(store, args.folds, args.cache_dir)
+        n_rows = len(store)
+    else:
+        df = load_cleaned_data(args.data)
+        if args.gap_aware_lags:
+            # Solo lag_1/24/168: sono le uniche feature di lag che la dashboard costruisce in previsione
+            df = add_lag_features(df, rolling=(), drop_invalid=True).drop(columns=['lags_valid'])
+        X, y = split_xy(df)
+        folds = encode_folds(X, y, args.folds, args.cache_dir)
+        n_rows = len(X)
+    print(f'{len(folds)} fold codificati in {time.perf_counter() - t0:.1f}s ({n_rows:,} righe)')
+
+    configs = expand_grid({m: DEFAULT_GRID[m] for m in args.models})
+    t0 = time.perf_counter()
+    board = search(folds, configs, workers=args.workers, prune_margin=args.prune_margin)
+    print(f'Ricerca completata in {time.perf_counter() - t0:.1f}s')
+
+    lb_dir = os.path.dirname(args.leaderboard)
+    if lb_dir:
+        os.makedirs(lb_dir, exist_ok=True)
+    board.to_csv(args.leaderboard, index=False)
+    print(board.head(10).to_string(index=False))
+
+    if not args.no_refit:
+        if args.store:
+            X, y = store.to_frame(), np.asarray(store.y)
+        refit_best(X, y, board, args.out)
+        print(f"Pipeline migliore ({board.iloc[0]['model']} {board.iloc[0]['params']}) salvata in {args.out}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,160 @@
+"""
+Aggiornamento incrementale del modello quando arrivano nuove ore di dati.
+
+Uso (dalla cartella Dashboard):
+    python -m training.online [--data dataset/cleaned_data.csv] [--model models/rf_pipeline.pkl]
+                              [--window-days 365] [--new-trees 5]
+
+Invece di riaddestrare da zero su tutto lo storico:
+  - Random Forest: vengono aggiunti alcuni alberi (warm start) addestrati sulla finestra
+    recente e ritirati altrettanti alberi più vecchi, così la foresta mantiene la sua dimensione;
+  - modelli lineari (Ridge del notebook 3_RegressoreLineare): il regressore viene convertito in
+    un SGDRegressor inizializzato con gli stessi coefficienti e aggiornato con partial_fit
+    sulle sole ore nuove.
+Le ore nuove vengono anche valutate dal rilevatore di anomalie (core/anomaly.py), un'ora alla
+volta rispetto al profilo (ora, giorno) dello storico precedente.
+Il preprocessore addestrato resta invariato. Il pickle viene sostituito in modo atomico:
+la dashboard se ne accorge e prepara in background il modello aggiornato (core/refresh.py).
+"""
+import argparse
+import json
+import os
+import pickle
+import time
+import warnings
+
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import RandomForestRegressor
+from sklearn.exceptions import ConvergenceWarning
+from sklearn.linear_model import SGDRegressor
+
+from core.anomaly import anomaly_events, score_new_hours
+from core.data import DATA_PATH, MODEL_PATH, TARGET, load_cleaned_data, load_pipeline
+
+
+def state_path(model_path):
+    """File JSON accanto al modello con l'ultima ora già usata per l'aggiornamento."""
+    return model_path + '.online.json'
+
+
+def load_state(model_path):
+    try:
+        with open(state_path(model_path), encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def save_pipeline(pipeline, model_path, state):
+    """Scrive modello e stato in modo atomico (chi legge vede sempre un file completo)."""
+    tmp = model_path + '.tmp'
+    with open(tmp, 'wb') as f:
+        pickle.dump(pipeline, f)
+    os.replace(tmp, model_path)
+    tmp = state_path(model_path) + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp, state_path(model_path))
+
+
+def update_forest(model, X, y, new_trees=5, max_trees=None):
+    """
+    Warm start: addestra `new_trees` alberi su (X, y) e li aggiunge alla foresta,
+    poi ritira i più vecchi oltre `max_trees` (default: dimensione attuale della foresta).
+    """
+    max_trees = max_trees or len(model.estimators_)
+    model.set_params(warm_start=True, n_estimators=len(model.estimators_) + new_trees)
+    # Seed diverso a ogni aggiornamento, altrimenti i nuovi alberi ripetono il bootstrap precedente
+    model.set_params(random_state=(model.random_state or 0) + len(model.estimators_))
+    model.fit(X, y)
+    if len(model.estimators_) > max_trees:
+        model.estimators_ = model.estimators_[-max_trees:]
+    model.set_params(n_estimators=len(model.estimators_), warm_start=False)
+    return model
+
+
+def update_linear(model, X, y, eta0=1e-3):
+    """
+    Aggiornamento SGD di un modello lineare. Un Ridge/LinearRegression viene prima convertito
+    in SGDRegressor con gli stessi coefficienti, così si parte dal modello addestrato.
+    """
+    if not isinstance(model, SGDRegressor):
+        sgd = SGDRegressor(alpha=1e-6, learning_rate='constant', eta0=eta0, max_iter=1, tol=None, random_state=0)
+        with warnings.catch_warnings():
+            # Una sola epoca sulle righe nuove: l'avviso di mancata convergenza è atteso
+            warnings.simplefilter('ignore', ConvergenceWarning)
+            return sgd.fit(X, y, coef_init=np.ravel(model.coef_), intercept_init=np.ravel(model.intercept_))
+    model.partial_fit(X, y)
+    return model
+
+
+def update_pipeline(pipeline, new_rows, window_rows=None, new_trees=5, max_trees=None):
+    """
+    Aggiorna la pipeline con le nuove righe. Per le foreste i nuovi alberi usano `window_rows`
+    (finestra recente, che include le nuove righe); i modelli lineari usano solo `new_rows`.
+    Restituisce la pipeline aggiornata (lo stesso oggetto, con l'ultimo step eventualmente sostituito).
+    """
+    pre = pipeline.named_steps['preprocessor']
+    name, model = pipeline.steps[-1]
+    if isinstance(model, RandomForestRegressor):
+        train = window_rows if window_rows is not None else new_rows
+        update_forest(model, pre.transform(train.drop(columns=[TARGET])), train[TARGET].to_numpy(), new_trees, max_trees)
+    elif hasattr(model, 'coef_'):
+        X = pre.transform(new_rows.drop(columns=[TARGET]))
+        pipeline.steps[-1] = (name, update_linear(model, X, new_rows[TARGET].to_numpy(dtype=float)))
+    else:
+        raise ValueError(f'{type(model).__name__} non supporta l\'aggiornamento incrementale')
+    return pipeline
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--data', default=DATA_PATH)
+    parser.add_argument('--model', default=MODEL_PATH)
+    parser.add_argument('--since', default=None, help="prima ora nuova (default: dopo l'ultimo aggiornamento)")
+    # Con un anno intero i nuovi alberi vedono tutte le stagioni (~0.3s per 5 alberi)
+    parser.add_argument('--window-days', type=int, default=365, help='finestra recente per i nuovi alberi')
+    parser.add_argument('--new-trees', type=int, default=5)
+    parser.add_argument('--max-trees', type=int, default=None, help='alberi massimi (default: dimensione attuale)')
+    args = parser.parse_args(argv)
+
+    df = load_cleaned_data(args.data).sort_values('date_time').reset_index(drop=True)
+    state = load_state(args.model)
+    since = args.since or state.get('last_date_time')
+    if since is None:
+        print("Nessun aggiornamento precedente: indicare --since con la prima ora da usare")
+        return 1
+    since = pd.Timestamp(since)
+    new_rows = df[df['date_time'] > since] if args.since is None else df[df['date_time'] >= since]
+    if new_rows.empty:
+        print(f'Nessuna ora nuova dopo {since}')
+        return 0
+    last_dt = df['date_time'].max()
+    window = df[df['date_time'] > last_dt - pd.Timedelta(days=args.window_days)]
+
+    # Anomalie tra le ore in arrivo: aggiornamento O(1) per ora a partire dallo storico precedente
+    scores = score_new_hours(df[df['date_time'] < new_rows['date_time'].min()], new_rows)
+    events = anomaly_events(scores)
+    print(f"{int(scores['anomala'].sum())} ore anomale su {len(scores):,} ore nuove ({len(events)} eventi)")
+    if not events.empty:
+        print(events.to_string(index=False))
+
+    t0 = time.perf_counter()
+    pipeline = update_pipeline(load_pipeline(args.model), new_rows.drop(columns=['date_time']),
+                               window.drop(columns=['date_time']), args.new_trees, args.max_trees)
+    elapsed = time.perf_counter() - t0
+
+    save_pipeline(pipeline, args.model, {
+        'last_date_time': last_dt.isoformat(),
+        'updated': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'new_rows': len(new_rows),
+        'anomalous_hours': int(scores['anomala'].sum()),
+        'updates': state.get('updates', 0) + 1,
+    })
+    print(f'Modello aggiornato con {len(new_rows):,} ore nuove in {elapsed:.2f}s -> {args.model}')
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,36 @@
+from sklearn.compose import ColumnTransformer
+from sklearn.ensemble import RandomForestRegressor
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import OrdinalEncoder, StandardScaler
+from sklearn.tree import DecisionTreeRegressor
+
+from core.data import CATEGORICAL_FEATURES, NUMERIC_FEATURES
+
+# Modelli ad albero confrontati nel notebook 5_ModelliAlbero
+MODEL_FACTORIES = {
+    'DecisionTree': lambda **params: DecisionTreeRegressor(random_state=0, **params),
+    'RandomForest': lambda **params: RandomForestRegressor(random_state=0, n_jobs=1, **params),
+}
+
+
+def make_preprocessor():
+    """Stesso preprocessore del notebook 5_ModelliAlbero (OrdinalEncoder + StandardScaler)."""
+    ordinal_encoder = OrdinalEncoder(
+        handle_unknown='use_encoded_value',
+        unknown_value=-1                   # Assegna il valore -1 alle categorie sconosciute
+    )
+    return ColumnTransformer(
+        transformers=[
+            ('ord_enc', ordinal_encoder, CATEGORICAL_FEATURES),
+            ('scaler', StandardScaler(), NUMERIC_FEATURES)
+        ],
+        remainder='drop'
+    )
+
+
+def make_pipeline(model_name, params):
+    """Pipeline nel formato caricato dalla dashboard (models/rf_pipeline.pkl)."""
+    return Pipeline([
+        ('preprocessor', make_preprocessor()),
+        ('model', MODEL_FACTORIES[model_name](**params))
+    ])